@@ -15,8 +15,16 @@ fi
 echo "Loading pgsql helper tools"
 source /srv/softwareheritage/utils/pgsql.sh
 
+# wait for services of the stack (see readiness.py graph) or probe specs
+# (tcp:host:port, pg:service, kafka, http://...) to be ready
+wait_ready () {
+    python3 /srv/softwareheritage/utils/readiness.py wait "$@"
+}
+
 if [ -v SWH_CONFIG_FILENAME ]; then
-    python3 /srv/softwareheritage/utils/init_pathslicer_root.py --init
+    # set PATHSLICER_PREFILL to create the whole slice tree of pathslicing
+    # objstorages upfront instead of on the write path
+    python3 /srv/softwareheritage/utils/init_pathslicer_root.py --init ${PATHSLICER_PREFILL:+--prefill}
 fi
 
 # fill .pg_services.conf and .pgpass from PGCFG_n config entries
@@ -71,11 +79,7 @@ case "$1" in
         # pretty, but will do for now
         if [ "$1" == "storage" ] && [ -v CASSANDRA_SEEDS ]; then
           echo Waiting for Cassandra to start
-          IFS=','
-          for CASSANDRA_SEED in ${CASSANDRA_SEEDS}; do
-              echo "   $CASSANDRA_SEED..."
-              wait-for-it ${CASSANDRA_SEED}:9042 -s --timeout=0
-          done
+          wait_ready $(echo ${CASSANDRA_SEEDS} | tr ',' '\n' | sed 's/.*/tcp:&:9042/')
           echo Creating keyspace
           swh storage cassandra init
         fi
@@ -83,7 +87,7 @@ case "$1" in
         if [ "$1" == "search" ]; then
             ES_HOST=`yq '.search.hosts[0]' $SWH_CONFIG_FILENAME | sed -E -s 's|https?://||'`
             echo Waiting for elasticsearch host $ES_HOST
-            wait-for-it $ES_HOST -s --timeout=0
+            wait_ready tcp:$ES_HOST
         fi
 
         if [ "$1" == "objstorage" ]; then
@@ -91,14 +95,14 @@ case "$1" in
             if [ "$backend" == "winery" ]; then
                 echo Custom db initialisation for winery
                 wait_pgsql
-                swh db init-admin -d service=$POSTGRES_DB objstorage:winery
-                swh db init -d service=$POSTGRES_DB objstorage:winery
-                swh db upgrade --non-interactive -d service=$POSTGRES_DB objstorage:winery
+                python3 /srv/softwareheritage/utils/setup_db.py \
+                        -d service=$POSTGRES_DB objstorage:winery
             fi
         fi
 
         echo "Starting the SWH $1 RPC server"
         exec python3 -m gunicorn \
+             --config /etc/gunicorn/swh.cfg \
              --bind 0.0.0.0:${PORT:-5000} \
              --bind unix:/var/run/gunicorn/swh/$1.sock \
              --threads ${GUNICORN_THREADS:-4} \
@@ -107,40 +111,114 @@ case "$1" in
              --timeout ${GUNICORN_TIMEOUT:-3600} \
              --statsd-host=prometheus-statsd-exporter:9125 \
              --statsd-prefix=service.app.$1  \
-             "swh.$1.api.server:make_app_from_configfile()"
+             --pythonpath /srv/softwareheritage/utils \
+             "${RPC_APP:-swh.$1.api.server:make_app_from_configfile()}"
         ;;
 
     "scheduler")
         shift
         wait_pgsql
 
-        wait-for-it scheduler:5008 -s --timeout=0
+        wait_ready scheduler amqp
 
         echo "Register task types"
         swh scheduler task-type register
 
         echo "Starting the swh-scheduler $1"
-        exec wait-for-it amqp:5672 -s --timeout=0 -- \
-             swh scheduler -C ${SWH_CONFIG_FILENAME} $@
+        exec swh scheduler -C ${SWH_CONFIG_FILENAME} $@
         ;;
 
     "graph-replayer")
         shift
-        wait-for-it storage:5002
+        wait_ready storage kafka
         echo "Starting the SWH mirror graph replayer"
-        exec swh storage replay $@
+        exec python3 /srv/softwareheritage/utils/replication_freshness.py \
+             storage replay $@
         ;;
 
     "content-replayer")
         shift
-        wait-for-it objstorage:5003
+        wait_ready objstorage kafka
         echo "Starting the SWH mirror content replayer"
-        exec swh objstorage replay $@
+        exec python3 /srv/softwareheritage/utils/presence_filter.py run $@
+        ;;
+
+    "presence-filter")
+        shift
+        echo "Running the SWH content replayer presence filter tool"
+        exec python3 /srv/softwareheritage/utils/presence_filter.py $@
+        ;;
+
+    "search-backfill")
+        shift
+        wait_ready search kafka
+        echo "Starting the SWH search backfill"
+        exec python3 /srv/softwareheritage/utils/search_backfill.py $@
+        ;;
+
+    "download-bench")
+        shift
+        wait_ready vault
+        echo "Starting the SWH vault download benchmark"
+        exec python3 /srv/softwareheritage/utils/download_bench.py $@
+        ;;
+
+    "replay-errors")
+        shift
+        wait_ready redis
+        echo "Replaying the objects reported by the SWH mirror replayers"
+        exec python3 /srv/softwareheritage/utils/replay_errors.py $@
+        ;;
+
+    "replication-lag-monitor")
+        shift
+        echo "Starting the SWH mirror replication lag monitor"
+        exec python3 /srv/softwareheritage/utils/replication_lag.py $@
+        ;;
+
+    "replayer-autoscaler")
+        shift
+        wait_ready tcp:prometheus:9090
+        echo "Starting the SWH replayer autoscaler"
+        exec python3 /srv/softwareheritage/utils/replayer_autoscaler.py $@
+        ;;
+
+    "mirror-verify")
+        shift
+        wait_ready storage-public
+        echo "Starting the SWH mirror verifier"
+        exec python3 /srv/softwareheritage/utils/mirror_verify.py $@
+        ;;
+
+    "replayer-bench")
+        shift
+        echo "Starting the SWH replayer benchmark"
+        exec python3 /srv/softwareheritage/utils/replayer_bench.py $@
+        ;;
+
+    "pathslicer-to-winery")
+        shift
+        wait_pgsql
+        echo "Starting the SWH pathslicing to winery objstorage migration"
+        exec python3 /srv/softwareheritage/utils/pathslicer_to_winery.py $@
+        ;;
+
+    "initial-load")
+        shift
+        wait_pgsql
+        echo "Starting the SWH mirror storage initial load mode"
+        exec python3 /srv/softwareheritage/utils/initial_load.py $@
+        ;;
+
+    "vault-load")
+        shift
+        echo "Starting the SWH vault load generator"
+        exec python3 /srv/softwareheritage/utils/vault_load.py $@
         ;;
 
     "search-indexer")
         shift
-        wait-for-it search:5010
+        wait_ready search kafka
         echo "Starting the SWH search indexer"
         exec swh search -C ${SWH_CONFIG_FILENAME} \
              journal-client objects $@
@@ -154,7 +232,7 @@ case "$1" in
     "winery")
         shift
         wait_pgsql
-        wait-for-it objstorage:5003
+        wait_ready objstorage
         exec swh objstorage winery $@
         ;;
 
@@ -204,7 +282,7 @@ if not User.objects.filter(username = username).exists():
         shift
         CFGNAME="${OBJTYPE}_${NBITS}"
 
-        wait-for-it storage:5002
+        wait_ready storage
         if [ -v POSTGRES_DB ]; then
             swh_setup_db scrubber
 
@@ -213,7 +291,7 @@ if not User.objects.filter(username = username).exists():
         fi
 
         echo "Starting a SWH storage scrubber ${CFGNAME}"
-        exec swh scrubber check storage ${CFGNAME} $@
+        exec python3 /srv/softwareheritage/utils/scrubber_scheduler.py run ${CFGNAME} $@
         ;;
 
     *)
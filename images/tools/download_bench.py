@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# benchmark of the downloads of cooked vault bundles: fetched through the
+# vault RPC workers, sent by nginx on the signed download links of the vault
+# (see vault_cache.py), or downloaded from the vault endpoint of swh-web (as
+# users do), reporting the throughput and the occupancy of the vault or web
+# workers
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import urljoin
+
+import click
+import requests
+from swh.model.swhids import CoreSWHID
+from swh.vault import get_vault
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.downloads = 0
+        self.bytes = 0
+        # time spent by the vault or web workers on the downloads
+        self.worker_time = 0.0
+
+    def add(self, size: int, worker_time: float) -> None:
+        with self.lock:
+            self.downloads += 1
+            self.bytes += size
+            self.worker_time += worker_time
+
+
+def fetch(vault, session, base_url: str, bundle_type: str, swhid) -> Tuple[int, float]:
+    """Fetch a bundle through the vault RPC server, which is busy meanwhile"""
+    t0 = time.monotonic()
+    size = len(vault.fetch(bundle_type, swhid))
+    return size, time.monotonic() - t0
+
+
+def nginx(vault, session, base_url: str, bundle_type: str, swhid) -> Tuple[int, float]:
+    """Download a bundle from nginx; the vault RPC server is only busy
+    signing the link"""
+    t0 = time.monotonic()
+    url = vault.download_url(
+        bundle_type, swhid, content_disposition='attachment; filename="bench"'
+    )
+    worker_time = time.monotonic() - t0
+    if url is None:
+        raise click.ClickException("The vault does not provide download links")
+    size = 0
+    with session.get(urljoin(base_url, url), stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+    return size, worker_time
+
+
+def web(vault, session, base_url: str, bundle_type: str, swhid) -> Tuple[int, float]:
+    """Download a bundle from the vault endpoint of swh-web, the workers of
+    which are busy until they have sent it, or the redirection to its
+    download link (then followed, to nginx)"""
+    t0 = time.monotonic()
+    url = urljoin(base_url, f"api/1/vault/{bundle_type.replace('_', '-')}/{swhid}/raw/")
+    size = 0
+    with session.get(url, stream=True, allow_redirects=False) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+        location = response.headers["Location"] if response.is_redirect else None
+    worker_time = time.monotonic() - t0
+    if location is not None:
+        size = 0
+        with session.get(urljoin(url, location), stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+    return size, worker_time
+
+
+# mode -> (download function, workers it keeps busy)
+MODES: Dict[str, Tuple[Callable, str]] = {
+    "fetch": (fetch, "vault"),
+    "nginx": (nginx, "vault"),
+    "web": (web, "web"),
+}
+
+
+def run_mode(
+    download: Callable,
+    vault,
+    base_url: str,
+    bundles: List[Tuple[str, CoreSWHID]],
+    concurrency: int,
+    duration: float,
+) -> Tuple[Stats, float]:
+    stats = Stats()
+    t0 = time.monotonic()
+    deadline = t0 + duration
+
+    def worker(offset: int) -> None:
+        session = requests.Session()
+        i = offset
+        while time.monotonic() < deadline:
+            bundle_type, swhid = bundles[i % len(bundles)]
+            stats.add(*download(vault, session, base_url, bundle_type, swhid))
+            i += 1
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for future in [pool.submit(worker, i) for i in range(concurrency)]:
+            future.result()
+    return stats, time.monotonic() - t0
+
+
+@click.command()
+@click.option(
+    "--vault-url",
+    default="http://vault:5005/",
+    show_default=True,
+    help="URL of the vault RPC server",
+)
+@click.option(
+    "--base-url",
+    default="http://nginx:5081/",
+    show_default=True,
+    help="URL of swh-web, the (relative) download links are resolved against",
+)
+@click.option("--bundle-type", default="flat", show_default=True, help="Of the SWHIDs")
+@click.option("--concurrency", "-c", default=8, show_default=True)
+@click.option("--duration", default=60.0, show_default=True, help="Per mode")
+@click.option(
+    "--workers",
+    default=16,
+    show_default=True,
+    help="Number of workers of the vault RPC server",
+)
+@click.option(
+    "--web-workers",
+    default=16,
+    show_default=True,
+    help="Number of workers of swh-web",
+)
+@click.option(
+    "--mode",
+    "modes",
+    type=click.Choice(list(MODES)),
+    multiple=True,
+    default=list(MODES),
+    show_default=True,
+)
+@click.argument("swhids", nargs=-1, required=True)
+def main(
+    vault_url,
+    base_url,
+    bundle_type,
+    concurrency,
+    duration,
+    workers,
+    web_workers,
+    modes,
+    swhids,
+):
+    """Download the (already cooked) bundles of SWHIDS in a loop, in each mode,
+    and report the throughput and the occupancy of the vault workers (or of
+    the web workers, for the web mode)
+
+    Run the web mode before and after enabling the nginx_download section of
+    conf/vault.yml to compare the occupancy of the web workers.
+    """
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    vault = get_vault(cls="remote", url=vault_url)
+    bundles = [(bundle_type, CoreSWHID.from_string(swhid)) for swhid in swhids]
+    nb_workers = {"vault": workers, "web": web_workers}
+    for mode in modes:
+        logger.info("Downloading %s bundles for %ss", mode, duration)
+        download, busy = MODES[mode]
+        stats, elapsed = run_mode(
+            download, vault, base_url, bundles, concurrency, duration
+        )
+        occupancy = stats.worker_time / elapsed / nb_workers[busy]
+        click.echo(
+            f"{mode}: {stats.downloads} downloads, "
+            f"{stats.bytes / elapsed / 2**20:.1f} MB/s, "
+            f"{stats.downloads / elapsed:.1f} downloads/s, "
+            f"{busy} workers occupancy {occupancy:.1%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# level-by-level walker of the graph reachable from a set of origins, used to
+# compute per-origin object counts on a mirror (see tests/ and mirror_verify.py)
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import logging
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from swh.model.model import ReleaseTargetType, SnapshotBranch, SnapshotTargetType
+from swh.storage.algos.origin import iter_origin_visit_statuses, iter_origin_visits
+from swh.storage.algos.snapshot import snapshot_get_all_branches
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_WORKERS = 10
+# max number of nodes kept in memory, per object type
+DEFAULT_MAX_NODES = 5_000_000
+
+T = TypeVar("T")
+Node = TypeVar("Node")
+
+# revision id -> (directory, parents)
+RevisionNode = Tuple[bytes, Tuple[bytes, ...]]
+# directory id -> (subdirectories, contents)
+DirectoryNode = Tuple[Tuple[bytes, ...], Tuple[bytes, ...]]
+# release id -> (target type, target)
+ReleaseNode = Tuple[ReleaseTargetType, bytes]
+
+
+# (encode, decode) functions used to keep nodes in a persistent store
+CODECS: Dict[str, Tuple[Callable[[Any], Any], Callable[[Any], Any]]] = {
+    "snapshot": (
+        lambda branches: [(br.target, br.target_type.value) for br in branches],
+        lambda value: tuple(
+            SnapshotBranch(target=target, target_type=SnapshotTargetType(type_))
+            for target, type_ in value
+        ),
+    ),
+    "release": (
+        lambda rel: (rel[0].value, rel[1]),
+        lambda value: (ReleaseTargetType(value[0]), value[1]),
+    ),
+    "revision": (
+        lambda rev: (rev[0], list(rev[1])),
+        lambda value: (value[0], tuple(value[1])),
+    ),
+    "directory": (
+        lambda dir_: (list(dir_[0]), list(dir_[1])),
+        lambda value: (tuple(value[0]), tuple(value[1])),
+    ),
+}
+
+
+class NodeCache(Generic[Node]):
+    """Thread-safe mapping of object ids to nodes (``None`` meaning the object
+    is missing from the storage), evicting the least recently used nodes
+    beyond ``max_nodes``"""
+
+    def __init__(self, max_nodes: int = DEFAULT_MAX_NODES):
+        self.max_nodes = max_nodes
+        self.nodes: OrderedDict[bytes, Optional[Node]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, obj_id: bytes) -> bool:
+        return obj_id in self.nodes
+
+    def get(self, obj_id: bytes, default: Any = None) -> Any:
+        with self.lock:
+            if obj_id not in self.nodes:
+                return default
+            self.nodes.move_to_end(obj_id)
+            return self.nodes[obj_id]
+
+    def __setitem__(self, obj_id: bytes, node: Optional[Node]) -> None:
+        with self.lock:
+            self.nodes[obj_id] = node
+            self.nodes.move_to_end(obj_id)
+            while len(self.nodes) > self.max_nodes:
+                self.nodes.popitem(last=False)
+
+
+# marker of the nodes not in a NodeCache
+EVICTED = object()
+
+
+def grouper(iterable: Iterable[T], n: int) -> Iterator[List[T]]:
+    it = iter(iterable)
+    while True:
+        chunk = list(islice(it, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+class GraphWalker:
+    """Compute the objects reachable from origins, one graph level at a time.
+
+    Each level of the graph (snapshots, releases, revisions, directories) is
+    fetched from the storage in chunks of ``batch_size`` objects, dispatched
+    over a pool of ``max_workers`` threads. Fetched nodes are kept in memory
+    (``None`` meaning the object is missing from the storage), up to
+    ``max_nodes`` per object type, so a subgraph shared between several
+    origins (e.g. forks) is usually only fetched once. Nodes evicted from
+    memory are fetched again, one by one, when needed: ``max_nodes`` should
+    be well above the size of the graph of the largest origins. A walker can
+    be shared by several threads computing stats for different origins.
+
+    Counting is then done from these in-memory nodes and gives the exact same
+    results as walking each origin with ``BFSRevisionsWalker`` and
+    ``dir_iterator``.
+
+    If a ``store`` (see ``walk_cache.WalkCache``) is given, nodes are looked up
+    there before being fetched from the storage, and fetched nodes are added
+    to it, so that a later walker only fetches objects that are new since the
+    previous run. Missing objects are not stored, as they may be replicated
+    later on.
+    """
+
+    def __init__(
+        self,
+        storage,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        store=None,
+        max_nodes: int = DEFAULT_MAX_NODES,
+    ):
+        self.storage = storage
+        self.store = store
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.snapshots: NodeCache[Tuple[SnapshotBranch, ...]] = NodeCache(max_nodes)
+        self.releases: NodeCache[ReleaseNode] = NodeCache(max_nodes)
+        self.revisions: NodeCache[RevisionNode] = NodeCache(max_nodes)
+        self.directories: NodeCache[DirectoryNode] = NodeCache(max_nodes)
+
+    def __enter__(self) -> "GraphWalker":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+    def _map(
+        self,
+        fetch: Callable[[List[bytes]], List[Tuple[bytes, Any]]],
+        ids: Iterable[bytes],
+        batch_size: Optional[int] = None,
+    ) -> Iterator[Tuple[bytes, Any]]:
+        chunks = grouper(ids, batch_size or self.batch_size)
+        for nodes in self.pool.map(fetch, chunks):
+            yield from nodes
+
+    def _fetch(
+        self,
+        kind: str,
+        fetch: Callable[[List[bytes]], List[Tuple[bytes, Any]]],
+        ids: Set[bytes],
+        batch_size: Optional[int] = None,
+    ) -> Iterator[Tuple[bytes, Any]]:
+        """Fetch nodes from the persistent store, if any, then the remaining
+        ones from the storage"""
+        if self.store is None or not ids:
+            yield from self._map(fetch, ids, batch_size)
+            return
+        encode, decode = CODECS[kind]
+        for obj_id, value in self.store.get_many(ids).items():
+            ids.discard(obj_id)
+            yield obj_id, decode(value)
+        fetched = list(self._map(fetch, ids, batch_size))
+        self.store.put_many(
+            (obj_id, encode(node)) for obj_id, node in fetched if node is not None
+        )
+        yield from fetched
+
+    def _get(
+        self,
+        kind: str,
+        cache: NodeCache[Node],
+        fetch: Callable[[List[bytes]], List[Tuple[bytes, Optional[Node]]]],
+        obj_id: bytes,
+    ) -> Optional[Node]:
+        """Get a node from ``cache``, fetching it again if it was evicted"""
+        node = cache.get(obj_id, EVICTED)
+        if node is EVICTED:
+            [(_, node)] = self._fetch(kind, fetch, {obj_id}, batch_size=1)
+            cache[obj_id] = node
+        return node
+
+    def snapshot(self, snp_id: bytes) -> Optional[Tuple[SnapshotBranch, ...]]:
+        return self._get("snapshot", self.snapshots, self.fetch_snapshots, snp_id)
+
+    def release(self, rel_id: bytes) -> Optional[ReleaseNode]:
+        return self._get("release", self.releases, self.fetch_releases, rel_id)
+
+    def revision(self, rev_id: bytes) -> Optional[RevisionNode]:
+        return self._get("revision", self.revisions, self.fetch_revisions, rev_id)
+
+    def directory(self, dir_id: bytes) -> Optional[DirectoryNode]:
+        return self._get("directory", self.directories, self.fetch_directories, dir_id)
+
+    def _walk(
+        self,
+        kind: str,
+        cache: NodeCache[Node],
+        fetch: Callable[[List[bytes]], List[Tuple[bytes, Optional[Node]]]],
+        ids: Iterable[bytes],
+        successors: Callable[[Node], Iterable[bytes]],
+    ) -> Set[bytes]:
+        """Ensure all the nodes reachable from ``ids`` are in ``cache``,
+        fetching the missing ones level by level, and return their ids.
+
+        Nodes already in ``cache`` are traversed in memory rather than
+        skipped, so the walk is complete even when another thread is filling
+        the cache concurrently.
+        """
+        seen: Set[bytes] = set()
+        to_visit = list(ids)
+        while to_visit:
+            to_fetch: Set[bytes] = set()
+            while to_visit:
+                obj_id = to_visit.pop()
+                if obj_id in seen:
+                    continue
+                seen.add(obj_id)
+                node = cache.get(obj_id, EVICTED)
+                if node is EVICTED:
+                    to_fetch.add(obj_id)
+                elif node is not None:
+                    to_visit.extend(successors(node))
+            if to_fetch:
+                logger.debug(
+                    "Fetching %s objects with %s", len(to_fetch), fetch.__name__
+                )
+            for obj_id, node in self._fetch(kind, fetch, to_fetch):
+                cache[obj_id] = node
+                if node is not None:
+                    to_visit.extend(successors(node))
+        return seen
+
+    def fetch_origin(self, url: str) -> Tuple[int, Set[bytes]]:
+        visits = list(iter_origin_visits(self.storage, url))
+        snp_ids = {
+            vs.snapshot
+            for v in visits
+            for vs in iter_origin_visit_statuses(self.storage, url, v.visit)
+            if vs.snapshot
+        }
+        return len(visits), snp_ids
+
+    def fetch_snapshots(
+        self, snp_ids: List[bytes]
+    ) -> List[Tuple[bytes, Optional[Tuple[SnapshotBranch, ...]]]]:
+        nodes: List[Tuple[bytes, Optional[Tuple[SnapshotBranch, ...]]]] = []
+        for snp_id in snp_ids:
+            snp = snapshot_get_all_branches(self.storage, snp_id)
+            nodes.append(
+                (
+                    snp_id,
+                    tuple(br for br in snp.branches.values() if br)
+                    if snp is not None
+                    else None,
+                )
+            )
+        return nodes
+
+    def fetch_releases(
+        self, rel_ids: List[bytes]
+    ) -> List[Tuple[bytes, Optional[ReleaseNode]]]:
+        return [
+            (rel_id, (rel.target_type, rel.target) if rel else None)
+            for rel_id, rel in zip(rel_ids, self.storage.release_get(rel_ids))
+        ]
+
+    def fetch_revisions(
+        self, rev_ids: List[bytes]
+    ) -> List[Tuple[bytes, Optional[RevisionNode]]]:
+        return [
+            (rev_id, (rev.directory, rev.parents) if rev else None)
+            for rev_id, rev in zip(rev_ids, self.storage.revision_get(rev_ids))
+        ]
+
+    def fetch_directories(
+        self, dir_ids: List[bytes]
+    ) -> List[Tuple[bytes, Optional[DirectoryNode]]]:
+        nodes: List[Tuple[bytes, Optional[DirectoryNode]]] = []
+        for dir_id in dir_ids:
+            subdirs: List[bytes] = []
+            cnts: List[bytes] = []
+            page_token = None
+            while True:
+                page = self.storage.directory_get_entries(dir_id, page_token=page_token)
+                if page is None:
+                    break
+                for entry in page.results:
+                    if entry.type == "dir":
+                        subdirs.append(entry.target)
+                    elif entry.type == "file":
+                        cnts.append(entry.target)
+                page_token = page.next_page_token
+                if page_token is None:
+                    break
+            nodes.append((dir_id, (tuple(subdirs), tuple(cnts)) if page else None))
+        return nodes
+
+    def walk(self, snp_ids: Iterable[bytes]) -> None:
+        """Fetch every object reachable from the given snapshots"""
+        snp_ids = set(snp_ids)
+        new_snp_ids = {snp_id for snp_id in snp_ids if snp_id not in self.snapshots}
+        # snapshots are paginated, fetch them one by one
+        for snp_id, snp in self._fetch(
+            "snapshot", self.fetch_snapshots, new_snp_ids, batch_size=1
+        ):
+            self.snapshots[snp_id] = snp
+        branches = [br for snp_id in snp_ids for br in self.snapshot(snp_id) or ()]
+
+        rel_ids = self._walk(
+            "release",
+            self.releases,
+            self.fetch_releases,
+            {
+                br.target
+                for br in branches
+                if br.target_type == SnapshotTargetType.RELEASE
+            },
+            lambda rel: (),
+        )
+        rev_ids = {
+            br.target
+            for br in branches
+            if br.target_type == SnapshotTargetType.REVISION
+        }
+        dir_ids = {
+            br.target
+            for br in branches
+            if br.target_type == SnapshotTargetType.DIRECTORY
+        }
+        for rel_id in rel_ids:
+            rel = self.release(rel_id)
+            if rel is None:
+                continue
+            if rel[0] == ReleaseTargetType.REVISION:
+                rev_ids.add(rel[1])
+            elif rel[0] == ReleaseTargetType.DIRECTORY:
+                dir_ids.add(rel[1])
+
+        rev_ids = self._walk(
+            "revision",
+            self.revisions,
+            self.fetch_revisions,
+            rev_ids,
+            lambda rev: rev[1],
+        )
+        for rev_id in rev_ids:
+            rev = self.revision(rev_id)
+            if rev is not None:
+                dir_ids.add(rev[0])
+        self._walk(
+            "directory",
+            self.directories,
+            self.fetch_directories,
+            dir_ids,
+            lambda dir_: dir_[0],
+        )
+
+    def origin_stats(self, urls: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Compute the stats of the given origins, as found in the
+        ``swh.test.objects.stats`` topic"""
+        urls = list(urls)
+        origins = dict(zip(urls, self.pool.map(self.fetch_origin, urls)))
+        self.walk(snp_id for _, snp_ids in origins.values() for snp_id in snp_ids)
+        return {
+            url: self.stats(url, visit_count, snp_ids)
+            for url, (visit_count, snp_ids) in origins.items()
+        }
+
+    def stats(self, url: str, visit_count: int, snp_ids: Set[bytes]) -> Dict[str, Any]:
+        """Count the objects reachable from the given snapshots, which must
+        have been walked already"""
+        branches = [br for snp_id in snp_ids for br in self.snapshot(snp_id) or ()]
+        stats: Dict[str, Any] = {"origin": url, "visit": visit_count}
+        stats["release"] = len(
+            {br for br in branches if br.target_type == SnapshotTargetType.RELEASE}
+        )
+        stats["alias"] = len(
+            {br for br in branches if br.target_type == SnapshotTargetType.ALIAS}
+        )
+        stats["branch"] = len(
+            {br for br in branches if br.target_type == SnapshotTargetType.REVISION}
+        )
+
+        rev_ids = {
+            br.target
+            for br in branches
+            if br.target_type == SnapshotTargetType.REVISION
+        }
+        dir_ids = {
+            br.target
+            for br in branches
+            if br.target_type == SnapshotTargetType.DIRECTORY
+        }
+        all_cnts: Set[bytes] = set()
+        for br in branches:
+            if br.target_type != SnapshotTargetType.RELEASE:
+                continue
+            rel = self.release(br.target)
+            if rel is None:
+                continue
+            target_type, target = rel
+            if target_type == ReleaseTargetType.REVISION:
+                rev_ids.add(target)
+            elif target_type == ReleaseTargetType.DIRECTORY:
+                dir_ids.add(target)
+            elif target_type == ReleaseTargetType.CONTENT:
+                all_cnts.add(target)
+            elif target_type == ReleaseTargetType.RELEASE:
+                raise ValueError("rel: Not yet supported")
+            elif target_type == ReleaseTargetType.SNAPSHOT:
+                raise ValueError("snp: Not yet supported")
+
+        # revisions given as roots are counted even if missing from the
+        # storage, but missing parents are not (as BFSRevisionsWalker does)
+        all_revs = set(rev_ids)
+        to_visit = list(rev_ids)
+        while to_visit:
+            rev = self.revision(to_visit.pop())
+            if rev is None:
+                continue
+            dir_ids.add(rev[0])
+            for parent in rev[1]:
+                if parent not in all_revs and self.revision(parent):
+                    all_revs.add(parent)
+                    to_visit.append(parent)
+
+        # directories are counted as soon as they are listed as an entry, even
+        # if missing from the storage (as dir_iterator does)
+        all_dirs = set(dir_ids)
+        to_visit = list(dir_ids)
+        while to_visit:
+            dir_ = self.directory(to_visit.pop())
+            if dir_ is None:
+                continue
+            subdirs, cnts = dir_
+            all_cnts.update(cnts)
+            for subdir in subdirs:
+                if subdir not in all_dirs:
+                    all_dirs.add(subdir)
+                    to_visit.append(subdir)
+
+        stats["cnt"] = len(all_cnts)
+        stats["dir"] = len(all_dirs)
+        stats["rev"] = len(all_revs)
+        return stats
@@ -5,25 +5,48 @@
 # See top-level LICENSE file for more information
 
 # very simple tool to ensure any pathslicer based objstorage found in the SWH
-# config file do have its root directory created
+# config file do have its root directory created; it can also prefill the
+# whole slice tree of these objstorages, and audit their content
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import logging
 import os
 import sys
+import time
+from typing import Any, Dict, Iterator, List, Set
 
+import click
 from swh.core.config import read as config_read
+from swh.objstorage.backends.pathslicing import DIR_MODE, PathSlicer
+from swh.objstorage.constants import ID_HEXDIGEST_LENGTH_BY_ALGO
+
+logger = logging.getLogger(__name__)
+
+HEX_DIGITS = "0123456789abcdef"
+# max number of stray/misplaced paths kept in the audit report of a slice
+MAX_REPORTED_PATHS = 100
+
+
+def iter_pathslicer_configs(cfg) -> Iterator[Dict[str, Any]]:
+    if isinstance(cfg, dict):
+        if cfg.get("cls") == "pathslicing":
+            if cfg.get("root"):
+                yield cfg
+        else:
+            for v in cfg.values():
+                yield from iter_pathslicer_configs(v)
+    elif isinstance(cfg, list):
+        for v in cfg:
+            yield from iter_pathslicer_configs(v)
 
 
 def ensure_pathslicer_root(cfg, init):
-    if cfg.get("cls") == "pathslicing":
-        root = cfg.get("root")
-        if root:
-            if init:
-                ensure_root(root)
-            print(root)
-    else:
-        for k, v in cfg.items():
-            if isinstance(v, dict):
-                ensure_pathslicer_root(v, init)
+    for objstorage in iter_pathslicer_configs(cfg):
+        root = objstorage["root"]
+        if init:
+            ensure_root(root)
+        print(root)
 
 
 def ensure_root(root):
@@ -34,6 +57,215 @@ def ensure_root(root):
         sys.exit(1)
 
 
-config_file = os.environ.get("SWH_CONFIG_FILENAME")
-cfg = config_read(config_file)
-ensure_pathslicer_root(cfg, "--init" in sys.argv)
+def get_slicer(cfg: Dict[str, Any]) -> PathSlicer:
+    primary_hash = cfg.get("primary_hash", "sha1")
+    slicer = PathSlicer(cfg["root"], cfg.get("slicing", "0:2/2:4"), primary_hash)
+    slicer.check_config()
+    return slicer
+
+
+def prefix_length(slicer: PathSlicer) -> int:
+    """Length of the hash prefix that determines the directory of an object"""
+    return max((bound.stop or 0) for bound in slicer.bounds) if len(slicer) else 0
+
+
+def hex_strings(length: int) -> Iterator[str]:
+    for i in range(16**length):
+        yield f"{i:0{length}x}" if length else ""
+
+
+def prefill_prefix(slicer: PathSlicer, prefix: str) -> int:
+    """Create the leaf directories of all the hashes starting with ``prefix``"""
+    length = prefix_length(slicer)
+    padding = "0" * (ID_HEXDIGEST_LENGTH_BY_ALGO[slicer.primary_hash] - length)
+    created: Set[str] = set()
+    for suffix in hex_strings(length - len(prefix)):
+        directory = slicer.get_directory(prefix + suffix + padding)
+        if directory not in created:
+            os.makedirs(directory, DIR_MODE, exist_ok=True)
+            created.add(directory)
+    return len(created)
+
+
+def prefill(slicer: PathSlicer, workers: int) -> None:
+    """Create the whole slice tree of a pathslicing objstorage, one task per
+    value of the first hex digit pair"""
+    t0 = time.monotonic()
+    length = prefix_length(slicer)
+    prefixes = list(hex_strings(min(length, 2)))
+    logger.info("Prefilling %s (%s leaf directories)", slicer.root, 16**length)
+    with ThreadPoolExecutor(workers) as pool:
+        created = sum(pool.map(lambda prefix: prefill_prefix(slicer, prefix), prefixes))
+    logger.info(
+        "Prefilled %s: %s directories in %.1fs",
+        slicer.root,
+        created,
+        time.monotonic() - t0,
+    )
+
+
+def is_hex(name: str, length: int) -> bool:
+    return len(name) == length and all(c in HEX_DIGITS for c in name)
+
+
+def audit_slice(slicer: PathSlicer, top: str) -> Dict[str, Any]:
+    """Walk the top-level slice directory ``top`` and count its objects.
+
+    Files which are not named after a hash (e.g. temporary files left over by
+    an interrupted write) are reported as stray, objects stored in the wrong
+    directory as misplaced.
+    """
+    length = ID_HEXDIGEST_LENGTH_BY_ALGO[slicer.primary_hash]
+    result: Dict[str, Any] = {
+        "slice": top,
+        "objects": 0,
+        "bytes": 0,
+        "stray": 0,
+        "misplaced": 0,
+        "stray_paths": [],
+        "misplaced_paths": [],
+    }
+
+    def report(kind: str, path: str) -> None:
+        result[kind] += 1
+        if len(result[f"{kind}_paths"]) < MAX_REPORTED_PATHS:
+            result[f"{kind}_paths"].append(path)
+
+    to_visit: List[str] = [os.path.normpath(os.path.join(slicer.root, top))]
+    while to_visit:
+        directory = to_visit.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    to_visit.append(entry.path)
+                elif not is_hex(entry.name, length):
+                    report("stray", entry.path)
+                elif os.path.normpath(slicer.get_directory(entry.name)) != directory:
+                    report("misplaced", entry.path)
+                else:
+                    result["objects"] += 1
+                    result["bytes"] += entry.stat(follow_symlinks=False).st_size
+    return result
+
+
+def audit(slicer: PathSlicer, workers: int, checkpoint: str, output) -> None:
+    """Audit a pathslicing objstorage, one task per top-level slice directory.
+
+    The result of each slice is appended to the ``checkpoint`` file (JSON
+    lines) as soon as it is done; slices found in there are not audited again.
+    """
+    done: Dict[str, Dict[str, Any]] = {}
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    if result["root"] == slicer.root:
+                        done[result["slice"]] = result
+    if done:
+        logger.info("Skipping %s slices already audited", len(done))
+
+    tops: List[str] = []
+    stray: List[str] = []
+    with os.scandir(slicer.root) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name not in done:
+                    tops.append(entry.name)
+            else:
+                stray.append(entry.path)
+
+    t0 = time.monotonic()
+    results = list(done.values())
+    total = len(results) + len(tops)
+    with open(checkpoint, "a") as ckpt, ThreadPoolExecutor(workers) as pool:
+        futures = {pool.submit(audit_slice, slicer, top): top for top in tops}
+        for future in as_completed(futures):
+            result = {"root": slicer.root, **future.result()}
+            ckpt.write(json.dumps(result) + "\n")
+            ckpt.flush()
+            results.append(result)
+            if result["stray"] or result["misplaced"]:
+                logger.warning(
+                    "%s/%s: %s stray files, %s misplaced objects",
+                    slicer.root,
+                    result["slice"],
+                    result["stray"],
+                    result["misplaced"],
+                )
+            logger.info(
+                "%s/%s: %s objects, %s bytes (%s/%s slices done)",
+                slicer.root,
+                result["slice"],
+                result["objects"],
+                result["bytes"],
+                len(results),
+                total,
+            )
+
+    for result in sorted(results, key=lambda r: r["slice"]):
+        output.write(json.dumps(result) + "\n")
+    summary = {
+        "root": slicer.root,
+        "slices": len(results),
+        "objects": sum(r["objects"] for r in results),
+        "bytes": sum(r["bytes"] for r in results),
+        "stray": sum(r["stray"] for r in results) + len(stray),
+        "misplaced": sum(r["misplaced"] for r in results),
+        "stray_paths": stray[:MAX_REPORTED_PATHS],
+        "duration": time.monotonic() - t0,
+    }
+    output.write(json.dumps(summary) + "\n")
+    logger.info(
+        "Audited %(root)s: %(objects)s objects, %(bytes)s bytes, "
+        "%(stray)s stray files, %(misplaced)s misplaced objects",
+        summary,
+    )
+
+
+@click.command()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(dir_okay=False),
+)
+@click.option("--init", is_flag=True, help="Create the root directories")
+@click.option(
+    "--prefill", "do_prefill", is_flag=True, help="Create the whole slice trees"
+)
+@click.option("--audit", "do_audit", is_flag=True, help="Audit the objstorages")
+@click.option("--workers", default=16, show_default=True)
+@click.option(
+    "--checkpoint",
+    default="pathslicer-audit.jsonl",
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="Audit results of the slices done so far, used to resume an audit",
+)
+@click.option(
+    "--output",
+    type=click.File("w"),
+    default="-",
+    help="Audit report (JSON lines)",
+)
+def main(config_file, init, do_prefill, do_audit, workers, checkpoint, output):
+    """Initialize or audit the pathslicing objstorages of a SWH config file"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        stream=sys.stderr,
+    )
+    cfg = config_read(config_file)
+    if init or do_prefill or not do_audit:
+        ensure_pathslicer_root(cfg, init or do_prefill)
+    for objstorage in iter_pathslicer_configs(cfg):
+        slicer = get_slicer(objstorage)
+        if do_prefill:
+            prefill(slicer, workers)
+        if do_audit:
+            audit(slicer, workers, checkpoint, output)
+
+
+if __name__ == "__main__":
+    main()
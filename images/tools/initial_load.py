@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# initial load mode of the mirror's postgresql storage: the secondary indexes
+# are dropped while the graph replayers fill an empty database, then rebuilt
+# (concurrently, several tables at once) and validated once the replication
+# lag is small enough
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import click
+import psycopg
+from replication_lag import DEFAULT_INTERVAL
+from replication_lag import from_config as lag_monitor_from_config
+from swh.core.cli.db import handle_cmd_args
+from swh.core.config import read as config_read
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LAG_THRESHOLD = 1_000_000
+DEFAULT_WORKERS = 4
+DEFAULT_MAINTENANCE_WORK_MEM = "1GB"
+# attempts at building an index before giving up
+MAX_ATTEMPTS = 3
+
+# secondary indexes used by the replayers themselves (lookups of origins,
+# snapshots, persons and metadata authorities/fetchers by their natural key),
+# which must not be dropped; unique indexes are never dropped either, as the
+# inserts rely on them to skip objects which are already there
+DEFAULT_KEEP = [
+    "origin_url_idx",
+    "snapshot_id_idx",
+    "person_fullname_idx",
+    "metadata_fetcher_name_version",
+    "metadata_authority_type_url",
+]
+
+STATE_TABLE = "mirror_initial_load_index"
+
+
+def storage_dsn(cfg: Dict[str, Any]) -> str:
+    """Connection string of the main database of the storage section"""
+    return handle_cmd_args(cfg=cfg, module="storage")[-1][5]
+
+
+def init_state(db: psycopg.Connection) -> None:
+    db.execute(
+        f"""create table if not exists {STATE_TABLE} (
+          name text primary key,
+          table_name text not null,
+          definition text not null,
+          dropped_at timestamptz not null default now()
+        )"""
+    )
+
+
+def secondary_indexes(db: psycopg.Connection, keep: List[str]) -> List[Dict[str, str]]:
+    """The non-unique indexes of the tables of the public schema which do not
+    back a constraint and are not in ``keep``"""
+    rows = db.execute(
+        """select i.relname, t.relname, pg_get_indexdef(x.indexrelid)
+           from pg_index x
+           join pg_class i on i.oid = x.indexrelid
+           join pg_class t on t.oid = x.indrelid
+           join pg_namespace n on n.oid = t.relnamespace
+           where n.nspname = 'public' and t.relkind = 'r'
+             and not x.indisunique and not x.indisprimary
+             and not x.indisexclusion
+             and not exists (
+               select 1 from pg_constraint c where c.conindid = x.indexrelid)
+             and t.relname <> %s and not (i.relname = any(%s))
+           order by t.relname, i.relname""",
+        (STATE_TABLE, keep),
+    ).fetchall()
+    return [
+        {"name": name, "table_name": table, "definition": definition}
+        for name, table, definition in rows
+    ]
+
+
+def defer_indexes(dsn: str, keep: List[str]) -> int:
+    """Drop the secondary indexes, recording their definition (in the same
+    transaction) so they can be rebuilt later"""
+    with psycopg.connect(dsn, autocommit=True) as db:
+        init_state(db)
+        indexes = secondary_indexes(db, keep)
+        for index in indexes:
+            with db.transaction():
+                db.execute("set local lock_timeout = '60s'")
+                db.execute(
+                    f"insert into {STATE_TABLE} (name, table_name, definition) "
+                    "values (%(name)s, %(table_name)s, %(definition)s) "
+                    "on conflict (name) do nothing",
+                    index,
+                )
+                db.execute(f'drop index if exists "{index["name"]}"')
+            logger.info("Dropped %s on %s", index["name"], index["table_name"])
+    return len(indexes)
+
+
+def deferred_indexes(db: psycopg.Connection) -> List[Dict[str, Any]]:
+    init_state(db)
+    rows = db.execute(
+        f"""select s.name, s.table_name, s.definition,
+                   coalesce(pg_relation_size(to_regclass(s.table_name)), 0)
+            from {STATE_TABLE} s order by 4 desc, s.table_name, s.name"""
+    ).fetchall()
+    return [
+        {"name": name, "table_name": table, "definition": definition, "size": size}
+        for name, table, definition, size in rows
+    ]
+
+
+def index_state(db: psycopg.Connection, name: str) -> Optional[bool]:
+    """None if the index does not exist, else whether it is valid"""
+    row = db.execute(
+        """select x.indisvalid and x.indisready from pg_index x
+           join pg_class i on i.oid = x.indexrelid
+           join pg_namespace n on n.oid = i.relnamespace
+           where n.nspname = 'public' and i.relname = %s""",
+        (name,),
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def rebuild_table(
+    dsn: str, table: str, indexes: List[Dict[str, Any]], maintenance_work_mem: str
+) -> List[str]:
+    """Rebuild the deferred indexes of a table, one after the other (concurrent
+    builds on the same table wait for each other anyway); return the ones
+    which could not be built"""
+    failed = []
+    with psycopg.connect(dsn, autocommit=True) as db:
+        db.execute(
+            "select set_config('maintenance_work_mem', %s, false)",
+            (maintenance_work_mem,),
+        )
+        for index in indexes:
+            name = index["name"]
+            for attempt in range(1, MAX_ATTEMPTS + 1):
+                state = index_state(db, name)
+                if state is False:
+                    # left over by an interrupted or failed concurrent build
+                    logger.warning("Dropping invalid index %s", name)
+                    db.execute(f'drop index concurrently if exists "{name}"')
+                if state is not True:
+                    t0 = time.monotonic()
+                    logger.info("Building %s (attempt %s)", name, attempt)
+                    try:
+                        db.execute(
+                            index["definition"].replace(
+                                "CREATE INDEX ", "CREATE INDEX CONCURRENTLY ", 1
+                            )
+                        )
+                    except psycopg.Error as exc:
+                        logger.warning("Failed to build %s: %s", name, exc)
+                        continue
+                    logger.info("Built %s in %.1fs", name, time.monotonic() - t0)
+                if index_state(db, name):
+                    db.execute(f"delete from {STATE_TABLE} where name = %s", (name,))
+                    break
+            else:
+                logger.error("Could not build a valid %s index", name)
+                failed.append(name)
+        db.execute(f'analyze "{table}"')
+    return failed
+
+
+def rebuild_indexes(dsn: str, workers: int, maintenance_work_mem: str) -> List[str]:
+    """Rebuild and validate all the deferred indexes, the tables being handled
+    in parallel (largest first); return the indexes which failed"""
+    with psycopg.connect(dsn, autocommit=True) as db:
+        indexes = deferred_indexes(db)
+    by_table: Dict[str, List[Dict[str, Any]]] = {}
+    for index in indexes:
+        by_table.setdefault(index["table_name"], []).append(index)
+    logger.info(
+        "Rebuilding %s indexes on %s tables, %s at a time",
+        len(indexes),
+        len(by_table),
+        workers,
+    )
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(workers) as pool:
+        failed = [
+            name
+            for names in pool.map(
+                lambda item: rebuild_table(dsn, *item, maintenance_work_mem),
+                by_table.items(),
+            )
+            for name in names
+        ]
+    logger.info(
+        "Rebuilt %s indexes in %.1fs",
+        len(indexes) - len(failed),
+        time.monotonic() - t0,
+    )
+    return failed
+
+
+def wait_lag(cfg: Dict[str, Any], threshold: int) -> None:
+    """Wait for the total lag of the consumer groups of the replication_lag
+    section to be under ``threshold`` messages"""
+    monitor = lag_monitor_from_config(cfg)
+    interval = cfg["replication_lag"].get("interval", DEFAULT_INTERVAL)
+    while True:
+        try:
+            lags = monitor.poll()
+            monitor.report(lags)
+            total = sum(lag.lag for lag in lags)
+            if total <= threshold:
+                logger.info("Replication lag is %s, under %s", total, threshold)
+                return
+        except Exception:
+            logger.exception("Failed to compute the replication lag")
+        time.sleep(interval)
+
+
+@click.group()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+    help="Configuration file with the storage, journal_client, replication_lag "
+    "and initial_load sections",
+)
+@click.pass_context
+def cli(ctx, config_file):
+    """Initial load mode of the mirror's postgresql storage"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file)
+    ctx.obj = {
+        "config": cfg,
+        "dsn": storage_dsn(cfg),
+        **cfg.get("initial_load", {}),
+    }
+
+
+def do_rebuild(obj: Dict[str, Any]) -> None:
+    failed = rebuild_indexes(
+        obj["dsn"],
+        obj.get("workers", DEFAULT_WORKERS),
+        obj.get("maintenance_work_mem", DEFAULT_MAINTENANCE_WORK_MEM),
+    )
+    if failed:
+        raise click.ClickException(f"Failed to build {', '.join(failed)}")
+
+
+@cli.command()
+@click.pass_obj
+def defer(obj):
+    """Drop the secondary indexes of the storage database"""
+    count = defer_indexes(obj["dsn"], obj.get("keep", DEFAULT_KEEP))
+    logger.info("%s indexes deferred", count)
+
+
+@cli.command()
+@click.pass_obj
+def rebuild(obj):
+    """Rebuild (concurrently) and validate the deferred indexes"""
+    do_rebuild(obj)
+
+
+@cli.command()
+@click.pass_obj
+def status(obj):
+    """List the deferred indexes"""
+    with psycopg.connect(obj["dsn"], autocommit=True) as db:
+        for index in deferred_indexes(db):
+            click.echo(f"{index['table_name']} {index['name']}: {index['definition']}")
+
+
+@cli.command()
+@click.option(
+    "--lag-threshold",
+    type=int,
+    help="Rebuild the indexes once the replication lag (in messages) is "
+    "under this value",
+)
+@click.pass_obj
+def run(obj, lag_threshold):
+    """Defer the indexes, wait for the replication to (almost) catch up, then
+    rebuild them"""
+    if lag_threshold is None:
+        lag_threshold = obj.get("lag_threshold", DEFAULT_LAG_THRESHOLD)
+    count = defer_indexes(obj["dsn"], obj.get("keep", DEFAULT_KEEP))
+    logger.info("%s indexes deferred, waiting for the replication lag", count)
+    wait_lag(obj["config"], lag_threshold)
+    do_rebuild(obj)
+
+
+if __name__ == "__main__":
+    cli()
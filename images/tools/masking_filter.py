@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# in-memory bloom filter of the masked objects (and display names) of the
+# masking proxy database, so the masking proxy of storage-public only queries
+# the database for the objects which may be masked
+
+from contextlib import contextmanager
+import hashlib
+import logging
+import math
+import threading
+import time
+from typing import Iterable, Iterator, List, Optional
+
+import psycopg
+from swh.core.statsd import statsd
+from swh.model.swhids import ExtendedSWHID
+from swh.storage.proxies.masking.cls import MaskingProxyStorage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ERROR_RATE = 1e-3
+# the filter is sized for twice the number of masked objects when (re)built
+MIN_CAPACITY = 100_000
+DEFAULT_REFRESH_INTERVAL = 5.0
+DEFAULT_REBUILD_INTERVAL = 3600.0
+# the filter is not used anymore when it could not be refreshed for that long
+DEFAULT_MAX_STALENESS = 60.0
+# how long the changes are kept in the masking_filter_change table
+CHANGES_RETENTION = "1 day"
+CHANNEL = "masking_filter"
+
+FILTER_METRIC = "swh_storage_masking_filter_total"
+SIZE_METRIC = "swh_storage_masking_filter_keys"
+
+# log of the changes which may mask new objects (or set new display names),
+# filled by triggers, so the filters can be updated incrementally; each change
+# records its transaction id, so a filter can read all the changes committed
+# since the snapshot of the database it was last refreshed from
+SCHEMA = """
+create table if not exists masking_filter_change (
+  txid xid8 not null default pg_current_xact_id(),
+  date timestamptz not null default now(),
+  object_type text not null,
+  object_id bytea not null
+);
+create index if not exists masking_filter_change_txid
+  on masking_filter_change (txid);
+
+create or replace function masking_filter_masked_object_change()
+  returns trigger language plpgsql as $$
+begin
+  if new.state != 'visible' then
+    insert into masking_filter_change (object_type, object_id)
+      values (new.object_type::text, new.object_id);
+    perform pg_notify('masking_filter', '');
+  end if;
+  return null;
+end
+$$;
+create or replace trigger masking_filter_masked_object
+  after insert or update on masked_object
+  for each row execute function masking_filter_masked_object_change();
+
+create or replace function masking_filter_display_name_change()
+  returns trigger language plpgsql as $$
+begin
+  insert into masking_filter_change (object_type, object_id)
+    values ('display_name', new.original_email);
+  perform pg_notify('masking_filter', '');
+  return null;
+end
+$$;
+create or replace trigger masking_filter_display_name
+  after insert or update on display_name
+  for each row execute function masking_filter_display_name_change();
+"""
+
+
+def filter_key(object_type: str, object_id: bytes) -> bytes:
+    return hashlib.blake2b(
+        object_type.encode() + b":" + object_id, digest_size=16
+    ).digest()
+
+
+def swhid_key(swhid: ExtendedSWHID) -> bytes:
+    return filter_key(swhid.object_type.name.lower(), swhid.object_id)
+
+
+def email_key(email: bytes) -> bytes:
+    return filter_key("display_name", email)
+
+
+class BloomFilter:
+    """Bloom filter of (uniformly distributed) 16 bytes keys.
+
+    Keys are only added by one thread; lookups from other threads meanwhile
+    may miss the key being added, as if it were added a bit later.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE):
+        nbits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.nbits = -(-nbits // 8) * 8
+        self.nprobes = max(1, round(self.nbits / capacity * math.log(2)))
+        self.bits = bytearray(self.nbits // 8)
+        self.count = 0
+
+    def positions(self, key: bytes) -> Iterator[int]:
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        for i in range(self.nprobes):
+            yield (h1 + i * h2) % self.nbits
+
+    def add(self, key: bytes) -> None:
+        bits = self.bits
+        for pos in self.positions(key):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(key))
+
+
+class MaskFilter(threading.Thread):
+    """Keep a bloom filter of the masked objects and display names of the
+    masking proxy database up to date.
+
+    The filter is built from a snapshot of the database, then updated from
+    the changes logged (by triggers) since that snapshot, as soon as they are
+    notified, or every ``refresh_interval`` seconds. It is rebuilt every
+    ``rebuild_interval`` seconds, to drop the objects not masked anymore and
+    resize it as the number of masked objects grows.
+
+    Until the filter is built, or when it could not be refreshed for
+    ``max_staleness`` seconds, every key may be masked.
+    """
+
+    def __init__(
+        self,
+        masking_db: str,
+        error_rate: float = DEFAULT_ERROR_RATE,
+        refresh_interval: float = DEFAULT_REFRESH_INTERVAL,
+        rebuild_interval: float = DEFAULT_REBUILD_INTERVAL,
+        max_staleness: float = DEFAULT_MAX_STALENESS,
+    ):
+        super().__init__(daemon=True)
+        self.masking_db = masking_db
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.max_staleness = max_staleness
+        self.filter: Optional[BloomFilter] = None
+        self.snapshot: Optional[str] = None
+        self.refreshed = 0.0
+        self.rebuilt = 0.0
+
+    def maybe_masked(self, keys: List[bytes]) -> List[bool]:
+        filter_ = self.filter
+        if filter_ is None or time.monotonic() - self.refreshed > self.max_staleness:
+            return [True] * len(keys)
+        return [key in filter_ for key in keys]
+
+    def installed(self, db: psycopg.Connection) -> bool:
+        """Whether the change log and its triggers exist"""
+        (installed,) = db.execute(
+            """select to_regclass('masking_filter_change') is not null
+                 and (select count(*) from pg_trigger
+                      where tgname in ('masking_filter_masked_object',
+                                       'masking_filter_display_name')) = 2"""
+        ).fetchone()
+        return installed
+
+    def setup(self, db: psycopg.Connection) -> None:
+        """Create the change log and its triggers, unless they already exist
+        (so the workers do not lock the masking tables on each connection)"""
+        if self.installed(db):
+            return
+        with db.transaction():
+            db.execute("select pg_advisory_xact_lock(hashtext('masking_filter'))")
+            # created by another worker meanwhile
+            if not self.installed(db):
+                db.execute(SCHEMA)
+                logger.info("Created the masking filter change log")
+
+    @contextmanager
+    def snapshot_transaction(self, db: psycopg.Connection) -> Iterator[str]:
+        """Repeatable read transaction; yield its snapshot"""
+        with db.transaction():
+            db.execute("set transaction isolation level repeatable read")
+            (snapshot,) = db.execute("select pg_current_snapshot()::text").fetchone()
+            yield snapshot
+
+    def rebuild(self, db: psycopg.Connection) -> None:
+        started = time.monotonic()
+        with self.snapshot_transaction(db) as snapshot:
+            (count,) = db.execute(
+                """select (select count(*) from masked_object
+                           where state != 'visible')
+                        + (select count(*) from display_name)"""
+            ).fetchone()
+            filter_ = BloomFilter(max(MIN_CAPACITY, 2 * count), self.error_rate)
+            cursor = db.cursor(name="masking_filter")
+            cursor.itersize = 10_000
+            cursor.execute(
+                """select object_type::text, object_id from masked_object
+                   where state != 'visible'
+                 union all
+                 select 'display_name', original_email from display_name"""
+            )
+            for object_type, object_id in cursor:
+                filter_.add(filter_key(object_type, object_id))
+            cursor.close()
+            db.execute(
+                "delete from masking_filter_change where date < now() - %s::interval",
+                (CHANGES_RETENTION,),
+            )
+        self.filter, self.snapshot = filter_, snapshot
+        self.refreshed = self.rebuilt = started
+        statsd.gauge(SIZE_METRIC, filter_.count)
+        logger.info(
+            "Built the masking filter (%s keys) in %.1fs",
+            filter_.count,
+            time.monotonic() - started,
+        )
+
+    def refresh(self, db: psycopg.Connection) -> None:
+        """Add the keys changed since the snapshot of the last refresh"""
+        assert self.filter is not None
+        started = time.monotonic()
+        with self.snapshot_transaction(db) as snapshot:
+            rows = db.execute(
+                """select object_type, object_id from masking_filter_change
+                   where txid >= pg_snapshot_xmin(%(since)s::pg_snapshot)
+                   and not pg_visible_in_snapshot(txid, %(since)s::pg_snapshot)""",
+                {"since": self.snapshot},
+            ).fetchall()
+        for object_type, object_id in rows:
+            self.filter.add(filter_key(object_type, object_id))
+        self.snapshot = snapshot
+        self.refreshed = started
+        if rows:
+            statsd.gauge(SIZE_METRIC, self.filter.count)
+            logger.info("Added %s keys to the masking filter", len(rows))
+
+    def run(self) -> None:
+        db: Optional[psycopg.Connection] = None
+        while True:
+            try:
+                if db is None or db.closed:
+                    db = psycopg.connect(self.masking_db, autocommit=True)
+                    self.setup(db)
+                    db.execute(f"listen {CHANNEL}")
+                    # notifications may have been missed
+                    self.snapshot = None
+                if (
+                    self.snapshot is None
+                    or time.monotonic() - self.rebuilt >= self.rebuild_interval
+                ):
+                    self.rebuild(db)
+                else:
+                    self.refresh(db)
+                # wait for a change (or the next periodic refresh), then let
+                # the notifications of the same batch of changes arrive
+                for _ in db.notifies(timeout=self.refresh_interval, stop_after=1):
+                    pass
+                for _ in db.notifies(timeout=0.1):
+                    pass
+            except Exception:
+                logger.exception("Failed to refresh the masking filter")
+                if db is not None:
+                    db.close()
+                time.sleep(self.refresh_interval)
+
+
+class FilteredMaskingQuery:
+    """Stand-in for the MaskingQuery of the masking proxy, only querying the
+    database (with a connection taken from its pool) about the keys which may
+    be masked according to the filter"""
+
+    def __init__(self, mask_filter: MaskFilter, masking_query):
+        self.mask_filter = mask_filter
+        self.masking_query = masking_query
+
+    def maybe(self, kind: str, items: List, keys: Iterable[bytes]) -> List:
+        found = self.mask_filter.maybe_masked(list(keys))
+        result = [item for item, maybe in zip(items, found) if maybe]
+        statsd.increment(
+            FILTER_METRIC,
+            len(items) - len(result),
+            tags={"kind": kind, "result": "negative"},
+        )
+        statsd.increment(
+            FILTER_METRIC, len(result), tags={"kind": kind, "result": "maybe"}
+        )
+        return result
+
+    def swhids_are_masked(self, swhids: List[ExtendedSWHID]):
+        swhids = self.maybe("swhid", swhids, map(swhid_key, swhids))
+        if not swhids:
+            return {}
+        with self.masking_query() as q:
+            return q.swhids_are_masked(swhids)
+
+    def display_name(self, original_emails: List[bytes]):
+        emails = self.maybe(
+            "display_name", original_emails, map(email_key, original_emails)
+        )
+        if not emails:
+            return {}
+        with self.masking_query() as q:
+            return q.display_name(emails)
+
+
+class FilteredMaskingProxyStorage(MaskingProxyStorage):
+    """Masking proxy checking the objects (and emails) of the results against
+    a :class:`MaskFilter` before querying the masking database.
+
+    Sample configuration use case for the filter::
+
+        masking_filter:
+          error_rate: 0.001
+          refresh_interval: 5
+    """
+
+    def __init__(self, *args, mask_filter: MaskFilter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.mask_filter = mask_filter
+
+    @contextmanager
+    def _masking_query(self):
+        yield FilteredMaskingQuery(self.mask_filter, super()._masking_query)
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# check that the origins of a mirror hold the expected number of objects, as
+# published for each origin in a kafka stats topic (swh.test.objects.stats)
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, Optional, Set
+
+import click
+from confluent_kafka import Consumer, KafkaException
+from graph_walker import (
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_MAX_NODES,
+    DEFAULT_MAX_WORKERS,
+    GraphWalker,
+)
+import msgpack
+from swh.core.config import read as config_read
+from swh.storage import get_storage
+from walk_cache import DEFAULT_MAX_SIZE, WalkCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOPIC = "swh.test.objects.stats"
+PROGRESS_INTERVAL = 10.0
+
+
+def kafka_config(journal_cfg: Dict[str, Any], group_suffix: str) -> Dict[str, Any]:
+    """Build a confluent_kafka consumer config from a swh journal client config
+    section (as used by the replayers)"""
+    cfg = {k: v for k, v in journal_cfg.items() if "." in k}
+    cfg.update(
+        {
+            "bootstrap.servers": ",".join(journal_cfg["brokers"]),
+            "group.id": f"{journal_cfg['group_id']}_{group_suffix}",
+            "auto.offset.reset": "earliest",
+            "enable.auto.commit": False,
+            "enable.partition.eof": True,
+        }
+    )
+    return cfg
+
+
+def iter_stats(consumer, topic: str, timeout: float = 10.0) -> Iterator[Dict]:
+    """Yield the stats records of ``topic`` as they arrive, until the end of
+    all the assigned partitions"""
+    partitions: Set[int] = set()
+
+    def on_assign(cons, parts):
+        logger.info("assignment %s", parts)
+        for p in parts:
+            partitions.add(p.partition)
+
+    consumer.subscribe([topic], on_assign=on_assign)
+    while True:
+        msg = consumer.poll(timeout=timeout)
+        if msg is None:
+            if not partitions:
+                return
+            continue
+        if msg.error():
+            if msg.error().name() == "_PARTITION_EOF":
+                partitions.discard(msg.partition())
+                if not partitions:
+                    return
+            else:
+                raise KafkaException(msg.error())
+        else:
+            k = msgpack.unpackb(msg.key())
+            v = msgpack.unpackb(msg.value())
+            logger.debug(
+                "%s [%d] at offset %d with key %s",
+                msg.topic(),
+                msg.partition(),
+                msg.offset(),
+                k,
+            )
+            if k != v["origin"]:
+                raise ValueError(f"Inconsistent stats record {k!r}: {v}")
+            yield v
+
+
+def iter_stats_dump(fileobj) -> Iterator[Dict]:
+    """Yield the stats records from a msgpack dump (as written by --record)"""
+    yield from msgpack.Unpacker(fileobj)
+
+
+def load_results(path: str) -> Dict[str, Dict]:
+    results: Dict[str, Dict] = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    results[result["origin"]] = result
+    return results
+
+
+def check_origin(walker: GraphWalker, expected: Dict) -> Dict[str, Any]:
+    origin = expected["origin"]
+    t0 = time.monotonic()
+    try:
+        actual: Optional[Dict] = walker.origin_stats([origin])[origin]
+        error = None
+    except Exception as exc:
+        logger.exception("Failed to check %s", origin)
+        actual = None
+        error = str(exc)
+    return {
+        "origin": origin,
+        "ok": actual == expected,
+        "expected": expected,
+        "actual": actual,
+        "error": error,
+        "duration": time.monotonic() - t0,
+    }
+
+
+@click.command()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+    help="Configuration file with a journal_client section (kafka access)",
+)
+@click.option(
+    "--storage-url",
+    default="http://storage-public:5002/",
+    show_default=True,
+    help="URL of the storage RPC server to check",
+)
+@click.option("--topic", default=DEFAULT_TOPIC, show_default=True)
+@click.option(
+    "--results",
+    "results_file",
+    default="mirror-verify.jsonl",
+    show_default=True,
+    type=click.Path(dir_okay=False),
+    help="Per-origin results file; origins already in there are skipped",
+)
+@click.option(
+    "--retry-failed",
+    is_flag=True,
+    help="Check again origins recorded as failed in the results file",
+)
+@click.option(
+    "--from-dump",
+    type=click.File("rb"),
+    help="Read stats records from a msgpack dump instead of kafka",
+)
+@click.option(
+    "--record",
+    type=click.File("ab"),
+    help="Append the stats records read from kafka to this msgpack dump",
+)
+@click.option(
+    "--workers",
+    default=4,
+    show_default=True,
+    help="Number of origins checked concurrently",
+)
+@click.option(
+    "--walker-workers",
+    default=DEFAULT_MAX_WORKERS,
+    show_default=True,
+    help="Number of concurrent storage requests",
+)
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option(
+    "--max-nodes",
+    default=DEFAULT_MAX_NODES,
+    show_default=True,
+    help="Max number of objects of each type kept in memory by the walker",
+)
+@click.option(
+    "--cache",
+    "cache_file",
+    type=click.Path(dir_okay=False),
+    help="Persistent walk cache (sqlite), reused between runs",
+)
+@click.option(
+    "--cache-size",
+    default=DEFAULT_MAX_SIZE,
+    show_default=True,
+    help="Max size of the walk cache, in bytes",
+)
+@click.option(
+    "--cache-max-age",
+    type=float,
+    help=(
+        "Fetch again the objects cached for more than this many seconds, to "
+        "notice the ones gone missing since (0 to check everything again)"
+    ),
+)
+def main(
+    config_file,
+    storage_url,
+    topic,
+    results_file,
+    retry_failed,
+    from_dump,
+    record,
+    workers,
+    walker_workers,
+    batch_size,
+    max_nodes,
+    cache_file,
+    cache_size,
+    cache_max_age,
+):
+    """Check the origins of a mirror against their expected stats"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+
+    done = {
+        origin
+        for origin, result in load_results(results_file).items()
+        if result["ok"] or not retry_failed
+    }
+    if done:
+        logger.info("Skipping %s origins already checked", len(done))
+
+    consumer = None
+    if from_dump:
+        records = iter_stats_dump(from_dump)
+    else:
+        cfg = config_read(config_file)
+        consumer = Consumer(kafka_config(cfg["journal_client"], "verify"))
+        records = iter_stats(consumer, topic)
+
+    storage = get_storage(
+        cls="remote",
+        url=storage_url,
+        max_retries=5,
+        pool_connections=walker_workers,
+        pool_maxsize=2 * walker_workers,
+    )
+    store = (
+        WalkCache(cache_file, max_size=cache_size, max_age=cache_max_age)
+        if cache_file
+        else None
+    )
+    walker = GraphWalker(
+        storage,
+        batch_size=batch_size,
+        max_workers=walker_workers,
+        store=store,
+        max_nodes=max_nodes,
+    )
+
+    checked = failed = 0
+    t0 = last_report = time.monotonic()
+    pending: Set[Future] = set()
+
+    def collect(futures, out):
+        nonlocal checked, failed, last_report
+        for future in futures:
+            result = future.result()
+            checked += 1
+            if not result["ok"]:
+                failed += 1
+                logger.warning("%s is NOT OK: %s", result["origin"], result)
+            out.write(json.dumps(result) + "\n")
+        out.flush()
+
+        now = time.monotonic()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            logger.info(
+                "%s origins checked (%s failed), %.2f origins/s",
+                checked,
+                failed,
+                checked / (now - t0),
+            )
+
+    try:
+        with open(results_file, "a") as out, ThreadPoolExecutor(workers) as pool:
+            for expected in records:
+                if record:
+                    record.write(msgpack.packb(expected))
+                if expected["origin"] in done:
+                    continue
+                if len(pending) >= 2 * workers:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished, out)
+                pending.add(pool.submit(check_origin, walker, expected))
+            finished, pending = wait(pending)
+            collect(finished, out)
+    finally:
+        walker.close()
+        if store is not None:
+            logger.info("Walk cache: %s hits, %s misses", store.hits, store.misses)
+            store.close()
+        if consumer is not None:
+            consumer.unsubscribe()
+            consumer.close()
+
+    elapsed = time.monotonic() - t0
+    logger.info(
+        "Done: %s origins checked (%s failed) in %.2fs, %.2f origins/s",
+        checked,
+        failed,
+        elapsed,
+        checked / elapsed if elapsed else 0,
+    )
+    if failed:
+        raise click.ClickException(f"{failed} origins do not match")
+
+
+if __name__ == "__main__":
+    main()
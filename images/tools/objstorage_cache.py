@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# size-bounded read cache on local (fast) disk in front of an objstorage,
+# used as the gunicorn app of objstorage RPC servers instead of
+# swh.objstorage.api.server:make_app_from_configfile()
+
+from contextlib import contextmanager
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Union
+
+from swh.core.statsd import statsd
+from swh.objstorage.api import server
+from swh.objstorage.exc import ObjNotFoundError
+from swh.objstorage.factory import get_objstorage
+from swh.objstorage.interface import HashDict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 100 * 2**30
+# fraction of max_size the cache is shrunk to when evicting
+LOW_WATERMARK = 0.9
+# how often the access times of hit objects are written to the index, and the
+# size of the cache (shared by all the processes using it) is read back
+SYNC_INTERVAL = 5.0
+# number of (file) locks used to serialize the misses on the same object
+LOCK_STRIPES = 4096
+HASH_ALGOS = ("sha256", "sha1", "sha1_git", "blake2s256")
+
+REQUESTS_METRIC = "swh_objstorage_cache_requests_total"
+BYTES_METRIC = "swh_objstorage_cache_bytes_total"
+SIZE_METRIC = "swh_objstorage_cache_size_bytes"
+
+SCHEMA = """
+pragma journal_mode = wal;
+pragma synchronous = normal;
+create table if not exists object (
+  key text primary key,
+  size integer not null,
+  atime real not null
+) without rowid;
+create index if not exists object_atime on object(atime);
+"""
+
+
+class ObjStorageCache:
+    """Objstorage proxy keeping the objects read from the wrapped objstorage
+    in a local directory, up to ``max_size`` bytes.
+
+    Objects are stored uncompressed, one file each, in a 2-level slicing of
+    ``root``, and indexed in a SQLite database (in the same directory) holding
+    their size and last access time, so the cache can be shared by the worker
+    processes of a server. When it grows over ``max_size``, the least recently
+    used objects are evicted. Concurrent misses on the same object (from any
+    process) are serialized by file locks, so only the first one reads it from
+    the backend, e.g. without using the read bandwidth allowed by a winery
+    throttler; the eviction of an object takes the same lock, so its file and
+    its index row are always removed together.
+
+    Sample configuration use case for the cache::
+
+        objstorage_cache:
+          root: /srv/softwareheritage/objstorage-cache
+          max_size: 100_000_000_000
+    """
+
+    def __init__(
+        self,
+        objstorage: Union[Dict[str, Any], Any],
+        root: str,
+        max_size: int = DEFAULT_MAX_SIZE,
+    ):
+        self.objstorage = (
+            get_objstorage(**objstorage) if isinstance(objstorage, dict) else objstorage
+        )
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(os.path.join(root, "locks"), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(
+            os.path.join(root, "index.sqlite"), timeout=60, check_same_thread=False
+        )
+        self.db.executescript(SCHEMA)
+        self.touched: Set[str] = set()
+        self.last_sync = time.monotonic()
+        self.size = self.stored_size()
+        logger.info("Opened objstorage cache %s (%s bytes)", root, self.size)
+
+    def __getattr__(self, key):
+        if key == "objstorage":
+            raise AttributeError(key)
+        return getattr(self.objstorage, key)
+
+    def key(self, obj_id: HashDict) -> str:
+        primary = getattr(self.objstorage, "primary_hash", None)
+        for algo in (primary, *HASH_ALGOS):
+            if algo and obj_id.get(algo):
+                return f"{algo}-{obj_id[algo].hex()}"  # type: ignore[literal-required]
+        raise ObjNotFoundError(obj_id)
+
+    def path(self, key: str) -> str:
+        hexid = key.split("-", 1)[1]
+        return os.path.join(self.root, hexid[0:2], hexid[2:4], key)
+
+    def stored_size(self) -> int:
+        with self.lock:
+            (size,) = self.db.execute(
+                "select coalesce(sum(size), 0) from object"
+            ).fetchone()
+        return size
+
+    @contextmanager
+    def fill_lock(self, key: str) -> Iterator[None]:
+        hexid = key.split("-", 1)[1]
+        stripe = int(hexid[:4], 16) % LOCK_STRIPES
+        fd = os.open(
+            os.path.join(self.root, "locks", f"{stripe:04x}"), os.O_CREAT | os.O_RDWR
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def read(self, key: str) -> Optional[bytes]:
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def account(self, result: str, nbytes: int) -> None:
+        statsd.increment(REQUESTS_METRIC, tags={"result": result})
+        statsd.increment(BYTES_METRIC, nbytes, tags={"result": result})
+
+    def get(self, obj_id: HashDict) -> bytes:
+        key = self.key(obj_id)
+        data = self.read(key)
+        result = "hit"
+        if data is None:
+            with self.fill_lock(key):
+                # the object may have been added while waiting for the lock
+                data = self.read(key)
+                if data is None:
+                    data = self.objstorage.get(obj_id)
+                    self.store(key, data)
+                    result = "miss"
+                else:
+                    result = "coalesced"
+        self.account(result, len(data))
+        if result == "miss":
+            self.sync()
+            # out of the fill lock, which the eviction may need
+            if self.size > self.max_size:
+                self.evict()
+        else:
+            with self.lock:
+                self.touched.add(key)
+            self.sync()
+        return data
+
+    def get_batch(self, obj_ids: Iterable[HashDict]) -> Iterator[Optional[bytes]]:
+        for obj_id in obj_ids:
+            try:
+                yield self.get(obj_id)
+            except ObjNotFoundError:
+                yield None
+
+    def store(self, key: str, data: bytes) -> None:
+        """Write an object and its index row; the fill lock of ``key`` must be
+        held, so they are not evicted in between"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        # index first, so a crash never leaves an object which can't be evicted
+        with self.lock, self.db:
+            row = self.db.execute(
+                "select size from object where key = ?", (key,)
+            ).fetchone()
+            self.db.execute(
+                "insert or replace into object (key, size, atime) values (?, ?, ?)",
+                (key, len(data), time.time()),
+            )
+            self.size += len(data) - (row[0] if row else 0)
+        os.replace(tmp, path)
+
+    def sync(self, force: bool = False) -> None:
+        """Write the access times of the objects hit since the last sync and
+        read back the total size of the cache"""
+        now = time.monotonic()
+        if not force and now - self.last_sync < SYNC_INTERVAL:
+            return
+        with self.lock:
+            self.last_sync = now
+            touched, self.touched = self.touched, set()
+            with self.db:
+                self.db.executemany(
+                    "update object set atime = ? where key = ?",
+                    [(time.time(), key) for key in touched],
+                )
+            (self.size,) = self.db.execute(
+                "select coalesce(sum(size), 0) from object"
+            ).fetchone()
+        statsd.gauge(SIZE_METRIC, self.size)
+
+    def evict(self) -> None:
+        """Evict the least recently used objects until the cache is under its
+        low watermark (unless another process is already evicting)"""
+        fd = os.open(os.path.join(self.root, "locks", "evict"), os.O_CREAT | os.O_RDWR)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return
+            target = int(self.max_size * LOW_WATERMARK)
+            candidates: List[str] = []
+            with self.lock:
+                (size,) = self.db.execute(
+                    "select coalesce(sum(size), 0) from object"
+                ).fetchone()
+                cursor = self.db.execute("select key, size from object order by atime")
+                while size > target:
+                    rows = cursor.fetchmany(1000)
+                    if not rows:
+                        break
+                    for key, obj_size in rows:
+                        if size <= target:
+                            break
+                        candidates.append(key)
+                        size -= obj_size
+                cursor.close()
+            evicted = 0
+            for key in candidates:
+                # the row and the file of an object are removed together, so
+                # a concurrent miss can not write the file of a removed row
+                with self.fill_lock(key):
+                    with self.lock, self.db:
+                        evicted += self.db.execute(
+                            "delete from object where key = ?", (key,)
+                        ).rowcount
+                    try:
+                        os.unlink(self.path(key))
+                    except FileNotFoundError:
+                        pass
+        finally:
+            os.close(fd)
+        self.sync(force=True)
+        if evicted:
+            logger.debug("Evicted %s objects from %s", evicted, self.root)
+            statsd.increment("swh_objstorage_cache_evicted_total", evicted)
+
+
+def make_app_from_configfile():
+    """Run the objstorage RPC server, with the read cache configured in the
+    objstorage_cache section of the config file in front of its objstorage"""
+    cfg = server.load_and_check_config(os.environ.get("SWH_CONFIG_FILENAME"))
+    if cfg.get("objstorage_cache"):
+        server.objstorage = ObjStorageCache(
+            cfg["objstorage"], **cfg["objstorage_cache"]
+        )
+    return server.make_app_from_configfile()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# bulk copy of a pathslicing objstorage into a winery one, e.g. to move an
+# existing mirror from the basic deployment to the advanced one without
+# replaying the content topic again
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import click
+from init_pathslicer_root import get_slicer
+from swh.core.config import read as config_read
+from swh.objstorage.factory import get_objstorage
+from swh.objstorage.interface import HashDict
+from swh.objstorage.objstorage import objid_for_content
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+# max size of a write batch, in bytes
+MAX_BATCH_BYTES = 64 * 2**20
+CHECKPOINT_INTERVAL = 10.0
+
+
+class Throttler:
+    """Token bucket limiting a flow to ``bps`` bytes per second (on average
+    over one second)"""
+
+    def __init__(self, bps: Optional[int]):
+        self.bps = bps
+        self.tokens = float(bps or 0)
+        self.last = time.monotonic()
+
+    def consume(self, nbytes: int) -> None:
+        if not self.bps:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.last) * self.bps, self.bps)
+        self.last = now
+        self.tokens -= nbytes
+        if self.tokens < 0:
+            time.sleep(-self.tokens / self.bps)
+
+
+def iter_leaf_dirs(root: str, depth: int, after: Optional[str]) -> Iterator[str]:
+    """Yield the leaf directories of a pathslicing tree (relative to
+    ``root``), in lexicographic order, starting after ``after``"""
+
+    def walk(path: str, level: int) -> Iterator[str]:
+        with os.scandir(os.path.join(root, path)) as entries:
+            names = sorted(
+                entry.name for entry in entries if entry.is_dir(follow_symlinks=False)
+            )
+        for name in names:
+            subpath = os.path.join(path, name)
+            if after is not None and subpath < after[: len(subpath)]:
+                continue
+            if level + 1 < depth:
+                yield from walk(subpath, level + 1)
+            elif after is None or subpath > after:
+                yield subpath
+
+    if depth:
+        yield from walk("", 0)
+    elif after is None:
+        yield ""
+
+
+class Migration:
+    """Copy the objects of a pathslicing objstorage to another objstorage.
+
+    The copy is a pipeline of three stages connected by bounded queues:
+
+    - ``read_workers`` threads read (and decompress) the objects of the leaf
+      directories, in lexicographic order,
+    - ``verify_workers`` threads hash them, check their sha1 matches their file
+      name and compute the other hashes (winery is indexed by sha256),
+    - the writer adds them in batches to the destination, within its
+      ``max_write_bps`` limit.
+
+    Progress is checkpointed as the last leaf directory all the objects of
+    which (and of all the previous directories) have been written, so an
+    interrupted migration can be resumed.
+
+    When a stage fails (e.g. the destination rejects a batch), all the stages
+    stop, and the error is raised by :meth:`run`.
+    """
+
+    def __init__(
+        self,
+        src_cfg: Dict[str, Any],
+        dst_cfg: Dict[str, Any],
+        checkpoint: str,
+        read_workers: int = 4,
+        verify_workers: int = 4,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        max_write_bps: Optional[int] = None,
+    ):
+        self.slicer = get_slicer(src_cfg)
+        self.src = get_objstorage(**src_cfg)
+        self.dst = get_objstorage(**dst_cfg)
+        self.checkpoint_file = checkpoint
+        self.read_workers = read_workers
+        self.verify_workers = verify_workers
+        self.batch_size = batch_size
+        self.throttler = Throttler(max_write_bps)
+
+        self.read_queue: queue.Queue = queue.Queue(maxsize=4 * batch_size)
+        self.write_queue: queue.Queue = queue.Queue(maxsize=4 * batch_size)
+        self.stats = {"objects": 0, "bytes": 0, "mismatches": 0, "errors": 0}
+        self.checkpoint = self.load_checkpoint()
+        # leaf directories in the order they are read; dir -> [objects not
+        # written yet, whether it has been read completely]
+        self.lock = threading.Lock()
+        self.pending: Dict[str, List[Any]] = {}
+        self.order: Deque[str] = deque()
+        # set when a stage fails, to stop the other ones
+        self.stop = threading.Event()
+        self.error: Optional[BaseException] = None
+
+    def load_checkpoint(self) -> Dict[str, Any]:
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as f:
+                checkpoint = json.load(f)
+            self.stats.update(checkpoint["stats"])
+            logger.info("Resuming after %s", checkpoint["last_dir"])
+            return checkpoint
+        return {"last_dir": None, "stats": self.stats}
+
+    def save_checkpoint(self) -> None:
+        self.checkpoint["stats"] = dict(self.stats)
+        tmp = self.checkpoint_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(tmp, self.checkpoint_file)
+
+    def fail(self, exc: BaseException) -> None:
+        with self.lock:
+            if self.error is None:
+                self.error = exc
+        self.stop.set()
+
+    def stage(self, target: Callable[[], None]) -> Callable[[], None]:
+        """Wrap the main function of a stage thread so that its failure stops
+        the migration"""
+
+        def run() -> None:
+            try:
+                target()
+            except BaseException as exc:
+                logger.exception("%s failed, stopping", target.__name__)
+                self.fail(exc)
+
+        return run
+
+    def put(self, q: queue.Queue, item: Any) -> bool:
+        """Put ``item`` in ``q``, unless the migration is stopped"""
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, q: queue.Queue, timeout: Optional[float] = None) -> Any:
+        """Get an item from ``q``; None once the migration is stopped (or at
+        the end of the stream); raise queue.Empty after ``timeout``"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=1.0)
+            except queue.Empty:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise
+        return None
+
+    def read_dir(self, leaf: str) -> None:
+        directory = os.path.join(self.slicer.root, leaf)
+        for name in sorted(os.listdir(directory)):
+            if self.stop.is_set():
+                return
+            try:
+                obj_id = bytes.fromhex(name)
+            except ValueError:
+                # temporary or stray file
+                continue
+            with self.lock:
+                self.pending[leaf][0] += 1
+            try:
+                data = self.src.get({"sha1": obj_id})
+            except Exception:
+                logger.exception("Failed to read %s", name)
+                self.done(leaf, 1, error="errors")
+                continue
+            if not self.put(self.read_queue, (leaf, obj_id, data)):
+                return
+        self.done(leaf, read=True)
+
+    def verify(self) -> None:
+        while True:
+            item = self.get(self.read_queue)
+            if item is None:
+                return
+            leaf, obj_id, data = item
+            hashes = objid_for_content(data)
+            if hashes["sha1"] != obj_id:
+                logger.error(
+                    "Hash mismatch for %s (actual sha1 %s)",
+                    obj_id.hex(),
+                    hashes["sha1"].hex(),
+                )
+                self.done(leaf, 1, error="mismatches")
+                continue
+            if not self.put(self.write_queue, (leaf, hashes, data)):
+                return
+
+    def done(
+        self, leaf: str, count: int = 0, read: bool = False, error: str = ""
+    ) -> None:
+        """Account for ``count`` objects of ``leaf`` written (or given up on,
+        counted in the ``error`` stats) and advance the checkpoint past the
+        leaf directories which are completely written"""
+        with self.lock:
+            self.pending[leaf][0] -= count
+            if error:
+                self.stats[error] += count
+            if read:
+                self.pending[leaf][1] = True
+            while self.order:
+                first = self.order[0]
+                remaining, complete = self.pending[first]
+                if remaining or not complete:
+                    break
+                self.order.popleft()
+                del self.pending[first]
+                self.checkpoint["last_dir"] = first
+
+    def flush(self, batch: List[Tuple[str, HashDict, bytes]]) -> None:
+        if not batch:
+            return
+        nbytes = sum(len(data) for _, _, data in batch)
+        self.throttler.consume(nbytes)
+        self.dst.add_batch([(hashes, data) for _, hashes, data in batch])
+        self.stats["objects"] += len(batch)
+        self.stats["bytes"] += nbytes
+        counts: Dict[str, int] = {}
+        for leaf, _, _ in batch:
+            counts[leaf] = counts.get(leaf, 0) + 1
+        for leaf, count in counts.items():
+            self.done(leaf, count)
+        batch.clear()
+
+    def write(self) -> None:
+        batch: List[Tuple[str, HashDict, bytes]] = []
+        batch_bytes = 0
+        t0 = last_checkpoint = time.monotonic()
+        objects0 = self.stats["objects"]
+        bytes0 = self.stats["bytes"]
+        while True:
+            try:
+                item = self.get(self.write_queue, timeout=1.0)
+            except queue.Empty:
+                # nothing to write for now, let the checkpoint progress
+                self.flush(batch)
+                batch_bytes = 0
+                continue
+            if item is None:
+                if self.stop.is_set():
+                    # the objects of the pending batch may not be verified
+                    return
+                break
+            batch.append(item)
+            batch_bytes += len(item[2])
+            if len(batch) >= self.batch_size or batch_bytes >= MAX_BATCH_BYTES:
+                self.flush(batch)
+                batch_bytes = 0
+
+            now = time.monotonic()
+            if now - last_checkpoint >= CHECKPOINT_INTERVAL:
+                last_checkpoint = now
+                self.save_checkpoint()
+                logger.info(
+                    "%s objects (%s bytes) copied, %.1f obj/s, %.1f MB/s, " "up to %s",
+                    self.stats["objects"],
+                    self.stats["bytes"],
+                    (self.stats["objects"] - objects0) / (now - t0),
+                    (self.stats["bytes"] - bytes0) / (now - t0) / 1e6,
+                    self.checkpoint["last_dir"],
+                )
+        self.flush(batch)
+        self.save_checkpoint()
+
+    def run(self) -> Dict[str, int]:
+        leaves = list(
+            iter_leaf_dirs(
+                self.slicer.root, len(self.slicer), self.checkpoint["last_dir"]
+            )
+        )
+        logger.info("%s leaf directories to copy", len(leaves))
+        for leaf in leaves:
+            self.pending[leaf] = [0, False]
+            self.order.append(leaf)
+
+        verifiers = [
+            threading.Thread(target=self.stage(self.verify))
+            for _ in range(self.verify_workers)
+        ]
+        writer = threading.Thread(target=self.stage(self.write))
+        for thread in verifiers + [writer]:
+            thread.start()
+        try:
+            with ThreadPoolExecutor(self.read_workers) as pool:
+                for _ in pool.map(self.read_dir, leaves):
+                    pass
+        except BaseException as exc:
+            self.fail(exc)
+            raise
+        finally:
+            for _ in verifiers:
+                self.put(self.read_queue, None)
+            for verifier in verifiers:
+                verifier.join()
+            self.put(self.write_queue, None)
+            writer.join()
+        if self.error is not None:
+            # directories completely written before the failure are not
+            # copied again
+            self.save_checkpoint()
+            raise self.error
+        return self.stats
+
+
+@click.command()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+    help="Configuration file with the objstorage (source, pathslicing) and "
+    "objstorage_dst (destination, winery) sections",
+)
+@click.option(
+    "--checkpoint",
+    default="pathslicer-to-winery.json",
+    show_default=True,
+    type=click.Path(dir_okay=False),
+)
+@click.option("--read-workers", default=4, show_default=True)
+@click.option("--verify-workers", default=4, show_default=True)
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option(
+    "--max-write-bps",
+    type=int,
+    help="Write rate limit, in bytes per second; defaults to the throttler "
+    "max_write_bps of the destination",
+)
+def main(
+    config_file,
+    checkpoint,
+    read_workers,
+    verify_workers,
+    batch_size,
+    max_write_bps,
+):
+    """Copy the objects of a pathslicing objstorage into a winery objstorage
+
+    The destination must already be the one the content replayer writes to,
+    so that objects added to the mirror while the migration runs are not lost.
+    """
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file)
+    src_cfg = cfg["objstorage"]
+    if src_cfg.get("cls") != "pathslicing":
+        raise click.ClickException("The source objstorage must be a pathslicing one")
+    dst_cfg = cfg["objstorage_dst"]
+    if max_write_bps is None:
+        max_write_bps = (dst_cfg.get("throttler") or {}).get("max_write_bps")
+
+    t0 = time.monotonic()
+    stats = Migration(
+        src_cfg,
+        dst_cfg,
+        checkpoint,
+        read_workers=read_workers,
+        verify_workers=verify_workers,
+        batch_size=batch_size,
+        max_write_bps=max_write_bps,
+    ).run()
+    logger.info(
+        "Done in %.1fs: %s objects (%s bytes) copied, %s hash mismatches, "
+        "%s read errors",
+        time.monotonic() - t0,
+        stats["objects"],
+        stats["bytes"],
+        stats["mismatches"],
+        stats["errors"],
+    )
+    if stats["mismatches"] or stats["errors"]:
+        raise click.ClickException("Some objects could not be copied")
+
+
+if __name__ == "__main__":
+    main()
@@ -97,29 +97,12 @@ wait_pgsql () {
     fi
 
     echo Waiting for postgresql service ${db_to_check} to be available.
-    until check_pgsql_db_created ${db_to_check}
-  do
-    echo -n "."
-    sleep 1;
-  done
-}
-
-check_pgsql_db_created () {
-  psql service=$1 -c "select 1" >/dev/null 2>&1
+    python3 /srv/softwareheritage/utils/readiness.py wait pg:${db_to_check}
 }
 
 swh_setup_db() {
   wait_pgsql
 
   echo "Database setup for $1 (db=postgresql:///?service=${NAME})"
-
-  echo " step 1: Creating extensions..."
-  swh db init-admin --all $1
-
-  echo " step 2: Initializing the database..."
-  swh db init --flavor ${DB_FLAVOR:-default} --all $1
-
-  echo " step 3: upgrade"
-  swh db upgrade --non-interactive --all $1
-
+  python3 /srv/softwareheritage/utils/setup_db.py --flavor ${DB_FLAVOR:-default} $1
 }
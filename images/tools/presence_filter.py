@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# persistent bloom filter of the objects of the content replayer's
+# destination objstorage, built once from its pathslicing tree or winery
+# index, then updated by the replayer itself, which looks the objects of each
+# journal batch up in it before fetching anything
+
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+import functools
+import logging
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+import click
+from init_pathslicer_root import get_slicer
+from pathslicer_to_winery import iter_leaf_dirs
+import psycopg
+import replication_freshness
+from swh.core.config import read as config_read
+from swh.core.statsd import statsd
+from swh.objstorage.constants import ID_HEXDIGEST_LENGTH_BY_ALGO
+from swh.objstorage.replayer import replay
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 1_000_000_000
+# probability for an object not in the destination to be seen as present,
+# hence not replicated; this is about 34 bits (and 23 probes) per object
+DEFAULT_ERROR_RATE = 1e-7
+DEFAULT_BATCH_SIZE = 100_000
+# how often the progress of a build is logged
+LOG_INTERVAL = 60.0
+# how often the filter is synced to disk by the replayer
+FLUSH_INTERVAL = 60.0
+
+# magic, primary hash (nul padded), number of bits, number of probes
+HEADER = struct.Struct("<8s16sQQ")
+MAGIC = b"SWHBLOOM"
+# the bit array starts at a page boundary
+HEADER_SIZE = 4096
+
+FILTER_METRIC = "swh_content_replayer_presence_filter_total"
+
+
+class PresenceFilter:
+    """Bloom filter of the object ids (hashes) of an objstorage, in a memory
+    mapped file.
+
+    As object ids are cryptographic hashes, the probe positions are derived
+    from the ids themselves (double hashing on their first 16 bytes). The
+    file is shared by all the processes using it: concurrent updates of the
+    same byte may lose a bit, which only makes an object look absent (and be
+    checked or copied as if there was no filter); a bit is never set for an
+    object which is not there.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        with open(path, "r+b") as f:
+            self.map = mmap.mmap(f.fileno(), 0)
+        magic, algo, self.nbits, self.nprobes = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a presence filter")
+        self.algo = algo.rstrip(b"\0").decode()
+        self.last_flush = time.monotonic()
+
+    @classmethod
+    def create(
+        cls,
+        path: str,
+        algo: str = "sha1",
+        capacity: int = DEFAULT_CAPACITY,
+        error_rate: float = DEFAULT_ERROR_RATE,
+    ) -> str:
+        """Create an empty filter sized for ``capacity`` objects in a
+        temporary file; return its path"""
+        if algo not in ID_HEXDIGEST_LENGTH_BY_ALGO:
+            raise ValueError(f"Unknown hash algorithm {algo}")
+        nbits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        nbits = -(-nbits // 8) * 8
+        nprobes = max(1, round(nbits / capacity * math.log(2)))
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, algo.encode(), nbits, nprobes))
+            f.truncate(HEADER_SIZE + nbits // 8)
+        logger.info(
+            "Created a %s bytes filter of %s ids (%s probes)",
+            nbits // 8,
+            algo,
+            nprobes,
+        )
+        return tmp
+
+    @classmethod
+    def open(cls, path: str, **kwargs) -> "PresenceFilter":
+        """Open the filter ``path``, creating an empty one if needed"""
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = cls.create(path, **kwargs)
+            try:
+                # do not replace a filter created by another replica meanwhile
+                os.link(tmp, path)
+                logger.warning("Created an empty presence filter %s", path)
+            except FileExistsError:
+                pass
+            finally:
+                os.unlink(tmp)
+        return cls(path)
+
+    def positions(self, key: bytes) -> Iterator[int]:
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        for i in range(self.nprobes):
+            yield (h1 + i * h2) % self.nbits
+
+    def add_many(self, keys: Iterable[bytes]) -> None:
+        map_ = self.map
+        with self.lock:
+            for key in keys:
+                for pos in self.positions(key):
+                    offset = HEADER_SIZE + (pos >> 3)
+                    map_[offset] |= 1 << (pos & 7)
+
+    def contains_many(self, keys: Iterable[bytes]) -> List[bool]:
+        map_ = self.map
+        return [
+            all(
+                map_[HEADER_SIZE + (pos >> 3)] & (1 << (pos & 7))
+                for pos in self.positions(key)
+            )
+            for key in keys
+        ]
+
+    def fill_ratio(self) -> float:
+        """Fraction of the bits which are set"""
+        ones = 0
+        for offset in range(HEADER_SIZE, len(self.map), 2**20):
+            ones += int.from_bytes(
+                self.map[offset : offset + 2**20], "big"
+            ).bit_count()
+        return ones / self.nbits
+
+    def flush(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if force or now - self.last_flush >= FLUSH_INTERVAL:
+            self.map.flush()
+            self.last_flush = now
+
+    def close(self) -> None:
+        self.map.flush()
+        self.map.close()
+
+
+class FilteredContentReplayer(replay.ContentReplayer):
+    """Content replayer skipping the objects of a batch found in a presence
+    filter, without any request to the source or destination objstorage; the
+    objects copied to (or found in) the destination are added to the filter.
+    """
+
+    def __init__(self, *args, presence_filter: PresenceFilter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.presence_filter = presence_filter
+
+    def _copy_object(self, obj, src, dst):
+        decision, copied_bytes = super()._copy_object(obj, src=src, dst=dst)
+        if decision in ("copied", "in_dst"):
+            self.presence_filter.add_many([obj[self.presence_filter.algo]])
+        return decision, copied_bytes
+
+    def replay(self, all_objects: Dict[str, List[dict]]):
+        algo = self.presence_filter.algo
+        contents = all_objects.get("content", [])
+        candidates = [
+            obj
+            for obj in contents
+            if obj.get("status") == "visible" and obj.get(algo) is not None
+        ]
+        present = {
+            id(obj)
+            for obj, found in zip(
+                candidates,
+                self.presence_filter.contains_many(obj[algo] for obj in candidates),
+            )
+            if found
+        }
+        if present:
+            statsd.increment(
+                replay.CONTENT_OPERATIONS_METRIC,
+                len(present),
+                tags={"decision": "in_dst", "status": "in_filter"},
+            )
+            logger.info("skipped %s content objects found in the filter", len(present))
+        statsd.increment(FILTER_METRIC, len(present), tags={"result": "hit"})
+        statsd.increment(
+            FILTER_METRIC, len(candidates) - len(present), tags={"result": "miss"}
+        )
+        remaining = [obj for obj in contents if id(obj) not in present]
+        if remaining:
+            super().replay({**all_objects, "content": remaining})
+        self.presence_filter.flush()
+
+
+# build workers: each process opens the filter being built once
+
+_build_filter: Optional[PresenceFilter] = None
+
+
+def _init_build_worker(path: str) -> None:
+    global _build_filter
+    _build_filter = PresenceFilter(path)
+
+
+def _add_keys(keys: List[bytes]) -> int:
+    assert _build_filter is not None
+    _build_filter.add_many(keys)
+    return len(keys)
+
+
+def _add_leaf_dir(root: str, hexlen: int, leaf: str) -> int:
+    keys = []
+    with os.scandir(os.path.join(root, leaf)) as entries:
+        for entry in entries:
+            # skip the temporary files of objects being written
+            if len(entry.name) == hexlen:
+                try:
+                    keys.append(bytes.fromhex(entry.name))
+                except ValueError:
+                    pass
+    return _add_keys(keys)
+
+
+def iter_winery_batches(db: str, batch_size: int) -> Iterator[List[bytes]]:
+    """Stream the ids of the objects present in a winery objstorage"""
+    with psycopg.connect(db) as conn:
+        with conn.cursor(name="presence_filter") as cur:
+            cur.itersize = batch_size
+            cur.execute("select signature from signature2shard where state = 'present'")
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [bytes(signature) for (signature,) in rows]
+
+
+def build_filter(
+    source: Dict[str, Any],
+    path: str,
+    capacity: int = DEFAULT_CAPACITY,
+    error_rate: float = DEFAULT_ERROR_RATE,
+    workers: int = 4,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> int:
+    """Build the filter of the objects of the ``source`` objstorage (the
+    backend behind the replayer's objstorage_dst) and atomically replace
+    ``path`` with it; return the number of objects added"""
+    if source["cls"] == "pathslicing":
+        slicer = get_slicer(source)
+        algo = slicer.primary_hash
+    elif source["cls"] == "winery":
+        algo = "sha256"
+    else:
+        raise ValueError(f"Cannot list the objects of a {source['cls']} objstorage")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = PresenceFilter.create(path, algo, capacity, error_rate)
+    task: Callable[[Any], int]
+    if source["cls"] == "pathslicing":
+        task = functools.partial(
+            _add_leaf_dir, source["root"], ID_HEXDIGEST_LENGTH_BY_ALGO[algo]
+        )
+        items: Iterable[Any] = iter_leaf_dirs(source["root"], len(slicer), None)
+    else:
+        task = _add_keys
+        items = iter_winery_batches(source["database"]["db"], batch_size)
+    t0 = last_log = time.monotonic()
+    count = 0
+    try:
+        with ProcessPoolExecutor(
+            workers, initializer=_init_build_worker, initargs=(tmp,)
+        ) as pool:
+            # bounded number of tasks in flight, so the listing is streamed
+            running: Set[Future] = set()
+            for item in items:
+                running.add(pool.submit(task, item))
+                if len(running) >= 4 * workers:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    count += sum(future.result() for future in done)
+                if time.monotonic() - last_log >= LOG_INTERVAL:
+                    last_log = time.monotonic()
+                    logger.info("Added %s objects", count)
+            count += sum(future.result() for future in running)
+        filter_ = PresenceFilter(tmp)
+        filter_.close()
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    logger.info("Built the filter of %s objects in %.1fs", count, time.monotonic() - t0)
+    if count > capacity:
+        logger.warning(
+            "The filter is over its capacity (%s), its error rate is higher "
+            "than expected",
+            capacity,
+        )
+    return count
+
+
+@click.group()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+    help="Configuration file of the content replayer, with a presence_filter "
+    "section",
+)
+@click.pass_context
+def cli(ctx, config_file):
+    """Presence filter of the content replayer's destination objstorage"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file)
+    ctx.obj = {
+        "config_file": config_file,
+        "config": cfg,
+        **cfg.get("presence_filter", {}),
+    }
+
+
+@cli.command()
+@click.option("--workers", default=4, help="Number of worker processes")
+@click.pass_obj
+def build(obj, workers):
+    """Build the filter from the objects of its source objstorage
+
+    The replayers using the previous filter (if any) must be restarted.
+    """
+    if "source" not in obj:
+        raise click.ClickException("No source objstorage in presence_filter")
+    build_filter(
+        obj["source"],
+        obj["path"],
+        capacity=obj.get("capacity", DEFAULT_CAPACITY),
+        error_rate=obj.get("error_rate", DEFAULT_ERROR_RATE),
+        workers=workers,
+    )
+
+
+@cli.command()
+@click.pass_obj
+def info(obj):
+    """Show the size and fill ratio of the filter"""
+    filter_ = PresenceFilter(obj["path"])
+    ratio = filter_.fill_ratio()
+    click.echo(f"hash: {filter_.algo}")
+    click.echo(f"size: {filter_.nbits // 8} bytes, {filter_.nprobes} probes")
+    click.echo(f"fill ratio: {ratio:.4f}")
+    click.echo(f"error rate: {ratio ** filter_.nprobes:.2e}")
+    if ratio < 1:
+        # estimated number of objects, from the fill ratio
+        estimate = -filter_.nbits / filter_.nprobes * math.log(1 - ratio)
+        click.echo(f"objects: ~{int(estimate)}")
+
+
+@cli.command(context_settings={"ignore_unknown_options": True})
+@click.argument("args", nargs=-1, type=click.UNPROCESSED)
+@click.pass_obj
+def run(obj, args):
+    """Run ``swh objstorage replay ARGS``, using the filter if configured"""
+    replication_freshness.install()
+    if obj.get("path"):
+        filter_ = PresenceFilter.open(
+            obj["path"],
+            algo=obj.get("algo", "sha1"),
+            capacity=obj.get("capacity", DEFAULT_CAPACITY),
+            error_rate=obj.get("error_rate", DEFAULT_ERROR_RATE),
+        )
+        logger.info("Using the presence filter %s", obj["path"])
+        replay.ContentReplayer = functools.partial(  # type: ignore[misc]
+            FilteredContentReplayer, presence_filter=filter_
+        )
+    from swh.core.cli import main as swh_main
+
+    config_opt = ["-C", obj["config_file"]] if obj["config_file"] else []
+    sys.argv = ["swh", "objstorage", *config_opt, "replay", *args]
+    swh_main()
+
+
+if __name__ == "__main__":
+    cli()
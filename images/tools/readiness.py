@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# wait for the services a container depends on to be ready, probing them (and
+# their own dependencies) in parallel with an exponential backoff, and report
+# the time each of them took to be ready
+
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import click
+from confluent_kafka.admin import AdminClient
+import psycopg
+from replication_lag import kafka_admin_config
+import requests
+from swh.core.config import read as config_read
+
+logger = logging.getLogger(__name__)
+
+INITIAL_DELAY = 0.1
+MAX_DELAY = 5.0
+PROBE_TIMEOUT = 5.0
+
+# the services of the mirror stacks: name -> (probe, dependencies); a service
+# is only probed once its dependencies are ready. The storage backend (pg or
+# cassandra, depending on the stack) is waited for by the storage itself.
+SERVICES: Dict[str, Tuple[str, List[str]]] = {
+    "storage-db": ("tcp:storage-db:5432", []),
+    "masking-proxy-db": ("tcp:masking-proxy-db:5432", []),
+    "web-db": ("tcp:web-db:5432", []),
+    "vault-db": ("tcp:vault-db:5432", []),
+    "scheduler-db": ("tcp:scheduler-db:5432", []),
+    "amqp": ("tcp:amqp:5672", []),
+    "redis": ("tcp:redis:6379", []),
+    "memcache": ("tcp:memcache:11211", []),
+    "elasticsearch": ("http://elasticsearch:9200/", []),
+    "kafka": ("kafka", []),
+    "objstorage": ("http://objstorage:5003/", []),
+    "storage": ("http://storage:5002/", []),
+    "storage-public": ("http://storage-public:5002/", ["storage", "masking-proxy-db"]),
+    "search": ("http://search:5010/", ["elasticsearch"]),
+    "scheduler": ("http://scheduler:5008/", ["scheduler-db", "amqp"]),
+    "vault": ("http://vault:5005/", ["vault-db", "storage-public", "scheduler"]),
+    "web": ("http://web:5004/", ["web-db", "storage-public", "search", "vault"]),
+}
+
+
+def backoff(
+    initial: float = INITIAL_DELAY, max_delay: float = MAX_DELAY
+) -> Iterator[float]:
+    """Exponentially increasing delays, capped to ``max_delay``"""
+    delay = initial
+    while True:
+        yield delay
+        delay = min(delay * 2, max_delay)
+
+
+class Probe:
+    """Check whether a service is ready; ``check`` raises if it is not"""
+
+    def check(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class TcpProbe(Probe):
+    def __init__(self, host: str, port: int):
+        self.address = (host, port)
+
+    def check(self) -> None:
+        socket.create_connection(self.address, timeout=PROBE_TIMEOUT).close()
+
+
+class HttpProbe(Probe):
+    def __init__(self, url: str):
+        self.url = url
+        self.session = requests.Session()
+
+    def check(self) -> None:
+        self.session.get(self.url, timeout=PROBE_TIMEOUT).raise_for_status()
+
+    def close(self) -> None:
+        self.session.close()
+
+
+class PgProbe(Probe):
+    """Run ``select 1`` on a database, reusing the same connection between
+    attempts once it could be established"""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        self.db = None
+
+    def check(self) -> None:
+        if self.db is None or self.db.closed:
+            self.db = psycopg.connect(
+                self.dsn, connect_timeout=int(PROBE_TIMEOUT), autocommit=True
+            )
+        self.db.execute("select 1")
+
+    def close(self) -> None:
+        if self.db is not None:
+            self.db.close()
+
+
+class KafkaProbe(Probe):
+    """Fetch the cluster metadata, using the journal_client section of the
+    SWH config file"""
+
+    def __init__(self):
+        cfg = config_read(os.environ["SWH_CONFIG_FILENAME"])
+        self.admin = AdminClient(kafka_admin_config(cfg["journal_client"]))
+
+    def check(self) -> None:
+        if not self.admin.list_topics(timeout=PROBE_TIMEOUT).brokers:
+            raise ConnectionError("No kafka broker available")
+
+
+def get_probe(spec: str) -> Probe:
+    """Build a probe from its spec: tcp:host:port, pg:<libpq service or
+    dsn>, kafka or an HTTP(S) URL"""
+    if spec.startswith("tcp:"):
+        host, port = spec[4:].rsplit(":", 1)
+        return TcpProbe(host, int(port))
+    if spec.startswith("pg:"):
+        dsn = spec[3:]
+        return PgProbe(dsn if "=" in dsn or "://" in dsn else f"service={dsn}")
+    if spec == "kafka":
+        return KafkaProbe()
+    if spec.startswith(("http://", "https://")):
+        return HttpProbe(spec)
+    raise ValueError(f"Unknown probe {spec}")
+
+
+def dependency_closure(
+    targets: List[str], services: Dict[str, Tuple[str, List[str]]]
+) -> Dict[str, Tuple[str, List[str]]]:
+    """Return the services to wait for: the targets and their transitive
+    dependencies; targets which are not known services are taken as probe
+    specs without dependencies"""
+    nodes: Dict[str, Tuple[str, List[str]]] = {}
+    to_visit = list(targets)
+    while to_visit:
+        name = to_visit.pop()
+        if name in nodes:
+            continue
+        nodes[name] = services.get(name, (name, []))
+        to_visit.extend(nodes[name][1])
+    return nodes
+
+
+class Readiness:
+    """Wait for a set of services, each probed by its own thread as soon as
+    its dependencies are ready"""
+
+    def __init__(
+        self,
+        targets: List[str],
+        services: Dict[str, Tuple[str, List[str]]] = SERVICES,
+    ):
+        self.nodes = dependency_closure(targets, services)
+        self.targets = targets
+        self.ready: Dict[str, threading.Event] = {
+            name: threading.Event() for name in self.nodes
+        }
+        # name -> seconds from the start of the wait to the service being ready
+        self.timeline: Dict[str, float] = {}
+        self.probes: Dict[str, Probe] = {}
+        self.stopped = threading.Event()
+        self.t0 = time.monotonic()
+
+    def wait_service(self, name: str) -> None:
+        probe = self.probes[name]
+        attempts = 0
+        try:
+            for dep in self.nodes[name][1]:
+                while not self.ready[dep].wait(1.0):
+                    if self.stopped.is_set():
+                        return
+            for delay in backoff():
+                attempts += 1
+                try:
+                    probe.check()
+                    break
+                except Exception as exc:
+                    logger.debug("%s not ready: %s", name, exc)
+                if self.stopped.wait(delay):
+                    return
+        finally:
+            probe.close()
+        self.timeline[name] = time.monotonic() - self.t0
+        logger.info(
+            "%s is ready after %.1fs (%s attempts)",
+            name,
+            self.timeline[name],
+            attempts,
+        )
+        self.ready[name].set()
+
+    def critical_path(self, name: str) -> List[str]:
+        """The chain of dependencies which were ready last, down from
+        ``name``"""
+        path = [name]
+        while self.nodes[path[-1]][1]:
+            path.append(
+                max(self.nodes[path[-1]][1], key=lambda dep: self.timeline[dep])
+            )
+        return path
+
+    def wait(self, timeout: Optional[float] = None) -> Dict[str, float]:
+        # build all the probes first, so an invalid spec or probe config fails
+        # the wait right away
+        try:
+            for name, (spec, _) in self.nodes.items():
+                self.probes[name] = get_probe(spec)
+        except Exception:
+            for probe in self.probes.values():
+                probe.close()
+            raise
+        threads = [
+            threading.Thread(target=self.wait_service, args=(name,), daemon=True)
+            for name in self.nodes
+        ]
+        for thread in threads:
+            thread.start()
+        deadline = None if timeout is None else self.t0 + timeout
+        for name in self.targets:
+            remaining = (
+                None if deadline is None else max(deadline - time.monotonic(), 0)
+            )
+            if not self.ready[name].wait(remaining):
+                self.stopped.set()
+                raise TimeoutError(
+                    "Services not ready: "
+                    + ", ".join(
+                        sorted(
+                            n for n, ready in self.ready.items() if not ready.is_set()
+                        )
+                    )
+                )
+        for name in self.targets:
+            path = self.critical_path(name)
+            if len(path) > 1:
+                logger.info(
+                    "%s critical path: %s",
+                    name,
+                    " <- ".join(f"{n} ({self.timeline[n]:.1f}s)" for n in path),
+                )
+        return dict(self.timeline)
+
+
+def wait_ready(targets: List[str], timeout: Optional[float] = None) -> Dict[str, float]:
+    """Wait for ``targets`` (names of known services or probe specs) and
+    their dependencies to be ready; return the time each took to be ready"""
+    return Readiness(targets).wait(timeout)
+
+
+@click.group()
+def cli():
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+
+
+@cli.command()
+@click.option("--timeout", type=float, help="Give up after this many seconds")
+@click.argument("targets", nargs=-1, required=True)
+def wait(timeout, targets):
+    """Wait for services to be ready
+
+    TARGETS are service names of the mirror stack (see SERVICES) or probe
+    specs: tcp:<host>:<port>, pg:<libpq service or dsn>, kafka (using the
+    journal_client section of the SWH config file) or an HTTP URL.
+    """
+    try:
+        wait_ready(list(targets), timeout)
+    except TimeoutError as exc:
+        raise click.ClickException(str(exc))
+
+
+@cli.command()
+def graph():
+    """Show the dependency graph of the mirror services"""
+    for name, (spec, deps) in sorted(SERVICES.items()):
+        click.echo(f"{name} [{spec}]: {', '.join(deps)}")
+
+
+if __name__ == "__main__":
+    cli()
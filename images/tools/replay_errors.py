@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# drain the errors reported in redis by the graph and content replayers
+# (replayer.error_reporter): the failed objects are replayed again, and the
+# entries of the ones which are now in the mirror are removed
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import click
+from readiness import backoff
+from redis import Redis
+from swh.core.config import read as config_read
+from swh.core.statsd import statsd
+from swh.model.model import BaseModel, HashableObject, ModelObjectType
+from swh.objstorage.factory import get_objstorage
+from swh.objstorage.interface import HashDict
+from swh.objstorage.replayer.replay import (
+    ReplayError,
+    check_hashes,
+    get_object,
+    put_object,
+)
+from swh.storage import get_storage
+from swh.storage.replay import OBJECT_CONVERTERS, OBJECT_FIXERS, process_replay_objects
+import yaml
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 100
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_ATTEMPTS = 5
+PROGRESS_INTERVAL = 10.0
+
+# keys of the entries reported by the content replayer
+# (blob:sha1:<hex>;sha1_git:<hex>;...) and by the graph replayer: by its
+# tenacious storage proxy for the objects it failed to insert
+# (<date>/<object type>), or by its deserializer for the invalid ones
+# (<date>/<object type>:<hex id> or <date>/<object type>:uuid:<uuid>)
+CONTENT_MATCH = "blob:*"
+GRAPH_MATCH = "*/*"
+
+# object types the presence of which can be checked in bulk
+MISSING_METHODS = {
+    "directory": "directory_missing",
+    "revision": "revision_missing",
+    "release": "release_missing",
+    "snapshot": "snapshot_missing",
+}
+
+RECOVERED_METRIC = "swh_replayer_errors_recovered_total"
+REMAINING_METRIC = "swh_replayer_errors_remaining"
+
+# an entry is only removed if it has not been reported again meanwhile
+DELETE_IF_UNCHANGED = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+  return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# (redis key, redis value, object id)
+Entry = Tuple[bytes, bytes, Any]
+
+
+class ReportLoader(yaml.SafeLoader):
+    """Loader of the entries of the graph replayer, dumped with yaml.dump
+    (which tags the tuples of the objects)"""
+
+
+ReportLoader.add_constructor(
+    "tag:yaml.org,2002:python/tuple",
+    lambda loader, node: tuple(loader.construct_sequence(node)),
+)
+
+
+def parse_content_key(key: str) -> Optional[HashDict]:
+    if not key.startswith("blob:"):
+        return None
+    obj_id: Dict[str, bytes] = {}
+    for item in key[len("blob:") :].split(";"):
+        algo, _, hexid = item.partition(":")
+        try:
+            obj_id[algo] = bytes.fromhex(hexid)
+        except ValueError:
+            return None
+    return obj_id  # type: ignore[return-value]
+
+
+def parse_graph_key(key: str) -> Optional[Tuple[str, Optional[bytes]]]:
+    """The object type and id (if given) of an entry of the graph replayer"""
+    _, _, oid = key.partition("/")
+    object_type, _, hexid = oid.partition(":")
+    if object_type not in {t.value for t in ModelObjectType}:
+        return None
+    if not hexid or hexid.startswith("uuid:"):
+        return object_type, None
+    try:
+        return object_type, bytes.fromhex(hexid)
+    except ValueError:
+        return None
+
+
+def scan_entries(
+    client: Redis, match: str, batch_size: int
+) -> Iterator[List[Tuple[bytes, bytes]]]:
+    """Yield the (key, value) entries matching ``match``, one batch (of about
+    ``batch_size`` entries) per SCAN call"""
+    cursor = 0
+    while True:
+        cursor, keys = client.scan(cursor, match=match, count=batch_size)
+        if keys:
+            values = client.mget(keys)
+            yield [(k, v) for k, v in zip(keys, values) if v is not None]
+        if cursor == 0:
+            break
+
+
+def with_backoff(fn: Callable[[], Any], max_attempts: int, what: str) -> Any:
+    for attempt, delay in enumerate(backoff(), 1):
+        try:
+            return fn()
+        except Exception as exc:
+            if attempt >= max_attempts:
+                raise
+            logger.warning(
+                "Failed to %s (attempt %s), retrying in %.1fs: %r",
+                what,
+                attempt,
+                delay,
+                exc,
+            )
+            time.sleep(delay)
+
+
+class ContentRetrier:
+    """Copy the objects of the entries of the content replayer again, from the
+    source objstorage to the destination one"""
+
+    match = CONTENT_MATCH
+
+    def __init__(
+        self,
+        src: Dict[str, Any],
+        dst: Dict[str, Any],
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    ):
+        self.src_cfg = src
+        self.dst_cfg = dst
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+
+    def parse(self, key: str) -> Optional[Tuple[str, Any]]:
+        obj_id = parse_content_key(key)
+        return None if obj_id is None else ("content", obj_id)
+
+    def backends(self):
+        if not hasattr(self.local, "src"):
+            self.local.src = get_objstorage(**self.src_cfg)
+            self.local.dst = get_objstorage(**self.dst_cfg)
+        return self.local.src, self.local.dst
+
+    def retry(self, object_type: str, entries: List[Entry]) -> List[Entry]:
+        """Replay the objects of ``entries``; return the entries of the ones
+        now in the destination"""
+        src, dst = self.backends()
+        recovered = []
+        todo = []
+        for entry in entries:
+            if entry[2] in dst:
+                recovered.append(entry)
+            else:
+                todo.append(entry)
+        if not todo:
+            return recovered
+        try:
+            objs = with_backoff(
+                lambda: list(src.get_batch([entry[2] for entry in todo])),
+                self.max_attempts,
+                "get objects from the source objstorage",
+            )
+        except Exception:
+            # fall back to the (retried) get of each object
+            objs = [None] * len(todo)
+        for entry, obj in zip(todo, objs):
+            obj_id = entry[2]
+            try:
+                if obj is None:
+                    obj = get_object(src, obj_id)
+                check_hashes(obj, obj_id)
+                put_object(dst, obj_id, obj)
+            except Exception as exc:
+                if not isinstance(exc, ReplayError):
+                    logger.info("Failed to replay %s: %r", entry[0].decode(), exc)
+                continue
+            recovered.append(entry)
+        return recovered
+
+
+def load_graph_object(object_type: str, value: bytes) -> BaseModel:
+    """Rebuild the object of an entry of the graph replayer from its dict
+    representation (stored by the tenacious proxy and the deserializer)"""
+    obj_type = ModelObjectType(object_type)
+    dict_repr = yaml.load(value, Loader=ReportLoader)["obj"]
+    if obj_type in OBJECT_FIXERS:
+        dict_repr = OBJECT_FIXERS[obj_type](dict_repr)
+    obj = OBJECT_CONVERTERS[obj_type](dict_repr)
+    if isinstance(obj, HashableObject) and obj.compute_hash() != obj.id:
+        raise ValueError(f"Invalid id {obj.id.hex()}")
+    return obj
+
+
+def without_tenacious(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """A storage config without its tenacious steps, which would swallow the
+    insertion failures of the objects retried"""
+    if cfg["cls"] == "tenacious":
+        return without_tenacious(cfg["storage"])
+    if cfg["cls"] == "pipeline":
+        return {
+            **cfg,
+            "steps": [step for step in cfg["steps"] if step["cls"] != "tenacious"],
+        }
+    return cfg
+
+
+class GraphRetrier:
+    """Insert the objects of the entries of the graph replayer again, the ones
+    its storage failed to insert as well as the ones which were invalid (if
+    they are valid now).
+
+    The storage is the one of the replayer, without its tenacious step, so a
+    failed insertion fails the whole chunk; the objects of the types the
+    storage can check the presence of are only recovered once they are
+    found there.
+    """
+
+    match = GRAPH_MATCH
+
+    def __init__(
+        self, storage: Dict[str, Any], max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    ):
+        self.storage_cfg = without_tenacious(storage)
+        self.max_attempts = max_attempts
+        self.local = threading.local()
+
+    def parse(self, key: str) -> Optional[Tuple[str, Any]]:
+        return parse_graph_key(key)
+
+    def get_storage(self):
+        if not hasattr(self.local, "storage"):
+            self.local.storage = get_storage(**self.storage_cfg)
+        return self.local.storage
+
+    def missing(self, object_type: str, objects: List[BaseModel]) -> Set[bytes]:
+        """The ids of ``objects`` missing from the storage"""
+        storage = self.get_storage()
+        return set(
+            with_backoff(
+                lambda: list(
+                    getattr(storage, MISSING_METHODS[object_type])(
+                        [obj.id for obj in objects]
+                    )
+                ),
+                self.max_attempts,
+                f"check the presence of {object_type} objects",
+            )
+        )
+
+    def retry(self, object_type: str, entries: List[Entry]) -> List[Entry]:
+        storage = self.get_storage()
+        recovered: List[Entry] = []
+        loaded: List[Tuple[Entry, BaseModel]] = []
+        for entry in entries:
+            try:
+                loaded.append((entry, load_graph_object(object_type, entry[1])))
+            except Exception as exc:
+                logger.info("Failed to load %s: %r", entry[0].decode(), exc)
+        checkable = object_type in MISSING_METHODS
+        if checkable and loaded:
+            missing = self.missing(object_type, [obj for _, obj in loaded])
+            recovered = [entry for entry, obj in loaded if obj.id not in missing]
+            loaded = [(entry, obj) for entry, obj in loaded if obj.id in missing]
+        objects = [obj for _, obj in loaded]
+        if objects:
+            with_backoff(
+                lambda: process_replay_objects({object_type: objects}, storage=storage),
+                self.max_attempts,
+                f"insert {object_type} objects",
+            )
+            if checkable:
+                # only the objects now found in the storage are recovered
+                missing = self.missing(object_type, objects)
+                for entry, obj in loaded:
+                    if obj.id in missing:
+                        logger.info("%s is still missing", entry[0].decode())
+                    else:
+                        recovered.append(entry)
+            else:
+                recovered += [entry for entry, _ in loaded]
+        return recovered
+
+
+class Drain:
+    """Replay again the objects of the error entries found in redis, with at
+    most ``concurrency`` batches of ``chunk_size`` objects (of the same type)
+    in flight, and remove the entries of the recovered objects"""
+
+    def __init__(
+        self,
+        client: Redis,
+        retrier,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY,
+    ):
+        self.client = client
+        self.retrier = retrier
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.delete = client.register_script(DELETE_IF_UNCHANGED)
+        self.seen: Dict[str, int] = {}
+        self.recovered: Dict[str, int] = {}
+
+    def chunks(self, dry_run: bool) -> Iterator[Tuple[str, List[Entry]]]:
+        """Group the scanned entries by object type, in chunks"""
+        pending: Dict[str, List[Entry]] = {}
+        for batch in scan_entries(self.client, self.retrier.match, self.batch_size):
+            for key, value in batch:
+                parsed = self.retrier.parse(key.decode())
+                if parsed is None:
+                    continue
+                object_type, obj_id = parsed
+                self.seen[object_type] = self.seen.get(object_type, 0) + 1
+                if dry_run:
+                    continue
+                chunk = pending.setdefault(object_type, [])
+                chunk.append((key, value, obj_id))
+                if len(chunk) >= self.chunk_size:
+                    yield object_type, pending.pop(object_type)
+        yield from pending.items()
+
+    def remove(self, object_type: str, entries: List[Entry]) -> None:
+        with self.client.pipeline(transaction=False) as pipe:
+            for key, value, _ in entries:
+                self.delete(keys=[key], args=[value], client=pipe)
+            removed = sum(pipe.execute())
+        self.recovered[object_type] = self.recovered.get(object_type, 0) + removed
+        statsd.increment(RECOVERED_METRIC, removed, tags={"object_type": object_type})
+
+    def run(self, dry_run: bool = False) -> Dict[str, Tuple[int, int]]:
+        """Drain the errors; return the (recovered, remaining) counts of each
+        object type"""
+        t0 = last_log = time.monotonic()
+        running: Dict[Future, str] = {}
+
+        def collect(done: Set[Future]) -> None:
+            for future in done:
+                object_type = running.pop(future)
+                try:
+                    self.remove(object_type, future.result())
+                except Exception:
+                    logger.exception("Failed to replay a chunk of %s", object_type)
+
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for object_type, chunk in self.chunks(dry_run):
+                running[
+                    pool.submit(self.retrier.retry, object_type, chunk)
+                ] = object_type
+                if len(running) >= 2 * self.concurrency:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    collect(done)
+                now = time.monotonic()
+                if now - last_log >= PROGRESS_INTERVAL:
+                    last_log = now
+                    self.log_progress(now - t0)
+            collect(set(running))
+
+        self.log_progress(time.monotonic() - t0)
+        result = {}
+        for object_type, seen in sorted(self.seen.items()):
+            recovered = self.recovered.get(object_type, 0)
+            result[object_type] = (recovered, seen - recovered)
+            statsd.gauge(
+                REMAINING_METRIC, seen - recovered, tags={"object_type": object_type}
+            )
+        return result
+
+    def log_progress(self, elapsed: float) -> None:
+        seen = sum(self.seen.values())
+        recovered = sum(self.recovered.values())
+        logger.info(
+            "%s entries scanned, %s recovered (%.1f/s)",
+            seen,
+            recovered,
+            recovered / elapsed if elapsed else 0,
+        )
+
+
+def get_retrier(cfg: Dict[str, Any], max_attempts: int):
+    """The retrier of the replayer the config file is the one of"""
+    if "objstorage_dst" in cfg:
+        return ContentRetrier(cfg["objstorage"], cfg["objstorage_dst"], max_attempts)
+    if "storage" in cfg:
+        return GraphRetrier(cfg["storage"], max_attempts)
+    raise click.ClickException("Not a graph or content replayer config file")
+
+
+@click.command()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+    help="Configuration file of the (graph or content) replayer",
+)
+@click.option(
+    "--concurrency",
+    default=DEFAULT_CONCURRENCY,
+    show_default=True,
+    help="Number of chunks of objects replayed at the same time",
+)
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option(
+    "--chunk-size",
+    default=DEFAULT_CHUNK_SIZE,
+    show_default=True,
+    help="Number of objects (of the same type) replayed together",
+)
+@click.option(
+    "--max-attempts",
+    default=DEFAULT_MAX_ATTEMPTS,
+    show_default=True,
+    help="Attempts of each request to the storage or objstorage",
+)
+@click.option(
+    "--dry-run",
+    "-n",
+    is_flag=True,
+    help="Only count the entries, by object type",
+)
+def main(config_file, concurrency, batch_size, chunk_size, max_attempts, dry_run):
+    """Replay again the objects a replayer failed at, as reported in its
+    error_reporter redis database, and remove the entries of the ones which
+    are in the mirror now"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file)
+    reporter_cfg = cfg.get("replayer", {}).get("error_reporter")
+    if not reporter_cfg:
+        raise click.ClickException("No replayer.error_reporter in the config file")
+    drain = Drain(
+        Redis(**reporter_cfg),
+        get_retrier(cfg, max_attempts),
+        batch_size=batch_size,
+        chunk_size=chunk_size,
+        concurrency=concurrency,
+    )
+    for object_type, (recovered, remaining) in drain.run(dry_run).items():
+        if dry_run:
+            click.echo(f"{object_type}: {remaining}")
+        else:
+            click.echo(f"{object_type}: {recovered} recovered, {remaining} remaining")
+
+
+if __name__ == "__main__":
+    main()
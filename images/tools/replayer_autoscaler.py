@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# scale the replayer services of the stack from the lag and the consume rate
+# of their kafka consumer groups, backing off when the backends of the mirror
+# are overloaded
+
+from collections import Counter, deque
+import logging
+import math
+import os
+import time
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import click
+from confluent_kafka.admin import AdminClient
+import psycopg
+from replication_lag import LagMonitor, PartitionLag, kafka_admin_config
+import requests
+from swh.core.config import read as config_read
+from swh.core.statsd import statsd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60.0
+DEFAULT_DOCKER_URL = "http://docker-api:2375"
+DEFAULT_PROMETHEUS_URL = "http://prometheus:9090/prometheus"
+# time the replayers should take to consume the current lag
+DEFAULT_CATCH_UP = 86400.0
+# relative difference between the desired and the current number of replicas
+# below which a service is left alone
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_MAX_STEP = 16
+# minimal time between two changes of the replicas of a service
+DEFAULT_COOLDOWN = 300.0
+# a service is only scaled down to the highest number of replicas it needed
+# over that period
+DEFAULT_SCALE_DOWN_WINDOW = 1800.0
+# fraction of the replicas kept when a backend is overloaded
+DEFAULT_BACKOFF_FACTOR = 0.5
+# lag, in seconds of consumption, above which the replicas of a group are
+# assumed to consume as fast as they can (giving the throughput of a replica)
+BACKLOG = 600.0
+# lag, in seconds of consumption, below which a group has caught up
+CAUGHT_UP = 10.0
+REQUEST_TIMEOUT = 30.0
+# samples of the active sessions of a postgresql limit, per poll
+PG_SAMPLES = 10
+PG_SAMPLE_INTERVAL = 0.2
+
+
+class GroupStats(NamedTuple):
+    lag: int
+    # messages/s consumed by the group; None before the second poll
+    rate: Optional[float]
+    # partitions of the largest topic of the group
+    partitions: int
+
+
+class Limit:
+    """Load of a backend of the mirror, with the value above which the
+    replayers writing to it back off.
+
+    The load is either the (scalar) result of a prometheus ``query``, or the
+    number of active sessions of the postgresql database ``db``.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max: float,
+        query: Optional[str] = None,
+        db: Optional[str] = None,
+        prometheus_url: str = DEFAULT_PROMETHEUS_URL,
+    ):
+        if (query is None) == (db is None):
+            raise ValueError(f"Limit {name} needs either a query or a db")
+        self.name = name
+        self.max = max
+        self.query = query
+        self.db = db
+        self.prometheus_url = prometheus_url
+
+    def prometheus_value(self) -> Optional[float]:
+        response = requests.get(
+            f"{self.prometheus_url.rstrip('/')}/api/v1/query",
+            params={"query": self.query},
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+        values = [
+            float(result["value"][1]) for result in response.json()["data"]["result"]
+        ]
+        values = [value for value in values if not math.isnan(value)]
+        return max(values) if values else None
+
+    def postgresql_value(self) -> float:
+        total = 0
+        with psycopg.connect(self.db, autocommit=True) as db:
+            for _ in range(PG_SAMPLES):
+                (active,) = db.execute(
+                    """select count(*) from pg_stat_activity
+                       where state = 'active' and backend_type = 'client backend'
+                       and pid != pg_backend_pid()"""
+                ).fetchone()
+                total += active
+                time.sleep(PG_SAMPLE_INTERVAL)
+        return total / PG_SAMPLES
+
+    def value(self) -> Optional[float]:
+        """Current load, None when unknown"""
+        if self.query is not None:
+            return self.prometheus_value()
+        return self.postgresql_value()
+
+
+class ReplayerService(NamedTuple):
+    name: str
+    group: str
+    object_types: List[str]
+    min_replicas: int
+    max_replicas: int
+    # names of the limits the service backs off on
+    limits: List[str]
+    # messages/s a replica consumes, measured when unset
+    replica_rate: Optional[float] = None
+
+
+class SwarmServices:
+    """Read and set the replicas of the services of a stack with the docker
+    engine API"""
+
+    def __init__(self, url: str, stack: str):
+        self.url = url.rstrip("/")
+        self.stack = stack
+        self.session = requests.Session()
+
+    def inspect(self, service: str) -> Dict[str, Any]:
+        response = self.session.get(
+            f"{self.url}/services/{self.stack}_{service}", timeout=REQUEST_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def replicas(self, service: str) -> int:
+        return self.inspect(service)["Spec"]["Mode"]["Replicated"]["Replicas"]
+
+    def scale(self, service: str, replicas: int) -> None:
+        info = self.inspect(service)
+        spec = info["Spec"]
+        spec["Mode"]["Replicated"]["Replicas"] = replicas
+        response = self.session.post(
+            f"{self.url}/services/{info['ID']}/update",
+            params={"version": info["Version"]["Index"]},
+            json=spec,
+            timeout=REQUEST_TIMEOUT,
+        )
+        response.raise_for_status()
+
+
+class Autoscaler:
+    """Scale each replayer service so its consumer group keeps up with the
+    journal and consumes its lag within ``catch_up`` seconds.
+
+    The throughput needed by a group is its inflow (the consume rate plus the
+    growth of the lag) plus the lag divided by ``catch_up``, and a replica
+    provides the ``replica_rate`` of its service, or else the throughput the
+    replicas provided on average the last time they had a backlog. Until that
+    is known, a replica is assumed to provide at least the current average
+    throughput, and a service which caught up is scaled down by more than
+    ``tolerance``. The number of replicas is kept within the bounds of the
+    service, and under the number of partitions of the largest topic of the
+    group, as extra consumers would stay idle.
+
+    To avoid storms of consumer group rebalances, a service is only scaled
+    when the desired number of replicas differs from the current one by more
+    than ``tolerance``, by at most ``max_step`` replicas, at most once every
+    ``cooldown`` seconds, and down to the highest number of replicas it
+    needed over the last ``scale_down_window`` seconds.
+
+    When a limit of a service is exceeded, its replicas are scaled down by
+    ``backoff_factor`` instead (still once per cooldown period), and they are
+    not scaled up again for ``scale_down_window`` seconds.
+    """
+
+    def __init__(
+        self,
+        monitor: LagMonitor,
+        swarm: SwarmServices,
+        services: List[ReplayerService],
+        limits: Dict[str, Limit],
+        catch_up: float = DEFAULT_CATCH_UP,
+        tolerance: float = DEFAULT_TOLERANCE,
+        max_step: int = DEFAULT_MAX_STEP,
+        cooldown: float = DEFAULT_COOLDOWN,
+        scale_down_window: float = DEFAULT_SCALE_DOWN_WINDOW,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        dry_run: bool = False,
+    ):
+        self.monitor = monitor
+        self.swarm = swarm
+        self.services = services
+        self.limits = limits
+        self.catch_up = catch_up
+        self.tolerance = tolerance
+        self.max_step = max_step
+        self.cooldown = cooldown
+        self.scale_down_window = scale_down_window
+        self.backoff_factor = backoff_factor
+        self.dry_run = dry_run
+        self.last_lag: Dict[str, Tuple[float, int]] = {}
+        # service -> measured messages/s per replica
+        self.capacity: Dict[str, float] = {}
+        self.last_scaled: Dict[str, float] = {}
+        # service -> time of the last backoff
+        self.backed_off: Dict[str, float] = {}
+        # service -> (time, desired replicas)
+        self.history: Dict[str, Deque[Tuple[float, int]]] = {
+            service.name: deque() for service in services
+        }
+
+    def group_stats(self, lags: List[PartitionLag]) -> Dict[str, GroupStats]:
+        stats: Dict[str, GroupStats] = {}
+        for group in self.monitor.groups:
+            group_lags = [lag for lag in lags if lag.group == group]
+            rates = [
+                self.monitor.rates.get((group, lag.topic, lag.partition))
+                for lag in group_lags
+            ]
+            known = [rate for rate in rates if rate is not None]
+            # the partitions of each topic are spread over the consumers of
+            # the group, so the consumers beyond the partitions of its largest
+            # topic get none
+            partitions = Counter(lag.topic for lag in group_lags)
+            stats[group] = GroupStats(
+                sum(lag.lag for lag in group_lags),
+                sum(known) if known else None,
+                max(partitions.values(), default=0),
+            )
+        return stats
+
+    def overloaded(self) -> Dict[str, bool]:
+        overloaded: Dict[str, bool] = {}
+        for name, limit in self.limits.items():
+            try:
+                value = limit.value()
+            except Exception:
+                logger.exception("Failed to get the load of %s", name)
+                value = None
+            if value is None:
+                # an unknown load does not prevent the replayers from running
+                overloaded[name] = False
+                continue
+            overloaded[name] = value > limit.max
+            statsd.gauge("swh_mirror_autoscaler_load", value, tags={"limit": name})
+            if overloaded[name]:
+                logger.warning("%s is overloaded: %.2f > %s", name, value, limit.max)
+        return overloaded
+
+    def desired(
+        self, service: ReplayerService, current: int, stats: GroupStats, now: float
+    ) -> int:
+        """Number of replicas the consumer group of the service needs"""
+        previous = self.last_lag.get(service.group)
+        self.last_lag[service.group] = (now, stats.lag)
+        if current == 0:
+            # no measure of the throughput of a replica: start replayers if
+            # there is anything to consume
+            return self.max_step if stats.lag else 0
+        if stats.rate is None or (stats.rate == 0 and stats.lag):
+            # first poll, or the group is rebalancing
+            return current
+        if stats.lag > stats.rate * BACKLOG:
+            self.capacity[service.name] = stats.rate / current
+        capacity = service.replica_rate or self.capacity.get(service.name)
+        if capacity is None:
+            if stats.lag <= stats.rate * CAUGHT_UP:
+                # more replicas than needed, by an unknown number: remove more
+                # than the tolerance keeps (once the lag stayed low over the
+                # scale down window)
+                return current - math.floor(current * self.tolerance) - 1
+            capacity = stats.rate / current
+        inflow = stats.rate
+        if previous is not None and now > previous[0]:
+            inflow = max(inflow + (stats.lag - previous[1]) / (now - previous[0]), 0)
+        needed = inflow + stats.lag / self.catch_up
+        return math.ceil(needed / capacity)
+
+    def target(
+        self,
+        service: ReplayerService,
+        current: int,
+        stats: GroupStats,
+        overloaded: bool,
+        now: float,
+    ) -> int:
+        upper = min(service.max_replicas, stats.partitions)
+        lower = min(service.min_replicas, upper)
+        if overloaded:
+            self.backed_off[service.name] = now
+            return max(lower, math.floor(current * self.backoff_factor))
+
+        desired = self.desired(service, current, stats, now)
+        history = self.history[service.name]
+        history.append((now, desired))
+        while history[0][0] < now - self.scale_down_window:
+            history.popleft()
+        if desired < current:
+            desired = max(d for _, d in history)
+        elif (
+            now - self.backed_off.get(service.name, -math.inf) < self.scale_down_window
+        ):
+            # do not overload the backends again right away
+            desired = current
+        desired = max(lower, min(desired, upper))
+        if (
+            lower <= current <= upper
+            and abs(desired - current) <= self.tolerance * current
+        ):
+            return current
+        if desired > current:
+            return min(desired, current + self.max_step)
+        return max(desired, current - self.max_step)
+
+    def step(self) -> None:
+        now = time.monotonic()
+        stats = self.group_stats(self.monitor.poll())
+        overloaded = self.overloaded()
+        for service in self.services:
+            current = self.swarm.replicas(service.name)
+            target = self.target(
+                service,
+                current,
+                stats[service.group],
+                any(overloaded.get(limit, False) for limit in service.limits),
+                now,
+            )
+            tags = {"service": service.name}
+            statsd.gauge("swh_mirror_autoscaler_replicas", current, tags=tags)
+            statsd.gauge("swh_mirror_autoscaler_target_replicas", target, tags=tags)
+            if target == current:
+                continue
+            if now - self.last_scaled.get(service.name, -math.inf) < self.cooldown:
+                logger.info(
+                    "%s: not scaling from %s to %s replicas yet (cooldown)",
+                    service.name,
+                    current,
+                    target,
+                )
+                continue
+            logger.info(
+                "%s: scaling from %s to %s replicas (lag=%s, rate=%s msg/s)",
+                service.name,
+                current,
+                target,
+                stats[service.group].lag,
+                stats[service.group].rate,
+            )
+            if self.dry_run:
+                continue
+            self.swarm.scale(service.name, target)
+            self.last_scaled[service.name] = now
+            statsd.increment(
+                "swh_mirror_autoscaler_scale_total",
+                tags={
+                    "service": service.name,
+                    "direction": "up" if target > current else "down",
+                },
+            )
+
+
+def from_config(cfg: Dict[str, Any], dry_run: bool = False) -> Autoscaler:
+    journal_cfg = cfg["journal_client"]
+    autoscaler_cfg = dict(cfg["replayer_autoscaler"])
+    prometheus_url = autoscaler_cfg.pop("prometheus_url", DEFAULT_PROMETHEUS_URL)
+    limits = {
+        name: Limit(name, prometheus_url=prometheus_url, **limit_cfg)
+        for name, limit_cfg in autoscaler_cfg.pop("limits", {}).items()
+    }
+    services = [
+        ReplayerService(
+            name,
+            service_cfg["group"],
+            service_cfg["object_types"],
+            service_cfg.get("min_replicas", 0),
+            service_cfg["max_replicas"],
+            service_cfg.get("limits", list(limits)),
+            service_cfg.get("replica_rate"),
+        )
+        for name, service_cfg in autoscaler_cfg.pop("services").items()
+    ]
+    for service in services:
+        unknown = set(service.limits) - set(limits)
+        if unknown:
+            raise ValueError(f"Unknown limits for {service.name}: {unknown}")
+    monitor = LagMonitor(
+        AdminClient(kafka_admin_config(journal_cfg)),
+        {service.group: service.object_types for service in services},
+        journal_cfg.get("prefix", "swh.journal.objects"),
+    )
+    swarm = SwarmServices(
+        autoscaler_cfg.pop("docker_url", DEFAULT_DOCKER_URL),
+        autoscaler_cfg.pop(
+            "stack", os.environ.get("X_SERVICE_LABEL_STACK_NAMESPACE", "swh-mirror")
+        ),
+    )
+    autoscaler_cfg.pop("interval", None)
+    return Autoscaler(
+        monitor, swarm, services, limits, dry_run=dry_run, **autoscaler_cfg
+    )
+
+
+@click.command()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--dry-run", is_flag=True, help="Log the scaling decisions without applying them"
+)
+def main(config_file, dry_run):
+    """Scale the replayer services from the replication lag"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file)
+    interval = cfg["replayer_autoscaler"].get("interval", DEFAULT_INTERVAL)
+    autoscaler = from_config(cfg, dry_run=dry_run)
+    while True:
+        t0 = time.monotonic()
+        try:
+            autoscaler.step()
+        except Exception:
+            logger.exception("Failed to scale the replayers")
+        time.sleep(max(interval - (time.monotonic() - t0), 0))
+
+
+if __name__ == "__main__":
+    main()
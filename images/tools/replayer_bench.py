@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# throughput benchmark of the graph and content replayers, replaying a
+# recorded journal dump in-process (no kafka needed) with a sweep of
+# batch_size/concurrency/pool_maxsize values
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import copy
+import itertools
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Set, Tuple
+
+import click
+from confluent_kafka import Consumer, KafkaException
+from mirror_verify import kafka_config
+import msgpack
+import psycopg
+from psycopg import sql
+from psycopg.conninfo import make_conninfo
+from swh.core.config import read as config_read
+from swh.core.db.db_utils import (
+    init_admin_extensions,
+    populate_database_for_package,
+    swh_db_flavor,
+)
+from swh.journal.serializers import kafka_to_value
+from swh.objstorage.factory import get_objstorage
+from swh.objstorage.replayer.replay import ContentReplayer, objid_from_dict
+from swh.storage import get_storage
+from swh.storage.replay import ModelObjectDeserializer, process_replay_objects
+
+logger = logging.getLogger(__name__)
+
+STORAGE_DBMODULE = "swh.storage:postgresql"
+
+
+def local_objstorage_config(root: str) -> Dict[str, Any]:
+    """Config of a local pathslicing objstorage laid out like the mirror's one
+    (see conf/objstorage.yml)"""
+    os.makedirs(root, exist_ok=True)
+    return {
+        "cls": "pathslicing",
+        "root": root,
+        "slicing": "0:2/2:4",
+        "compression": "gzip",
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of ``values``"""
+    values = sorted(values)
+    return values[max(int(round(q / 100 * len(values))) - 1, 0)]
+
+
+def set_pool_maxsize(cfg: Dict[str, Any], pool_maxsize: int) -> Dict[str, Any]:
+    """Return a copy of a storage/objstorage config with ``pool_maxsize`` set
+    on every remote backend (including the steps of a pipeline)"""
+    cfg = copy.deepcopy(cfg)
+    for backend in iter_backends(cfg):
+        if backend["cls"] == "remote":
+            backend["pool_maxsize"] = pool_maxsize
+    return cfg
+
+
+def iter_backends(cfg: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Iterate over the backends of a storage/objstorage config (including
+    the steps of a pipeline)"""
+    to_visit: List[Any] = [cfg]
+    while to_visit:
+        item = to_visit.pop()
+        if isinstance(item, dict):
+            if "cls" in item:
+                yield item
+            to_visit.extend(item.values())
+        elif isinstance(item, list):
+            to_visit.extend(item)
+
+
+@contextmanager
+def fresh_storage_config(cfg: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Copy of a storage config in which every postgresql backend uses a new
+    database, initialized with the storage schema (in the flavor of the
+    configured database) and dropped afterwards, so that every run of a sweep
+    starts from an empty storage instead of finding the objects of the
+    previous runs there.
+
+    The configured databases are left alone (and may be in use by the
+    mirror): they are neither written to nor used as templates.
+    """
+    cfg = copy.deepcopy(cfg)
+    created: List[Tuple[str, str]] = []
+    try:
+        for backend in iter_backends(cfg):
+            if backend["cls"] != "postgresql":
+                continue
+            with psycopg.connect(backend["db"]) as db:
+                dbname = db.info.dbname
+            flavor = swh_db_flavor(backend["db"])
+            name = f"{dbname}_bench_{os.getpid()}_{len(created)}"
+            admin_dsn = make_conninfo(backend["db"], dbname="postgres")
+            with psycopg.connect(admin_dsn, autocommit=True) as db:
+                db.execute(sql.SQL("create database {}").format(sql.Identifier(name)))
+            created.append((admin_dsn, name))
+            backend["db"] = make_conninfo(backend["db"], dbname=name)
+            init_admin_extensions(STORAGE_DBMODULE, backend["db"])
+            populate_database_for_package(STORAGE_DBMODULE, backend["db"], flavor)
+        yield cfg
+    finally:
+        for admin_dsn, name in created:
+            with psycopg.connect(admin_dsn, autocommit=True) as db:
+                db.execute(
+                    sql.SQL("drop database if exists {} with (force)").format(
+                        sql.Identifier(name)
+                    )
+                )
+
+
+class DumpJournalClient:
+    """Stand-in for swh.journal's JournalClient reading messages from a dump
+    written by the ``record`` command instead of kafka.
+
+    Like the kafka client, ``process`` calls ``worker_fn`` with batches of
+    deserialized values (a dict object_type -> values), but batches only hold
+    one object type so their latency can be accounted per object type.
+    Batches are dispatched over ``concurrency`` threads, standing for as many
+    replayer replicas. The volume of a batch is computed by ``size_fn``
+    (defaults to the size of the kafka messages).
+    """
+
+    def __init__(
+        self,
+        messages: Dict[str, List[bytes]],
+        batch_size: int,
+        concurrency: int = 1,
+        value_deserializer: Callable[[str, bytes], Any] = lambda _, v: kafka_to_value(
+            v
+        ),
+        size_fn: Callable[[List[bytes]], int] = lambda msgs: sum(map(len, msgs)),
+    ):
+        self.messages = messages
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.value_deserializer = value_deserializer
+        self.size_fn = size_fn
+        # object_type -> [(start time, duration, nb objects, nb bytes)]
+        self.batches: Dict[str, List[Tuple[float, float, int, int]]] = defaultdict(list)
+        self.duration = 0.0
+
+    def iter_batches(self) -> Iterator[Tuple[str, List[bytes]]]:
+        for object_type, messages in self.messages.items():
+            for i in range(0, len(messages), self.batch_size):
+                yield object_type, messages[i : i + self.batch_size]
+
+    def process_batch(
+        self, worker_fn: Callable[[Dict[str, List[Any]]], None], batch
+    ) -> None:
+        object_type, messages = batch
+        t0 = time.monotonic()
+        values = [
+            value
+            for value in (
+                self.value_deserializer(object_type, message) for message in messages
+            )
+            if value is not None
+        ]
+        worker_fn({object_type: values})
+        self.batches[object_type].append(
+            (t0, time.monotonic() - t0, len(messages), self.size_fn(messages))
+        )
+
+    def process(self, worker_fn: Callable[[Dict[str, List[Any]]], None]) -> None:
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            for _ in pool.map(
+                lambda batch: self.process_batch(worker_fn, batch),
+                self.iter_batches(),
+            ):
+                pass
+        self.duration = time.monotonic() - t0
+
+
+def load_dump(path: str, object_types: Set[str]) -> Dict[str, List[bytes]]:
+    messages: Dict[str, List[bytes]] = defaultdict(list)
+    with open(path, "rb") as f:
+        for object_type, _key, value in msgpack.Unpacker(f):
+            if not object_types or object_type in object_types:
+                messages[object_type].append(value)
+    return messages
+
+
+def content_bytes(messages: List[bytes]) -> int:
+    """Size of the visible contents described by ``messages``, i.e. the
+    volume actually copied by the content replayer"""
+    return sum(
+        content["length"]
+        for content in map(kafka_to_value, messages)
+        if content.get("status") == "visible"
+    )
+
+
+def run_graph_replay(
+    storage_cfg: Dict[str, Any],
+    messages: Dict[str, List[bytes]],
+    batch_size: int,
+    concurrency: int,
+    pool_maxsize: int,
+    validate: bool,
+) -> DumpJournalClient:
+    # start from a fresh storage for each run
+    with fresh_storage_config(storage_cfg) as cfg:
+        storage = get_storage(**set_pool_maxsize(cfg, pool_maxsize))
+        deserializer = ModelObjectDeserializer(validate=validate)
+        client = DumpJournalClient(
+            messages, batch_size, concurrency, value_deserializer=deserializer.convert
+        )
+        client.process(
+            lambda all_objects: process_replay_objects(all_objects, storage=storage)
+        )
+    return client
+
+
+def run_content_replay(
+    src_cfg: Dict[str, Any],
+    messages: List[bytes],
+    batch_size: int,
+    concurrency: int,
+    pool_maxsize: int,
+) -> DumpJournalClient:
+    # start from an empty local objstorage for each run
+    dst_root = tempfile.mkdtemp(prefix="replayer-bench-")
+    try:
+        # the content replayer processes batches one at a time, copying the
+        # objects of a batch with ``concurrency`` threads
+        client = DumpJournalClient(
+            {"content": messages}, batch_size, size_fn=content_bytes
+        )
+        with ContentReplayer(
+            src=set_pool_maxsize(src_cfg, pool_maxsize),
+            dst=local_objstorage_config(dst_root),
+            concurrency=concurrency,
+        ) as replayer:
+            client.process(replayer.replay)
+        return client
+    finally:
+        shutil.rmtree(dst_root, ignore_errors=True)
+
+
+def summarize(client: DumpJournalClient) -> Iterator[Dict[str, Any]]:
+    """Throughput and batch latencies of each object type; the throughput of
+    a type is measured over the time its own batches were processed (from
+    the start of the first one to the end of the last one), as the types of
+    a dump are replayed one after the other"""
+    for object_type, batches in client.batches.items():
+        latencies = [batch[1] for batch in batches]
+        nobjs = sum(batch[2] for batch in batches)
+        nbytes = sum(batch[3] for batch in batches)
+        start = min(batch[0] for batch in batches)
+        duration = max(batch[0] + batch[1] for batch in batches) - start
+        yield {
+            "object_type": object_type,
+            "objects": nobjs,
+            "bytes": nbytes,
+            "batches": len(batches),
+            "duration": duration,
+            "objects_per_s": nobjs / duration,
+            "bytes_per_s": nbytes / duration,
+            "batch_p50": percentile(latencies, 50),
+            "batch_p99": percentile(latencies, 99),
+        }
+
+
+@click.group()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.pass_context
+def cli(ctx, config_file):
+    """Benchmark the graph and content replayers"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    ctx.obj = config_read(config_file) if config_file else {}
+
+
+@cli.command()
+@click.option("--type", "-t", "object_types", multiple=True, required=True)
+@click.option("--limit", "-n", default=10000, show_default=True, help="Per type")
+@click.option(
+    "--with-contents",
+    type=click.Path(file_okay=False),
+    help="Copy the recorded contents from the configured source objstorage "
+    "into a local pathslicing objstorage in this directory",
+)
+@click.argument("output", type=click.File("wb"))
+@click.pass_obj
+def record(cfg, object_types, limit, with_contents, output):
+    """Record messages from the journal into a dump file
+
+    Uses the journal_client section of the configuration file (and the
+    objstorage section with --with-contents).
+    """
+    journal_cfg = cfg["journal_client"]
+    prefix = journal_cfg.get("prefix", "swh.journal.objects")
+    consumer = Consumer(kafka_config(journal_cfg, "bench"))
+    src = dst = None
+    if with_contents:
+        src = get_objstorage(**cfg["objstorage"])
+        dst = get_objstorage(**local_objstorage_config(with_contents))
+
+    counts: Dict[str, int] = dict.fromkeys(object_types, 0)
+    partitions: Set[Tuple[str, int]] = set()
+
+    def on_assign(cons, parts):
+        partitions.update((p.topic, p.partition) for p in parts)
+
+    consumer.subscribe([f"{prefix}.{t}" for t in object_types], on_assign=on_assign)
+    try:
+        while any(count < limit for count in counts.values()):
+            msg = consumer.poll(timeout=10.0)
+            if msg is None:
+                if not partitions:
+                    break
+                continue
+            if msg.error():
+                if msg.error().name() == "_PARTITION_EOF":
+                    partitions.discard((msg.topic(), msg.partition()))
+                    if not partitions:
+                        break
+                    continue
+                raise KafkaException(msg.error())
+            object_type = msg.topic()[len(prefix) + 1 :]
+            if counts[object_type] >= limit:
+                continue
+            counts[object_type] += 1
+            output.write(msgpack.packb((object_type, msg.key(), msg.value())))
+            if dst is not None and object_type == "content":
+                content = kafka_to_value(msg.value())
+                if content.get("status") == "visible":
+                    obj_id = objid_from_dict(content)
+                    dst.add(src.get(obj_id), obj_id)
+    finally:
+        consumer.close()
+    logger.info("Recorded %s", counts)
+
+
+@cli.command()
+@click.option(
+    "--replayer",
+    type=click.Choice(["graph", "content"]),
+    default="graph",
+    show_default=True,
+)
+@click.option("--type", "-t", "object_types", multiple=True)
+@click.option(
+    "--batch-size",
+    multiple=True,
+    type=int,
+    default=[100, 1000, 2000],
+    show_default=True,
+)
+@click.option(
+    "--concurrency", multiple=True, type=int, default=[1, 4, 16], show_default=True
+)
+@click.option(
+    "--pool-maxsize", multiple=True, type=int, default=[10], show_default=True
+)
+@click.option("--validate/--no-validate", default=True, show_default=True)
+@click.option(
+    "--contents",
+    type=click.Path(exists=True, file_okay=False),
+    help="Local objstorage written by record --with-contents, used as source "
+    "by the content replayer instead of the configured objstorage",
+)
+@click.option(
+    "--output",
+    type=click.File("a"),
+    default="-",
+    help="JSON lines file the results are appended to",
+)
+@click.argument("dump", type=click.Path(exists=True, dir_okay=False))
+@click.pass_obj
+def run(
+    cfg,
+    replayer,
+    object_types,
+    batch_size,
+    concurrency,
+    pool_maxsize,
+    validate,
+    contents,
+    output,
+    dump,
+):
+    """Replay a dump with every combination of the swept parameters
+
+    The graph replayer writes in the storage of the configuration file
+    (defaults to an in-memory storage); each run starts from new, empty
+    databases with the schema and flavor of its postgresql ones (which need
+    not be idle, as they are not copied), and remote or cassandra storages can
+    only be used for a single run. Its
+    concurrency is the number of batches processed in parallel. The content
+    replayer copies into a fresh local pathslicing objstorage; its concurrency
+    is the number of copy threads.
+    """
+    messages = load_dump(dump, set(object_types))
+    if replayer == "content":
+        if contents:
+            src_cfg = local_objstorage_config(contents)
+        else:
+            src_cfg = cfg["objstorage"]
+    else:
+        storage_cfg = cfg.get("storage", {"cls": "memory"})
+        persistent = {
+            backend["cls"]
+            for backend in iter_backends(storage_cfg)
+            if backend["cls"] in ("remote", "cassandra")
+        }
+        nruns = len(batch_size) * len(concurrency) * len(pool_maxsize)
+        if persistent and nruns > 1:
+            raise click.ClickException(
+                f"Runs would not start from the same {', '.join(persistent)} "
+                "storage; use a postgresql or memory storage to sweep parameters, "
+                "or run each combination against a reset storage"
+            )
+    image_tag = os.environ.get("SWH_IMAGE_TAG", os.environ.get("SWH_VER", "unknown"))
+
+    for bsize, conc, pmaxsize in itertools.product(
+        batch_size, concurrency, pool_maxsize
+    ):
+        logger.info(
+            "Running the %s replayer with batch_size=%s concurrency=%s "
+            "pool_maxsize=%s",
+            replayer,
+            bsize,
+            conc,
+            pmaxsize,
+        )
+        if replayer == "graph":
+            client = run_graph_replay(
+                storage_cfg,
+                messages,
+                bsize,
+                conc,
+                pmaxsize,
+                validate,
+            )
+        else:
+            client = run_content_replay(
+                src_cfg, messages.get("content", []), bsize, conc, pmaxsize
+            )
+        for result in summarize(client):
+            result.update(
+                {
+                    "image_tag": image_tag,
+                    "replayer": replayer,
+                    "batch_size": bsize,
+                    "concurrency": conc,
+                    "pool_maxsize": pmaxsize,
+                }
+            )
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            logger.info(
+                "%(object_type)s: %(objects_per_s).1f obj/s, %(bytes_per_s).0f B/s, "
+                "p50=%(batch_p50).3fs p99=%(batch_p99).3fs",
+                result,
+            )
+
+
+if __name__ == "__main__":
+    cli()
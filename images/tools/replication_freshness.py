@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# freshness of the mirror: time between the (kafka) timestamp of the journal
+# messages and the end of their replay in the local storage or objstorage,
+# reported by the replayers as a histogram per object type
+
+import logging
+import sys
+import time
+from typing import Dict, List
+
+from confluent_kafka import TIMESTAMP_NOT_AVAILABLE
+from swh.core.statsd import statsd
+from swh.journal import client
+
+logger = logging.getLogger(__name__)
+
+FRESHNESS_METRIC = "swh_replayer_freshness"
+# number of messages per batch and object type whose freshness is reported
+SAMPLES_PER_BATCH = 32
+
+
+class FreshnessJournalClient(client.JournalClient):
+    """Journal client reporting, once the worker function is done with a batch
+    of objects (so they are written in the mirror), the time elapsed since
+    their messages were written in the journal.
+
+    Only a sample of the messages of each batch is reported (with the
+    matching statsd sample rate), to bound the traffic to the statsd exporter
+    whatever the batch size.
+    """
+
+    def _init_decoded_objects(self) -> None:
+        super()._init_decoded_objects()
+        self.timestamps: Dict[str, List[int]] = {}
+
+    def process_one_object(self, decoded_object, decoded_object_type, raw_message):
+        super().process_one_object(decoded_object, decoded_object_type, raw_message)
+        ts_type, ts = raw_message.timestamp()
+        if ts_type != TIMESTAMP_NOT_AVAILABLE:
+            self.timestamps.setdefault(decoded_object_type, []).append(ts)
+
+    def commit_batch(self):
+        timestamps = self.timestamps
+        super().commit_batch()
+        now = time.time() * 1000
+        for object_type, values in timestamps.items():
+            sample_rate = min(1, SAMPLES_PER_BATCH / len(values))
+            for ts in values:
+                statsd.timing(
+                    FRESHNESS_METRIC,
+                    max(0, now - ts),
+                    tags={"object_type": object_type},
+                    sample_rate=sample_rate,
+                )
+
+
+def install() -> None:
+    """Make the journal clients of the replayers report their freshness"""
+    client.JournalClient = FreshnessJournalClient  # type: ignore[misc]
+
+
+def main() -> None:
+    """Run the ``swh`` command given as arguments, e.g. ``storage replay``,
+    reporting the freshness of the replayed objects"""
+    from swh.core.cli import main as swh_main
+
+    install()
+    sys.argv = ["swh", *sys.argv[1:]]
+    swh_main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# monitor the replication lag of the replayers' kafka consumer groups, per
+# partition, from the broker watermarks and the committed offsets
+
+import logging
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import click
+from confluent_kafka import ConsumerGroupTopicPartitions, TopicPartition
+from confluent_kafka.admin import AdminClient, OffsetSpec
+from swh.core.config import read as config_read
+from swh.core.statsd import statsd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 15.0
+REQUEST_TIMEOUT = 60.0
+
+
+class PartitionLag(NamedTuple):
+    group: str
+    topic: str
+    partition: int
+    # None when the group never committed an offset on this partition
+    committed: Optional[int]
+    low: int
+    high: int
+
+    @property
+    def lag(self) -> int:
+        if self.committed is None or self.committed < self.low:
+            return self.high - self.low
+        return max(self.high - self.committed, 0)
+
+
+def kafka_admin_config(journal_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """Build a confluent_kafka admin client config from a swh journal client
+    config section (as used by the replayers)"""
+    cfg = {k: v for k, v in journal_cfg.items() if "." in k}
+    # these are consumer-only settings the admin client would choke on
+    for k in ("session.timeout.ms", "max.poll.interval.ms", "fetch.max.bytes"):
+        cfg.pop(k, None)
+    cfg["bootstrap.servers"] = ",".join(journal_cfg["brokers"])
+    return cfg
+
+
+class LagMonitor:
+    """Compute the lag of each partition of the topics consumed by a set of
+    consumer groups.
+
+    Partitions on which a group has not committed any offset yet are reported
+    with their full size as lag, so a group is only considered done once it
+    has consumed every partition of its topics up to the high watermark.
+    """
+
+    def __init__(
+        self,
+        admin: AdminClient,
+        groups: Dict[str, List[str]],
+        prefix: str,
+    ):
+        self.admin = admin
+        # group -> topics
+        self.groups = {
+            group: [f"{prefix}.{object_type}" for object_type in object_types]
+            for group, object_types in groups.items()
+        }
+        self.last_poll: Optional[float] = None
+        self.last_committed: Dict[Tuple[str, str, int], Optional[int]] = {}
+        # per-partition consume rate (messages/s) over the last poll interval
+        self.rates: Dict[Tuple[str, str, int], float] = {}
+
+    def topic_partitions(self) -> Dict[str, List[TopicPartition]]:
+        metadata = self.admin.list_topics(timeout=REQUEST_TIMEOUT)
+        tps: Dict[str, List[TopicPartition]] = {}
+        for topic in {topic for topics in self.groups.values() for topic in topics}:
+            if topic not in metadata.topics:
+                # an absent topic has no message to consume
+                logger.warning("Topic %s not found", topic)
+                continue
+            tps[topic] = [
+                TopicPartition(topic, partition)
+                for partition in metadata.topics[topic].partitions
+            ]
+        return tps
+
+    def watermarks(
+        self, tps: List[TopicPartition]
+    ) -> Dict[Tuple[str, int], Tuple[int, int]]:
+        lows = self.admin.list_offsets(
+            {tp: OffsetSpec.earliest() for tp in tps}, request_timeout=REQUEST_TIMEOUT
+        )
+        highs = self.admin.list_offsets(
+            {tp: OffsetSpec.latest() for tp in tps}, request_timeout=REQUEST_TIMEOUT
+        )
+        return {
+            (tp.topic, tp.partition): (
+                lows[tp].result().offset,
+                highs[tp].result().offset,
+            )
+            for tp in tps
+        }
+
+    def committed(
+        self, group: str, tps: List[TopicPartition]
+    ) -> Dict[Tuple[str, int], Optional[int]]:
+        futures = self.admin.list_consumer_group_offsets(
+            [ConsumerGroupTopicPartitions(group, tps)],
+            request_timeout=REQUEST_TIMEOUT,
+        )
+        return {
+            (tp.topic, tp.partition): tp.offset if tp.offset >= 0 else None
+            for tp in futures[group].result().topic_partitions
+        }
+
+    def poll(self) -> List[PartitionLag]:
+        """Compute the current lag of all the partitions of all the groups"""
+        now = time.monotonic()
+        tps_by_topic = self.topic_partitions()
+        watermarks = self.watermarks(
+            [tp for tps in tps_by_topic.values() for tp in tps]
+        )
+        lags: List[PartitionLag] = []
+        for group, topics in self.groups.items():
+            tps = [tp for topic in topics for tp in tps_by_topic.get(topic, [])]
+            committed = self.committed(group, tps) if tps else {}
+            for tp in tps:
+                low, high = watermarks[(tp.topic, tp.partition)]
+                lags.append(
+                    PartitionLag(
+                        group,
+                        tp.topic,
+                        tp.partition,
+                        committed.get((tp.topic, tp.partition)),
+                        low,
+                        high,
+                    )
+                )
+
+        for lag in lags:
+            key = (lag.group, lag.topic, lag.partition)
+            previous = self.last_committed.get(key)
+            if self.last_poll is not None and lag.committed is not None:
+                self.rates[key] = (
+                    lag.committed - (lag.low if previous is None else previous)
+                ) / (now - self.last_poll)
+            self.last_committed[key] = lag.committed
+        self.last_poll = now
+        return lags
+
+    def report(self, lags: List[PartitionLag]) -> Dict[str, bool]:
+        """Send the lag metrics to statsd, log a summary per group and return
+        whether each group is done"""
+        done: Dict[str, bool] = {}
+        for group in self.groups:
+            group_lags = [lag for lag in lags if lag.group == group]
+            total_lag = sum(lag.lag for lag in group_lags)
+            total_rate = 0.0
+            for lag in group_lags:
+                tags = {
+                    "group": group,
+                    "topic": lag.topic,
+                    "partition": str(lag.partition),
+                }
+                rate = self.rates.get((group, lag.topic, lag.partition))
+                statsd.gauge("swh_mirror_replication_lag", lag.lag, tags=tags)
+                if rate is not None:
+                    total_rate += rate
+                    statsd.gauge("swh_mirror_replication_consume_rate", rate, tags=tags)
+            done[group] = all(lag.lag == 0 for lag in group_lags)
+            tags = {"group": group}
+            statsd.gauge("swh_mirror_replication_group_lag", total_lag, tags=tags)
+            statsd.gauge(
+                "swh_mirror_replication_group_consume_rate", total_rate, tags=tags
+            )
+            statsd.gauge("swh_mirror_replication_done", int(done[group]), tags=tags)
+            if total_rate > 0:
+                statsd.gauge(
+                    "swh_mirror_replication_eta_seconds",
+                    total_lag / total_rate,
+                    tags=tags,
+                )
+            logger.info(
+                "%s: lag=%s (%s/%s partitions done), rate=%.1f msg/s%s",
+                group,
+                total_lag,
+                len([lag for lag in group_lags if lag.lag == 0]),
+                len(group_lags),
+                total_rate,
+                f", eta={total_lag / total_rate:.0f}s" if total_rate > 0 else "",
+            )
+        return done
+
+    def wait_done(
+        self, interval: float = DEFAULT_INTERVAL, timeout: Optional[float] = None
+    ) -> None:
+        """Wait for all the groups to have consumed all their partitions"""
+        t0 = time.monotonic()
+        done: Dict[str, bool] = {group: False for group in self.groups}
+        while True:
+            try:
+                done = self.report(self.poll())
+            except Exception:
+                logger.exception("Failed to compute the replication lag")
+            if all(done.values()):
+                return
+            if timeout is not None and time.monotonic() - t0 > timeout:
+                raise TimeoutError(
+                    "Replication not done for "
+                    + ", ".join(group for group, ok in done.items() if not ok)
+                )
+            time.sleep(interval)
+
+
+def from_config(cfg: Dict[str, Any]) -> LagMonitor:
+    journal_cfg = cfg["journal_client"]
+    return LagMonitor(
+        AdminClient(kafka_admin_config(journal_cfg)),
+        cfg["replication_lag"]["groups"],
+        journal_cfg.get("prefix", "swh.journal.objects"),
+    )
+
+
+@click.command()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="Exit as soon as all the groups are done instead of running forever",
+)
+@click.option("--timeout", type=float, help="Give up waiting after this many seconds")
+def main(config_file, wait, timeout):
+    """Export the replication lag of the replayers as prometheus metrics"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file)
+    interval = cfg["replication_lag"].get("interval", DEFAULT_INTERVAL)
+    monitor = from_config(cfg)
+    if wait:
+        monitor.wait_done(interval=interval, timeout=timeout)
+        return
+    while True:
+        t0 = time.monotonic()
+        try:
+            monitor.report(monitor.poll())
+        except Exception:
+            logger.exception("Failed to compute the replication lag")
+        time.sleep(max(interval - (time.monotonic() - t0), 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# partition scheduler of the storage scrubber: each replica runs several
+# checker threads, which claim partitions from the scrubber database in units
+# sized from the observed throughput (and steal them from each other), and
+# exports the progress and ETA of the scrubbing pass
+
+from collections import deque
+import logging
+import os
+import signal
+import threading
+import time
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import click
+from swh.core.config import read as config_read
+from swh.core.statsd import statsd
+from swh.scrubber import get_scrubber_db
+from swh.scrubber.db import ScrubberDb
+from swh.scrubber.storage_checker import StorageChecker
+from swh.scrubber.storage_checker import get_datastore as get_storage_datastore
+from swh.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+# wanted duration of the processing of a unit of partitions by a worker
+DEFAULT_UNIT_DURATION = 300.0
+MAX_UNIT_SIZE = 256
+# weight of the last partition in the throughput averages
+EWMA_ALPHA = 0.2
+# window over which the partition rate of all the replicas is computed
+RATE_WINDOW = 600
+REPORT_INTERVAL = 30.0
+# delay before claiming again partitions claimed by another replica meanwhile
+CLAIM_RETRY_DELAY = 1.0
+
+METRIC_PREFIX = "swh_scrubber_scheduler_"
+
+
+class CountingStorageChecker(StorageChecker):
+    """Storage checker counting the objects (rows) of the partitions it
+    checks"""
+
+    rows = 0
+
+    def check_object_hashes(self, objects):
+        self.rows += len(objects)
+        super().check_object_hashes(objects)
+
+    def check_object_references(self, objects):
+        if not self.check_hashes:
+            self.rows += len(objects)
+        super().check_object_references(objects)
+
+
+class PartitionScheduler:
+    """Hand the partitions of a check configuration out to the workers of this
+    replica.
+
+    Partitions are claimed (i.e. their start_date is set, as done by ``swh
+    scrubber check storage``, so both can run at the same time) by units of
+    consecutive partitions, reset ones first. The size of a unit is the
+    number of partitions expected to be checked in ``unit_duration`` seconds,
+    from the average rows per partition and rows per second observed so far;
+    it shrinks towards the end of the pass so all the workers finish at about
+    the same time. Each worker has its own queue of claimed partitions, and
+    steals half of the largest one when its queue and the database are empty.
+    """
+
+    def __init__(
+        self,
+        db: ScrubberDb,
+        config_id: int,
+        workers: int,
+        unit_duration: float = DEFAULT_UNIT_DURATION,
+    ):
+        self.db = db
+        self.config_id = config_id
+        self.config = db.config_get(config_id)
+        self.nb_partitions = self.config.nb_partitions
+        self.unit_duration = unit_duration
+        self.queues: List[Deque[int]] = [deque() for _ in range(workers)]
+        self.lock = threading.Lock()
+        self.exhausted = False
+        self.rows_per_partition: Optional[float] = None
+        self.rows_per_second: Optional[float] = None
+        self.tags = {
+            "object_type": self.config.object_type.name.lower(),
+            "config": self.config.name,
+        }
+
+    def unit_size(self, remaining: int) -> int:
+        if self.rows_per_partition is None or not self.rows_per_second:
+            size = 1
+        else:
+            seconds_per_partition = self.rows_per_partition / self.rows_per_second
+            size = int(self.unit_duration / max(seconds_per_partition, 1e-3))
+        # keep enough partitions for the other workers of all the replicas
+        tail = remaining // (2 * len(self.queues))
+        return max(1, min(size, tail, MAX_UNIT_SIZE))
+
+    def claim(self, count: int) -> List[int]:
+        """Reserve ``count`` partitions in the scrubber database"""
+        with self.db.transaction() as cur:
+            cur.execute(
+                """with free as (
+                     select partition_id from checked_partition
+                     where config_id = %(config_id)s and start_date is null
+                     order by partition_id limit %(count)s
+                     for update skip locked)
+                   update checked_partition p set start_date = now()
+                   from free
+                   where p.config_id = %(config_id)s
+                     and p.partition_id = free.partition_id
+                   returning p.partition_id""",
+                {"config_id": self.config_id, "count": count},
+            )
+            claimed = sorted(pid for (pid,) in cur.fetchall())
+            if len(claimed) < count:
+                cur.execute(
+                    """insert into checked_partition
+                         (config_id, partition_id, start_date)
+                       select %(config_id)s, pid, now()
+                       from generate_series(
+                         (select coalesce(max(partition_id) + 1, 0)
+                          from checked_partition
+                          where config_id = %(config_id)s),
+                         %(last)s) as pid
+                       limit %(count)s
+                       on conflict (config_id, partition_id) do nothing
+                       returning partition_id""",
+                    {
+                        "config_id": self.config_id,
+                        "last": self.nb_partitions - 1,
+                        "count": count - len(claimed),
+                    },
+                )
+                claimed += sorted(pid for (pid,) in cur.fetchall())
+        return claimed
+
+    def remaining(self) -> int:
+        """Number of partitions not claimed yet"""
+        with self.db.transaction() as cur:
+            cur.execute(
+                """select %(nb)s - count(*) filter (where start_date is not null)
+                   from checked_partition where config_id = %(config_id)s""",
+                {"config_id": self.config_id, "nb": self.nb_partitions},
+            )
+            (remaining,) = cur.fetchone()
+        return remaining
+
+    def next(self, worker: int) -> Optional[int]:
+        """The next partition to be checked by ``worker``, None when there
+        is none left"""
+        with self.lock:
+            queue = self.queues[worker]
+            if queue:
+                return queue.popleft()
+            while not self.exhausted:
+                remaining = self.remaining()
+                if remaining <= 0:
+                    self.exhausted = True
+                    break
+                claimed = self.claim(self.unit_size(remaining))
+                if claimed:
+                    statsd.gauge(
+                        METRIC_PREFIX + "unit_size", len(claimed), tags=self.tags
+                    )
+                    queue.extend(claimed)
+                    return queue.popleft()
+                # another replica claimed the partitions meanwhile (e.g. the
+                # same new ones): try the next ones
+                time.sleep(CLAIM_RETRY_DELAY)
+            victim = max(self.queues, key=len)
+            if not victim:
+                return None
+            stolen = [victim.pop() for _ in range((len(victim) + 1) // 2)]
+            statsd.increment(METRIC_PREFIX + "steals_total", tags=self.tags)
+            queue.extend(reversed(stolen))
+            return queue.popleft()
+
+    def done(self, rows: int, duration: float) -> None:
+        """Account for a partition of ``rows`` rows checked in ``duration``
+        seconds"""
+        with self.lock:
+            rate = rows / max(duration, 1e-3)
+            if self.rows_per_partition is None or self.rows_per_second is None:
+                self.rows_per_partition, self.rows_per_second = rows, rate
+            else:
+                self.rows_per_partition += EWMA_ALPHA * (rows - self.rows_per_partition)
+                self.rows_per_second += EWMA_ALPHA * (rate - self.rows_per_second)
+        statsd.increment(METRIC_PREFIX + "partitions_checked_total", tags=self.tags)
+        statsd.increment(METRIC_PREFIX + "rows_checked_total", rows, tags=self.tags)
+        statsd.timing(
+            METRIC_PREFIX + "partition_duration_seconds",
+            duration * 1000,
+            tags=self.tags,
+        )
+
+    def release(self) -> None:
+        """Give the claimed partitions which were not checked back"""
+        with self.lock:
+            pending = [pid for queue in self.queues for pid in queue]
+            for queue in self.queues:
+                queue.clear()
+            self.exhausted = True
+            if pending:
+                with self.db.transaction() as cur:
+                    cur.execute(
+                        """update checked_partition set start_date = null
+                           where config_id = %s and partition_id = any(%s)""",
+                        (self.config_id, pending),
+                    )
+                logger.info("Released %s partitions", len(pending))
+
+
+def pass_progress(db: ScrubberDb, config_id: int) -> Tuple[int, int, float]:
+    """Number of partitions checked in the current pass, number of partitions
+    and partitions checked per second (over the last RATE_WINDOW seconds) by
+    all the workers of the configuration"""
+    with db.transaction() as cur:
+        cur.execute(
+            """select
+                 count(*) filter (where end_date >= start_date),
+                 count(*) filter (
+                   where end_date >= now() - make_interval(secs => %(window)s))
+               from checked_partition where config_id = %(config_id)s""",
+            {"config_id": config_id, "window": RATE_WINDOW},
+        )
+        checked, recent = cur.fetchone()
+    nb_partitions = db.config_get(config_id).nb_partitions
+    return checked, nb_partitions, recent / RATE_WINDOW
+
+
+def report_progress(db: ScrubberDb, config_id: int, tags: Dict[str, str]) -> None:
+    checked, nb_partitions, rate = pass_progress(db, config_id)
+    remaining = nb_partitions - checked
+    statsd.gauge(METRIC_PREFIX + "partitions", nb_partitions, tags=tags)
+    statsd.gauge(METRIC_PREFIX + "partitions_checked", checked, tags=tags)
+    statsd.gauge(METRIC_PREFIX + "partitions_per_second", rate, tags=tags)
+    if rate:
+        statsd.gauge(METRIC_PREFIX + "eta_seconds", remaining / rate, tags=tags)
+    logger.info(
+        "%s/%s partitions checked (%.2f/s)%s",
+        checked,
+        nb_partitions,
+        rate,
+        f", ETA {remaining / rate / 3600:.1f}h" if rate else "",
+    )
+
+
+class Worker(threading.Thread):
+    def __init__(
+        self,
+        index: int,
+        scheduler: PartitionScheduler,
+        cfg: Dict[str, Any],
+        stop: threading.Event,
+    ):
+        super().__init__(name=f"scrubber-{index}")
+        self.index = index
+        self.scheduler = scheduler
+        self.stop = stop
+        self.checker = CountingStorageChecker(
+            db=get_scrubber_db(**cfg["scrubber"]),
+            storage=get_storage(**cfg["storage"]),
+            config_id=scheduler.config_id,
+        )
+
+    def run(self) -> None:
+        object_type = self.checker.object_type
+        while not self.stop.is_set():
+            partition_id = self.scheduler.next(self.index)
+            if partition_id is None:
+                break
+            self.checker.rows = 0
+            t0 = time.monotonic()
+            try:
+                self.checker._check_partition(object_type, partition_id)
+                self.checker.db.checked_partition_upsert(
+                    self.scheduler.config_id, partition_id
+                )
+            except Exception:
+                # left claimed but unchecked, like with swh scrubber check
+                logger.exception("Failed to check partition %s", partition_id)
+                statsd.increment(
+                    METRIC_PREFIX + "partitions_failed_total", tags=self.scheduler.tags
+                )
+                continue
+            self.scheduler.done(self.checker.rows, time.monotonic() - t0)
+
+
+def get_config_id(cfg: Dict[str, Any], db: ScrubberDb, name: str) -> int:
+    datastore = get_storage_datastore(storage=get_storage(**cfg["storage"]))
+    config_id = db.config_get_by_name(name, db.datastore_get_or_add(datastore))
+    if config_id is None:
+        raise click.ClickException(f"No scrubber configuration {name}")
+    return config_id
+
+
+@click.group()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+    help="Configuration file with the storage and scrubber sections",
+)
+@click.pass_context
+def cli(ctx, config_file):
+    """Partition scheduler of the storage scrubber"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file)
+    ctx.obj = {"config": cfg, "db": get_scrubber_db(**cfg["scrubber"])}
+
+
+@cli.command()
+@click.argument("name")
+@click.option(
+    "--workers",
+    default=int(os.environ.get("SCRUBBER_WORKERS", DEFAULT_WORKERS)),
+    show_default=True,
+    help="Number of checker threads",
+)
+@click.option(
+    "--unit-duration",
+    default=DEFAULT_UNIT_DURATION,
+    show_default=True,
+    help="Wanted duration (in seconds) of a unit of claimed partitions",
+)
+@click.pass_obj
+def run(obj, name, workers, unit_duration):
+    """Check the partitions of the scrubber configuration NAME"""
+    cfg, db = obj["config"], obj["db"]
+    config_id = get_config_id(cfg, db, name)
+    scheduler = PartitionScheduler(db, config_id, workers, unit_duration)
+    stop = threading.Event()
+
+    def on_signal(signum, frame):
+        logger.info("Stopping after the current partitions")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    threads = [Worker(i, scheduler, cfg, stop) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    # the progress is read from a connection of its own
+    progress_db = get_scrubber_db(**cfg["scrubber"])
+    while any(thread.is_alive() for thread in threads):
+        try:
+            report_progress(progress_db, config_id, scheduler.tags)
+        except Exception:
+            logger.exception("Failed to compute the progress of %s", name)
+        stop.wait(REPORT_INTERVAL)
+        if stop.is_set():
+            break
+    for thread in threads:
+        thread.join()
+    scheduler.release()
+    report_progress(progress_db, config_id, scheduler.tags)
+
+
+@cli.command()
+@click.argument("name")
+@click.pass_obj
+def status(obj, name):
+    """Show the progress of the current pass of the configuration NAME"""
+    config_id = get_config_id(obj["config"], obj["db"], name)
+    checked, nb_partitions, rate = pass_progress(obj["db"], config_id)
+    click.echo(f"{checked}/{nb_partitions} partitions checked")
+    click.echo(f"{rate * 3600:.0f} partitions per hour")
+    if rate:
+        click.echo(f"ETA: {(nb_partitions - checked) / rate / 3600:.1f}h")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# backfill mode of the search journal clients: the origin and visit status
+# topics are indexed into elasticsearch with large parallel bulk requests
+# (index refresh and replicas turned off), up to the end offsets seen at
+# startup, which are then committed for the incremental journal clients
+
+from collections import deque
+from contextlib import contextmanager
+import datetime
+import logging
+import os
+import random
+import time
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import click
+from confluent_kafka import OFFSET_BEGINNING, Consumer, KafkaException, TopicPartition
+from elasticsearch import Elasticsearch, helpers
+from mirror_verify import kafka_config
+from swh.core.config import read as config_read
+from swh.core.statsd import statsd
+from swh.journal.serializers import kafka_to_value, value_to_kafka
+from swh.model.hashutil import hash_to_hex
+from swh.model.model import Origin, OriginVisit
+from swh.search import get_search
+from swh.search.elasticsearch import (
+    ORIGIN_MAPPING,
+    ORIGIN_SETTINGS,
+    ORIGIN_UPDATE_SCRIPT,
+    _sanitize_origin,
+)
+from swh.search.journal_client import convert_journal_object
+from swh.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 2000
+DEFAULT_THREADS = 4
+DEFAULT_PREFIX = "swh.journal.objects"
+OBJECT_TYPES = ("origin", "origin_visit_status")
+CHECKPOINT_INTERVAL = 60.0
+PROGRESS_INTERVAL = 10.0
+
+DOCUMENTS_METRIC = "swh_search_backfill_documents_total"
+
+
+def origin_actions(documents: Iterable[Dict[str, Any]], index: str) -> Iterator[Dict]:
+    """Bulk actions upserting origin documents, as done by the origin_update
+    endpoint of the search service (so documents of the same origin are merged
+    in any order)"""
+    for document in map(_sanitize_origin, documents):
+        sha1 = hash_to_hex(Origin(url=document["url"]).id)
+        yield {
+            "_op_type": "update",
+            "_id": sha1,
+            "_index": index,
+            "scripted_upsert": True,
+            "upsert": {**document, "sha1": sha1},
+            "retry_on_conflict": 10,
+            "script": {
+                "source": ORIGIN_UPDATE_SCRIPT,
+                "lang": "painless",
+                "params": document,
+            },
+        }
+
+
+def bulk_index(
+    es: Elasticsearch,
+    actions: Iterable[Dict],
+    batch_size: int,
+    threads: int,
+) -> Iterator[bool]:
+    """Run ``actions`` in bulk requests of ``batch_size`` actions, ``threads``
+    requests at a time; yield whether each action succeeded, in order"""
+    for ok, info in helpers.parallel_bulk(
+        es,
+        actions,
+        thread_count=threads,
+        chunk_size=batch_size,
+        queue_size=2 * threads,
+        raise_on_error=False,
+    ):
+        if not ok:
+            logger.warning("Failed to index a document: %s", info)
+        yield ok
+
+
+@contextmanager
+def bulk_settings(
+    es: Elasticsearch, index: str, replicas: Optional[int] = None
+) -> Iterator[None]:
+    """Turn the refresh and the replicas of ``index`` off, and set them back
+    to their previous values (or to ``replicas`` replicas) afterwards"""
+    (settings,) = es.indices.get_settings(index=index).values()
+    refresh_interval = settings["settings"]["index"].get("refresh_interval")
+    if refresh_interval == "-1":
+        # left by an interrupted backfill: back to the default
+        refresh_interval = None
+    if replicas is None:
+        replicas = int(settings["settings"]["index"].get("number_of_replicas", 1))
+    es.indices.put_settings(
+        index=index,
+        settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}},
+    )
+    logger.info("Turned the refresh and replicas of %s off", index)
+    try:
+        yield
+    finally:
+        es.indices.put_settings(
+            index=index,
+            settings={
+                "index": {
+                    "refresh_interval": refresh_interval,
+                    "number_of_replicas": replicas,
+                }
+            },
+        )
+        logger.info(
+            "Restored the settings of %s (refresh_interval: %s, replicas: %s)",
+            index,
+            refresh_interval,
+            replicas,
+        )
+
+
+def end_offsets(consumer: Consumer, topics: List[str]) -> Dict[Tuple[str, int], int]:
+    """The current end offsets of the (non empty) partitions of ``topics``"""
+    metadata = consumer.list_topics(timeout=30)
+    offsets = {}
+    for topic in topics:
+        if topic not in metadata.topics:
+            raise click.ClickException(f"Unknown topic {topic}")
+        for partition in metadata.topics[topic].partitions:
+            low, high = consumer.get_watermark_offsets(
+                TopicPartition(topic, partition), timeout=30
+            )
+            if high > low:
+                offsets[(topic, partition)] = high
+    return offsets
+
+
+class Backfill:
+    """Index the messages of the journal topics of the search journal clients,
+    from the offsets committed by their consumer group (the beginning of the
+    topics for a new mirror) to the end offsets at startup.
+
+    The offsets are committed (for the consumer group of the journal clients,
+    which must not be running) as the documents are indexed, so an
+    interrupted backfill can be resumed, and the incremental journal clients
+    start where it ended. No offsets are committed any more once a document
+    failed, so a resumed backfill indexes it again.
+    """
+
+    def __init__(
+        self,
+        es: Elasticsearch,
+        index: str,
+        storage,
+        journal_cfg: Dict[str, Any],
+        object_types: Iterable[str] = OBJECT_TYPES,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        threads: int = DEFAULT_THREADS,
+    ):
+        self.es = es
+        self.index = index
+        self.storage = storage
+        self.batch_size = batch_size
+        self.threads = threads
+        self.prefix = journal_cfg.get("prefix") or DEFAULT_PREFIX
+        self.topics = [f"{self.prefix}.{object_type}" for object_type in object_types]
+        cfg = kafka_config(journal_cfg, "backfill")
+        cfg["group.id"] = journal_cfg["group_id"]
+        self.consumer = Consumer(cfg)
+        # (number of documents, offsets to commit once they are indexed)
+        self.pending: Deque[Tuple[int, List[TopicPartition]]] = deque()
+        self.stats = {"messages": 0, "documents": 0, "errors": 0}
+
+    def assign(self) -> Dict[Tuple[str, int], int]:
+        """Assign the partitions which have messages left; return their end
+        offsets"""
+        ends = end_offsets(self.consumer, self.topics)
+        committed = self.consumer.committed(
+            [TopicPartition(topic, partition) for topic, partition in ends],
+            timeout=30,
+        )
+        assignment = []
+        for tp in committed:
+            if tp.offset >= ends[(tp.topic, tp.partition)]:
+                del ends[(tp.topic, tp.partition)]
+                continue
+            if tp.offset < 0:
+                tp.offset = OFFSET_BEGINNING
+            assignment.append(tp)
+        self.consumer.assign(assignment)
+        logger.info("Backfilling %s partitions", len(assignment))
+        return ends
+
+    def documents(self, ends: Dict[Tuple[str, int], int]) -> Iterator[Dict]:
+        """Yield the documents of the messages up to ``ends``, recording the
+        offsets to commit after each batch of messages"""
+        while ends:
+            messages = self.consumer.consume(num_messages=self.batch_size, timeout=1)
+            offsets: Dict[Tuple[str, int], int] = {}
+            count = 0
+            for msg in messages:
+                if msg.error():
+                    if msg.error().name() == "_PARTITION_EOF":
+                        ends.pop((msg.topic(), msg.partition()), None)
+                        continue
+                    raise KafkaException(msg.error())
+                key = (msg.topic(), msg.partition())
+                if key not in ends or msg.offset() >= ends[key]:
+                    continue
+                offsets[key] = msg.offset() + 1
+                if offsets[key] >= ends[key]:
+                    del ends[key]
+                self.stats["messages"] += 1
+                object_type = msg.topic()[len(self.prefix) + 1 :]
+                document = convert_journal_object(
+                    object_type, kafka_to_value(msg.value()), self.storage
+                )
+                if document:
+                    count += 1
+                    yield document
+            if offsets:
+                self.pending.append(
+                    (
+                        count,
+                        [TopicPartition(t, p, o) for (t, p), o in offsets.items()],
+                    )
+                )
+
+    def run(self) -> Dict[str, int]:
+        ends = self.assign()
+        t0 = last_log = last_commit = time.monotonic()
+        done = reported = 0
+        to_commit: Dict[Tuple[str, int], TopicPartition] = {}
+
+        def commit():
+            if to_commit:
+                self.consumer.commit(
+                    offsets=list(to_commit.values()), asynchronous=False
+                )
+                to_commit.clear()
+
+        actions = origin_actions(self.documents(ends), self.index)
+        for ok in bulk_index(self.es, actions, self.batch_size, self.threads):
+            done += 1
+            self.stats["documents" if ok else "errors"] += 1
+            if not ok and self.stats["errors"] == 1:
+                logger.error(
+                    "A document failed: no further offsets are committed, so a "
+                    "resumed backfill indexes it again"
+                )
+            # the offsets of a batch of messages are committed once all its
+            # documents (and the previous ones) have been indexed, as long as
+            # none of them failed
+            while (
+                not self.stats["errors"] and self.pending and self.pending[0][0] <= done
+            ):
+                count, offsets = self.pending.popleft()
+                done -= count
+                to_commit.update(((tp.topic, tp.partition), tp) for tp in offsets)
+            now = time.monotonic()
+            if now - last_commit >= CHECKPOINT_INTERVAL:
+                commit()
+                last_commit = now
+            if now - last_log >= PROGRESS_INTERVAL:
+                statsd.increment(DOCUMENTS_METRIC, self.stats["documents"] - reported)
+                reported = self.stats["documents"]
+                self.log_progress(now - t0)
+                last_log = now
+        # the batches without documents
+        while not self.stats["errors"] and self.pending and self.pending[0][0] <= done:
+            to_commit.update(
+                ((tp.topic, tp.partition), tp) for tp in self.pending.popleft()[1]
+            )
+        commit()
+        statsd.increment(DOCUMENTS_METRIC, self.stats["documents"] - reported)
+        self.log_progress(time.monotonic() - t0)
+        self.consumer.close()
+        return self.stats
+
+    def log_progress(self, elapsed: float) -> None:
+        logger.info(
+            "%s messages, %s documents indexed (%.0f docs/s), %s errors",
+            self.stats["messages"],
+            self.stats["documents"],
+            self.stats["documents"] / elapsed if elapsed else 0,
+            self.stats["errors"],
+        )
+
+
+def elasticsearch_backend(cfg: Dict[str, Any]) -> Tuple[Elasticsearch, str]:
+    """The elasticsearch client and origin index of the search section"""
+    if cfg["search"]["cls"] != "elasticsearch":
+        raise click.ClickException("The search section must be an elasticsearch one")
+    search = get_search(**cfg["search"])
+    search.initialize()
+    return search._backend, search._get_origin_index()
+
+
+@click.group()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(exists=True, dir_okay=False),
+    help="Configuration file with the search (elasticsearch), storage and "
+    "journal sections",
+)
+@click.pass_context
+def cli(ctx, config_file):
+    """Backfill of the search index"""
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    ctx.obj = config_read(config_file) if config_file else {}
+
+
+@cli.command()
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option(
+    "--threads",
+    default=DEFAULT_THREADS,
+    show_default=True,
+    help="Number of bulk requests in flight",
+)
+@click.option(
+    "--replicas",
+    type=int,
+    help="Number of replicas of the index after the backfill (default: as before)",
+)
+@click.option(
+    "--max-num-segments",
+    type=int,
+    help="Number of segments of the index after the final force merge",
+)
+@click.option("--object-type", "-o", "object_types", multiple=True)
+@click.pass_obj
+def run(cfg, batch_size, threads, replicas, max_num_segments, object_types):
+    """Index the origin and visit status topics up to their current end
+
+    The search journal clients (using the consumer group of the journal
+    section) must be stopped meanwhile; they resume from the offsets the
+    backfill ended at.
+    """
+    es, index = elasticsearch_backend(cfg)
+    backfill = Backfill(
+        es,
+        index,
+        get_storage(**cfg["storage"]),
+        cfg["journal"],
+        object_types or cfg["journal"].get("object_types") or OBJECT_TYPES,
+        batch_size=batch_size,
+        threads=threads,
+    )
+    with bulk_settings(es, index, replicas):
+        stats = backfill.run()
+    es.indices.refresh(index=index)
+    t0 = time.monotonic()
+    logger.info("Force merging %s", index)
+    es.options(request_timeout=24 * 3600).indices.forcemerge(
+        index=index, max_num_segments=max_num_segments
+    )
+    logger.info("Force merged %s in %.1fs", index, time.monotonic() - t0)
+    if stats["errors"]:
+        raise click.ClickException(f"{stats['errors']} documents failed")
+
+
+def synthetic_messages(
+    storage, origins: int, visits: int, typed: bool = True
+) -> Iterator[Tuple[str, bytes]]:
+    """Messages of the origin and visit status topics (visit statuses without
+    a visit type unless ``typed``, with their visits added to ``storage``)"""
+    date = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(origins):
+        url = f"https://example.org/bench/{random.getrandbits(64):x}/{i}"
+        yield "origin", value_to_kafka({"url": url})
+        if not typed:
+            storage.origin_add([Origin(url=url)])
+            storage.origin_visit_add(
+                [
+                    OriginVisit(
+                        origin=url,
+                        visit=visit,
+                        date=date + datetime.timedelta(days=visit),
+                        type="git",
+                    )
+                    for visit in range(1, visits + 1)
+                ]
+            )
+        for visit in range(1, visits + 1):
+            status = {
+                "origin": url,
+                "visit": visit,
+                "date": date + datetime.timedelta(days=visit),
+                "status": "full",
+                "snapshot": os.urandom(20),
+                "metadata": None,
+            }
+            if typed:
+                status["type"] = "git"
+            yield "origin_visit_status", value_to_kafka(status)
+
+
+def convert_messages(
+    messages: Iterable[Tuple[str, bytes]], storage
+) -> Iterator[Dict[str, Any]]:
+    """The documents of ``messages``, converted as by :meth:`Backfill.documents`"""
+    for object_type, value in messages:
+        document = convert_journal_object(object_type, kafka_to_value(value), storage)
+        if document:
+            yield document
+
+
+@cli.command()
+@click.option(
+    "--url",
+    default="http://localhost:9200",
+    show_default=True,
+    help="URL of the (local) elasticsearch to benchmark",
+)
+@click.option(
+    "--storage-url",
+    help="URL of a disposable storage RPC server to convert the visit statuses "
+    "with (default: an in-memory storage)",
+)
+@click.option("--origins", default=100_000, show_default=True)
+@click.option("--visits", default=3, show_default=True, help="Per origin")
+@click.option(
+    "--typed/--untyped",
+    default=True,
+    show_default=True,
+    help="Whether the visit statuses have their visit type, or it is fetched "
+    "from the storage (as for the messages of older journals)",
+)
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@click.option("--threads", default=DEFAULT_THREADS, show_default=True)
+@click.option(
+    "--incremental-sample",
+    default=5000,
+    show_default=True,
+    help="Number of messages indexed one at a time, as by the journal clients",
+)
+def bench(
+    url, storage_url, origins, visits, typed, batch_size, threads, incremental_sample
+):
+    """Compare the throughput of the journal clients and of the backfill
+    (deserialization, conversion and indexing of the messages), on synthetic
+    messages in a temporary index, e.g. of a local elasticsearch container::
+
+        docker run --rm -p 9200:9200 -e discovery.type=single-node \\
+            -e xpack.security.enabled=false elasticsearch:8.17.0
+    """
+    es = Elasticsearch(hosts=[url], request_timeout=600)
+    if storage_url:
+        storage = get_storage("remote", url=storage_url)
+    else:
+        storage = get_storage("memory")
+    index = f"origin-bench-{os.getpid()}"
+    es.indices.create(index=index, settings=ORIGIN_SETTINGS, mappings=ORIGIN_MAPPING)
+    try:
+        # the messages are generated (and their visits added to the storage)
+        # beforehand, out of the measured time
+        messages = list(
+            synthetic_messages(
+                storage, incremental_sample // (visits + 1) or 1, visits, typed
+            )
+        )
+        t0 = time.monotonic()
+        for document in convert_messages(messages, storage):
+            helpers.bulk(es, origin_actions([document], index))
+        incremental = len(messages) / (time.monotonic() - t0)
+        click.echo(f"incremental: {len(messages)} messages, {incremental:.0f} msg/s")
+
+        messages = list(synthetic_messages(storage, origins, visits, typed))
+        t0 = time.monotonic()
+        with bulk_settings(es, index):
+            actions = origin_actions(convert_messages(messages, storage), index)
+            ok = sum(bulk_index(es, actions, batch_size, threads))
+        bulk = len(messages) / (time.monotonic() - t0)
+        click.echo(
+            f"backfill: {len(messages)} messages ({len(messages) - ok} errors), "
+            f"{bulk:.0f} msg/s ({bulk / incremental:.1f}x)"
+        )
+        t0 = time.monotonic()
+        es.indices.refresh(index=index)
+        es.options(request_timeout=3600).indices.forcemerge(index=index)
+        click.echo(f"refresh and force merge: {time.monotonic() - t0:.1f}s")
+    finally:
+        es.indices.delete(index=index)
+
+
+if __name__ == "__main__":
+    cli()
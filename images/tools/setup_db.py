@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# one-shot database setup (init-admin, init, upgrade) of a swh service: the
+# schema versions are checked first, and only one of the replicas of the
+# service (holding a postgresql advisory lock) runs the migration steps
+
+from contextlib import contextmanager
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import click
+import psycopg
+from swh.core.cli.db import db as db_cli
+from swh.core.cli.db import handle_cmd_args
+from swh.core.config import read as config_read
+from swh.core.db.db_utils import get_sql_for_package
+
+logger = logging.getLogger(__name__)
+
+# (package:cls, connection string, expected version)
+Backend = Tuple[str, str, Optional[int]]
+
+
+def expected_version(dbmodule: str, backend_class: Optional[type]) -> Optional[int]:
+    """The schema version a backend expects, without instantiating it: its
+    ``current_version`` class attribute if any, or the last upgrade script of
+    its sql directory"""
+    version = getattr(backend_class, "current_version", None)
+    if isinstance(version, int):
+        return version
+    try:
+        upgrades = get_sql_for_package(dbmodule, upgrade=True)
+    except Exception:
+        return None
+    return max((int(f.stem) for f in upgrades if f.stem.isdigit()), default=None)
+
+
+def get_backends(
+    cfg: Dict[str, Any], module: str, dbname: Optional[str]
+) -> List[Backend]:
+    return [
+        (f"{package}:{cls}", cnxstr, expected_version(f"{package}:{cls}", backend))
+        for _, package, cls, _, backend, cnxstr, _ in handle_cmd_args(
+            cfg=cfg, module=module, do_all=dbname is None, dbname=dbname
+        )
+    ]
+
+
+def db_version(cnxstr: str) -> Optional[int]:
+    """Current schema version of a database, None if it is not initialized"""
+    with psycopg.connect(cnxstr, autocommit=True) as db:
+        try:
+            row = db.execute(
+                "select version from dbversion order by dbversion desc limit 1"
+            ).fetchone()
+        except (psycopg.errors.UndefinedTable, psycopg.errors.UndefinedColumn):
+            return None
+    return row[0] if row else None
+
+
+def outdated(backends: List[Backend]) -> List[str]:
+    """The databases of ``backends`` which are not at their expected version
+    (or the expected version of which is unknown)"""
+    result = []
+    for dbmodule, cnxstr, expected in backends:
+        version = db_version(cnxstr)
+        logger.info(
+            "%s database is at version %s (expected %s)", dbmodule, version, expected
+        )
+        if version is None or expected is None or version < expected:
+            result.append(dbmodule)
+    return result
+
+
+def lock_key(name: str) -> int:
+    """A (signed 64 bits) advisory lock key for ``name``"""
+    return int.from_bytes(
+        hashlib.sha1(f"swh-setup-db:{name}".encode()).digest()[:8],
+        "big",
+        signed=True,
+    )
+
+
+@contextmanager
+def advisory_lock(cnxstr: str, name: str) -> Iterator[None]:
+    """Hold a session level advisory lock of the database ``cnxstr``, waiting
+    for it if another replica has it"""
+    key = lock_key(name)
+    with psycopg.connect(cnxstr, autocommit=True) as db:
+        (locked,) = db.execute("select pg_try_advisory_lock(%s)", (key,)).fetchone()
+        if not locked:
+            logger.info("Waiting for another replica to set up the %s database", name)
+            t0 = time.monotonic()
+            db.execute("select pg_advisory_lock(%s)", (key,))
+            logger.info("Got the lock after %.1fs", time.monotonic() - t0)
+        try:
+            yield
+        finally:
+            db.execute("select pg_advisory_unlock(%s)", (key,))
+
+
+def run_setup(cfg: Dict[str, Any], module: str, dbname: Optional[str], flavor: str):
+    """Run the ``swh db`` init-admin, init and upgrade steps in process"""
+    target = ["-d", dbname] if dbname else ["--all"]
+    flavor_opt = ["--flavor", flavor] if flavor else []
+    steps = [
+        ("Creating extensions", ["init-admin", *target, module]),
+        ("Initializing the database", ["init", *flavor_opt, *target, module]),
+        ("Upgrading the database", ["upgrade", "--non-interactive", *target, module]),
+    ]
+    for i, (title, args) in enumerate(steps, 1):
+        logger.info(" step %s: %s...", i, title)
+        db_cli.main(
+            args, prog_name="swh db", obj={"config": cfg}, standalone_mode=False
+        )
+
+
+@click.command()
+@click.option(
+    "--config-file",
+    "-C",
+    default=os.environ.get("SWH_CONFIG_FILENAME"),
+    type=click.Path(dir_okay=False),
+)
+@click.option(
+    "--dbname",
+    "-d",
+    help="Connection string of the database; by default, all the databases "
+    "of MODULE found in the config file are set up",
+)
+@click.option("--flavor", help="Flavor of the databases, when initialized")
+@click.argument("module")
+def main(config_file, dbname, flavor, module):
+    """Initialize or upgrade the databases of a swh MODULE, if needed
+
+    The replicas of a service all run this at startup: once the databases are
+    at the expected version, it only costs one connection per database; if
+    not, the first replica to get the advisory lock runs the migration while
+    the others wait for it, then check the versions again.
+    """
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
+    )
+    cfg = config_read(config_file) if config_file else {}
+    backends = get_backends(cfg, module, dbname)
+    if not backends:
+        raise click.ClickException(f"No database found for {module}")
+    if not outdated(backends):
+        logger.info("%s databases are up to date", module)
+        return
+
+    # the main database is the last one of the config (see pgsql.sh)
+    with advisory_lock(backends[-1][1], module):
+        todo = outdated(backends)
+        if not todo:
+            logger.info("%s databases set up by another replica", module)
+            return
+        t0 = time.monotonic()
+        logger.info("Setting up %s", ", ".join(todo))
+        run_setup(cfg, module, dbname, flavor)
+        logger.info("%s databases set up in %.1fs", module, time.monotonic() - t0)
+
+
+if __name__ == "__main__":
+    main()
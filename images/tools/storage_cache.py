@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# read-through memcached cache of the immutable objects served by the
+# storage-public RPC server (revisions, releases, directory entries and
+# snapshot branches), used as the gunicorn app of the service instead of
+# swh.storage.api.server:make_app_from_configfile(); also sets up the filter
+# of masked objects of the masking proxy (see masking_filter.py)
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from masking_filter import FilteredMaskingProxyStorage, MaskFilter
+import psycopg
+from pymemcache.client.hash import HashClient
+from swh.core.api.serializers import msgpack_dumps, msgpack_loads
+from swh.core.statsd import statsd
+from swh.model.swhids import ExtendedObjectType, ExtendedSWHID
+from swh.storage import get_storage
+from swh.storage.api import server
+from swh.storage.api.serializers import DECODERS, ENCODERS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_INVALIDATION_INTERVAL = 10.0
+DEFAULT_PREFIX = "swh-storage:"
+# memcached's default max item size is 1MiB
+MAX_VALUE_SIZE = 1000 * 1000
+
+REQUESTS_METRIC = "swh_storage_cache_requests_total"
+DURATION_METRIC = "swh_storage_cache_duration_seconds"
+
+
+def memcached_client(servers: List[str]) -> HashClient:
+    hosts = []
+    for spec in servers:
+        host, _, port = spec.partition(":")
+        hosts.append((host, int(port or 11211)))
+    return HashClient(
+        hosts,
+        connect_timeout=1,
+        timeout=1,
+        no_delay=True,
+        # a memcached server going away is only a cache miss
+        ignore_exc=True,
+    )
+
+
+class CachingStorage:
+    """Storage proxy serving some methods read-through from memcached.
+
+    Only the results about immutable objects are cached, and only for the
+    calls with the default paging arguments, so each object has a fixed set
+    of keys which can be invalidated. Objects not found are not cached, as
+    they may be replicated later on.
+
+    Sample configuration use case for caching storage::
+
+        storage_cache:
+          servers:
+            - memcache:11211
+          ttl: 86400
+    """
+
+    def __init__(
+        self,
+        storage,
+        servers: List[str],
+        ttl: int = DEFAULT_TTL,
+        prefix: str = DEFAULT_PREFIX,
+    ):
+        self.storage = storage
+        self.client = memcached_client(servers)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def __getattr__(self, key):
+        if key == "storage":
+            raise AttributeError(key)
+        return getattr(self.storage, key)
+
+    def key(self, method: str, obj_id: bytes, variant: str = "") -> str:
+        return f"{self.prefix}{method}:{obj_id.hex()}{variant}"
+
+    def cached(
+        self,
+        method: str,
+        keys: List[str],
+        fetch: Callable[[List[int]], List[Any]],
+    ) -> List[Any]:
+        """Look ``keys`` up in a single multi-get, call ``fetch`` with the
+        indices of the missing ones and store its (non None) results"""
+        t0 = time.monotonic()
+        found = self.client.get_many(keys) if keys else {}
+        results: List[Any] = [None] * len(keys)
+        missing: List[int] = []
+        for i, key in enumerate(keys):
+            if key in found:
+                results[i] = msgpack_loads(found[key], extra_decoders=DECODERS)
+            else:
+                missing.append(i)
+        tags = {"method": method}
+        statsd.increment(
+            REQUESTS_METRIC, len(keys) - len(missing), tags={**tags, "result": "hit"}
+        )
+        if missing:
+            statsd.increment(
+                REQUESTS_METRIC, len(missing), tags={**tags, "result": "miss"}
+            )
+            to_store: Dict[str, bytes] = {}
+            for i, result in zip(missing, fetch(missing)):
+                results[i] = result
+                if result is not None:
+                    value = msgpack_dumps(result, extra_encoders=ENCODERS)
+                    if len(value) <= MAX_VALUE_SIZE:
+                        to_store[keys[i]] = value
+            if to_store:
+                self.client.set_many(to_store, expire=self.ttl, noreply=True)
+        statsd.timing(
+            DURATION_METRIC,
+            (time.monotonic() - t0) * 1000,
+            tags={**tags, "result": "miss" if missing else "hit"},
+        )
+        return results
+
+    def _get_many(self, method: str, ids: List[bytes], ignore_displayname: bool):
+        variant = ":raw" if ignore_displayname else ""
+        return self.cached(
+            method,
+            [self.key(method, obj_id, variant) for obj_id in ids],
+            lambda missing: getattr(self.storage, method)(
+                [ids[i] for i in missing], ignore_displayname=ignore_displayname
+            ),
+        )
+
+    def revision_get(self, revision_ids, ignore_displayname=False):
+        return self._get_many("revision_get", revision_ids, ignore_displayname)
+
+    def release_get(self, releases, ignore_displayname=False):
+        return self._get_many("release_get", releases, ignore_displayname)
+
+    def directory_get_entries(self, directory_id, page_token=None, limit=1000):
+        if page_token is not None or limit != 1000:
+            return self.storage.directory_get_entries(
+                directory_id, page_token=page_token, limit=limit
+            )
+        return self.cached(
+            "directory_get_entries",
+            [self.key("directory_get_entries", directory_id)],
+            lambda missing: [self.storage.directory_get_entries(directory_id)],
+        )[0]
+
+    def snapshot_get_branches(
+        self,
+        snapshot_id,
+        branches_from=b"",
+        branches_count=1000,
+        target_types=None,
+        branch_name_include_substring=None,
+        branch_name_exclude_prefix=None,
+    ):
+        if (
+            branches_from
+            or branches_count != 1000
+            or target_types is not None
+            or branch_name_include_substring is not None
+            or branch_name_exclude_prefix is not None
+        ):
+            return self.storage.snapshot_get_branches(
+                snapshot_id,
+                branches_from=branches_from,
+                branches_count=branches_count,
+                target_types=target_types,
+                branch_name_include_substring=branch_name_include_substring,
+                branch_name_exclude_prefix=branch_name_exclude_prefix,
+            )
+        return self.cached(
+            "snapshot_get_branches",
+            [self.key("snapshot_get_branches", snapshot_id)],
+            lambda missing: [self.storage.snapshot_get_branches(snapshot_id)],
+        )[0]
+
+    def invalidate(self, swhids: Iterable[ExtendedSWHID]) -> int:
+        """Drop the cached results about the given objects"""
+        keys: List[str] = []
+        for swhid in swhids:
+            obj_id = swhid.object_id
+            if swhid.object_type == ExtendedObjectType.REVISION:
+                keys += [
+                    self.key("revision_get", obj_id),
+                    self.key("revision_get", obj_id, ":raw"),
+                ]
+            elif swhid.object_type == ExtendedObjectType.RELEASE:
+                keys += [
+                    self.key("release_get", obj_id),
+                    self.key("release_get", obj_id, ":raw"),
+                ]
+            elif swhid.object_type == ExtendedObjectType.DIRECTORY:
+                keys.append(self.key("directory_get_entries", obj_id))
+            elif swhid.object_type == ExtendedObjectType.SNAPSHOT:
+                keys.append(self.key("snapshot_get_branches", obj_id))
+        if keys:
+            self.client.delete_many(keys, noreply=True)
+            statsd.increment("swh_storage_cache_invalidated_total", len(keys))
+        return len(keys)
+
+
+class MaskInvalidator(threading.Thread):
+    """Poll the masking proxy database for the masking requests recorded (or
+    updated) since the last poll and invalidate the cached results about
+    their objects.
+
+    The first poll looks ``ttl`` seconds back, as older cached results have
+    expired anyway.
+    """
+
+    def __init__(
+        self,
+        cache: CachingStorage,
+        masking_db: str,
+        interval: float = DEFAULT_INVALIDATION_INTERVAL,
+    ):
+        super().__init__(daemon=True)
+        self.cache = cache
+        self.masking_db = masking_db
+        self.interval = interval
+        self.since = None
+
+    def poll(self, db: psycopg.Connection) -> None:
+        if self.since is None:
+            (self.since,) = db.execute(
+                "select now() - make_interval(secs => %s)", (self.cache.ttl,)
+            ).fetchone()
+        (now,) = db.execute("select now()").fetchone()
+        rows: List[Tuple[str, bytes]] = db.execute(
+            """select distinct o.object_type::text, o.object_id
+               from masked_object o
+               where o.request in (
+                 select id from masking_request where date >= %(since)s
+                 union
+                 select request from masking_request_history
+                 where date >= %(since)s)""",
+            {"since": self.since},
+        ).fetchall()
+        self.since = now
+        if rows:
+            count = self.cache.invalidate(
+                ExtendedSWHID(
+                    object_type=ExtendedObjectType[object_type.upper()],
+                    object_id=object_id,
+                )
+                for object_type, object_id in rows
+            )
+            logger.info("Invalidated %s cached results of masked objects", count)
+
+    def run(self) -> None:
+        db: Optional[psycopg.Connection] = None
+        while True:
+            try:
+                if db is None or db.closed:
+                    db = psycopg.connect(self.masking_db, autocommit=True)
+                self.poll(db)
+            except Exception:
+                logger.exception("Failed to poll the masking requests")
+            time.sleep(self.interval)
+
+
+def make_app_from_configfile() -> server.StorageServerApp:
+    """Run the storage RPC server, with the read-through cache configured in
+    the storage_cache section of the config file; when the storage is a
+    masking proxy, the cache is set up right below it, so masks are still
+    applied to every request, and the masking proxy checks the results
+    against the filter configured in the masking_filter section, if any."""
+    cfg = server.load_and_check_config(os.environ.get("SWH_CONFIG_FILENAME"))
+    cache_cfg = dict(cfg.get("storage_cache") or {})
+    filter_cfg = cfg.get("masking_filter")
+    storage_cfg = cfg["storage"]
+    if not cache_cfg and filter_cfg is None:
+        return server.make_app_from_configfile()
+
+    masking = storage_cfg["cls"] == "masking"
+    backend = get_storage(**(storage_cfg["storage"] if masking else storage_cfg))
+    if cache_cfg:
+        interval = cache_cfg.pop("invalidation_interval", None)
+        cache = backend = CachingStorage(backend, **cache_cfg)
+        logger.info("Caching storage results in %s", ", ".join(cache_cfg["servers"]))
+    if masking:
+        masking_db = storage_cfg.get("masking_db") or storage_cfg["db"]
+        proxy_cfg = {
+            k: v for k, v in storage_cfg.items() if k not in ("cls", "storage")
+        }
+        if filter_cfg is not None:
+            mask_filter = MaskFilter(masking_db, **filter_cfg)
+            mask_filter.start()
+            server.storage = FilteredMaskingProxyStorage(
+                storage=backend, mask_filter=mask_filter, **proxy_cfg
+            )
+            logger.info("Checking the masked objects against a filter")
+        else:
+            server.storage = get_storage(cls="masking", storage=backend, **proxy_cfg)
+        if cache_cfg:
+            MaskInvalidator(
+                cache, masking_db, interval or DEFAULT_INVALIDATION_INTERVAL
+            ).start()
+    else:
+        server.storage = backend
+    return server.make_app_from_configfile()
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# size-bounded vault cache: the size of the cooked bundles is recorded in the
+# vault database, and the least recently fetched ones are evicted when the
+# cache goes over its budget, by a sweeper run within the vault RPC server,
+# used as its gunicorn app instead of
+# swh.vault.api.server:make_app_from_configfile(); the cooked bundles can
+# also be downloaded straight from nginx, on signed links
+
+import base64
+from datetime import timedelta
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlencode
+
+import psycopg
+from swh.core.statsd import statsd
+from swh.model.swhids import CoreSWHID
+from swh.objstorage.exc import ObjNotFoundError
+from swh.vault import get_vault
+from swh.vault.api import server
+from swh.vault.backend import NotFoundExc
+from swh.vault.cache import VaultCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 300.0
+# fraction of max_size the cache is shrunk to when evicting
+LOW_WATERMARK = 0.9
+BATCH_SIZE = 1000
+# the sweeper of all the workers (and replicas) of the vault service
+LOCK_KEY = "vault_cache_sweeper"
+# validity of the download links
+DEFAULT_EXPIRY = 3600
+
+SIZE_METRIC = "swh_vault_cache_size_bytes"
+BUNDLES_METRIC = "swh_vault_cache_bundles"
+EVICTED_METRIC = "swh_vault_cache_evicted_total"
+EVICTED_BYTES_METRIC = "swh_vault_cache_evicted_bytes_total"
+
+SCHEMA = """
+create table if not exists vault_bundle_size (
+  bundle_id bigint primary key references vault_bundle(id) on delete cascade,
+  size bigint not null
+);
+"""
+
+# the least recently fetched bundles, up to ``excess`` bytes (a bundle fetched
+# while they are evicted is kept)
+LRU_QUERY = """
+select id, type::text, swhid, size, ts_last_access from (
+  select b.id, b.type, b.swhid, s.size, b.ts_last_access,
+         sum(s.size) over (order by b.ts_last_access, b.id) - s.size as before
+  from vault_bundle b join vault_bundle_size s on s.bundle_id = b.id
+  where not b.sticky and b.task_status = 'done'
+) t
+where before < %s
+order by ts_last_access, id
+limit %s
+"""
+
+# the (top level) objects of bundles which are masked, from a masking proxy
+# database
+MASKED_QUERY = """
+select object_type::text, object_id from masked_object
+where state != 'visible'
+and (object_type::text, object_id) in (
+  select * from unnest(%s::text[], %s::bytea[])
+)
+"""
+
+
+class CacheSweeper(threading.Thread):
+    """Keep the vault cache under ``max_size`` bytes.
+
+    Every ``interval`` seconds, the sweeper records the size of the bundles
+    cooked since its previous run (in the vault_bundle_size table), then
+    evicts the least recently fetched (non sticky) bundles until the cache is
+    back under its low watermark. The bundles which are masked in the
+    ``masking_db`` database, if any, are evicted as well (sticky or not).
+
+    Sample configuration use case for the sweeper::
+
+        cache_sweeper:
+          max_size: 100_000_000_000
+          interval: 300
+    """
+
+    def __init__(
+        self,
+        db: str,
+        cache: Dict[str, Any],
+        max_size: int,
+        interval: float = DEFAULT_INTERVAL,
+        masking_db: Optional[str] = None,
+    ):
+        super().__init__(daemon=True)
+        self.dsn = db
+        self.cache = VaultCache(**cache)
+        self.max_size = max_size
+        self.interval = interval
+        self.masking_db = masking_db
+
+    def bundle_size(self, bundle_type: str, swhid: str) -> int:
+        """Size of a bundle in the cache (on disk for a pathslicing cache)"""
+        obj_id = self.cache._get_internal_id(bundle_type, CoreSWHID.from_string(swhid))
+        objstorage = self.cache.objstorage
+        try:
+            slicer = getattr(objstorage, "slicer", None)
+            if slicer is not None:
+                return os.stat(slicer.get_path(obj_id["sha1"].hex())).st_size
+            return len(objstorage.get(obj_id))
+        except (FileNotFoundError, ObjNotFoundError):
+            # cooked again on the next request
+            return 0
+
+    def record_sizes(self, db: psycopg.Connection) -> int:
+        count = 0
+        while True:
+            rows = db.execute(
+                """select b.id, b.type::text, b.swhid from vault_bundle b
+                   left join vault_bundle_size s on s.bundle_id = b.id
+                   where b.task_status = 'done' and s.bundle_id is null
+                   limit %s""",
+                (BATCH_SIZE,),
+            ).fetchall()
+            if not rows:
+                return count
+            with db.cursor() as cur:
+                cur.executemany(
+                    """insert into vault_bundle_size (bundle_id, size)
+                       values (%s, %s) on conflict do nothing""",
+                    [
+                        (bundle_id, self.bundle_size(bundle_type, swhid))
+                        for bundle_id, bundle_type, swhid in rows
+                    ],
+                )
+            count += len(rows)
+
+    def evict(
+        self, db: psycopg.Connection, rows: List[Tuple[Any, ...]], reason: str
+    ) -> Tuple[int, int]:
+        """Evict the bundles (id, type, swhid, size, last access) of ``rows``
+        (unless fetched since, when evicted for lack of space); return the
+        number of bundles and bytes evicted.
+
+        The row of each bundle is deleted in a transaction committed once its
+        cached file is deleted, so a bundle the file of which can't be deleted
+        is kept (and logged) instead of being left on disk untracked.
+        """
+        count = size = 0
+        for bundle_id, bundle_type, swhid, bundle_size, last_access in rows:
+            try:
+                with db.transaction():
+                    deleted = db.execute(
+                        """delete from vault_bundle
+                           where id = %s and (%s or ts_last_access <= %s)""",
+                        (bundle_id, reason != "lru", last_access),
+                    ).rowcount
+                    if deleted:
+                        try:
+                            self.cache.delete(bundle_type, CoreSWHID.from_string(swhid))
+                        except ObjNotFoundError:
+                            pass
+            except Exception:
+                logger.exception("Failed to evict the %s bundle %s", bundle_type, swhid)
+                continue
+            if deleted:
+                count += 1
+                size += bundle_size
+        if count:
+            statsd.increment(EVICTED_METRIC, count, tags={"reason": reason})
+            statsd.increment(EVICTED_BYTES_METRIC, size, tags={"reason": reason})
+            logger.info("Evicted %s %s bundles (%s bytes)", count, reason, size)
+        return count, size
+
+    def evict_masked(self, db: psycopg.Connection) -> None:
+        assert self.masking_db is not None
+        with psycopg.connect(self.masking_db) as masking_db:
+            last_id = 0
+            while True:
+                bundles = db.execute(
+                    """select b.id, b.type::text, b.swhid, s.size, b.ts_last_access
+                       from vault_bundle b
+                       join vault_bundle_size s on s.bundle_id = b.id
+                       where b.id > %s order by b.id limit %s""",
+                    (last_id, BATCH_SIZE),
+                ).fetchall()
+                if not bundles:
+                    return
+                last_id = bundles[-1][0]
+                swhids = [CoreSWHID.from_string(row[2]) for row in bundles]
+                masked = set(
+                    masking_db.execute(
+                        MASKED_QUERY,
+                        (
+                            [swhid.object_type.name.lower() for swhid in swhids],
+                            [swhid.object_id for swhid in swhids],
+                        ),
+                    ).fetchall()
+                )
+                rows = [
+                    row
+                    for row, swhid in zip(bundles, swhids)
+                    if (swhid.object_type.name.lower(), swhid.object_id) in masked
+                ]
+                if rows:
+                    self.evict(db, rows, "masked")
+
+    def sweep(self, db: psycopg.Connection) -> None:
+        recorded = self.record_sizes(db)
+        if recorded:
+            logger.info("Recorded the size of %s bundles", recorded)
+        if self.masking_db:
+            self.evict_masked(db)
+        (size, count) = db.execute(
+            """select coalesce(sum(s.size), 0), count(*) from vault_bundle_size s"""
+        ).fetchone()
+        if size > self.max_size:
+            excess = size - int(self.max_size * LOW_WATERMARK)
+            while excess > 0:
+                rows = db.execute(LRU_QUERY, (excess, BATCH_SIZE)).fetchall()
+                if not rows:
+                    logger.warning(
+                        "The vault cache is over its budget by %s bytes, but has "
+                        "no bundle left to evict",
+                        excess,
+                    )
+                    break
+                evicted, evicted_size = self.evict(db, rows, "lru")
+                if not evicted:
+                    logger.warning(
+                        "The vault cache is over its budget by %s bytes, but no "
+                        "bundle of the last batch was evicted; trying again on the "
+                        "next sweep",
+                        excess,
+                    )
+                    break
+                excess -= evicted_size
+                size -= evicted_size
+                count -= evicted
+        statsd.gauge(SIZE_METRIC, size)
+        statsd.gauge(BUNDLES_METRIC, count)
+
+    def run(self) -> None:
+        db: Optional[psycopg.Connection] = None
+        while True:
+            try:
+                if db is None or db.closed:
+                    db = psycopg.connect(self.dsn, autocommit=True)
+                (locked,) = db.execute(
+                    "select pg_try_advisory_lock(hashtext(%s))", (LOCK_KEY,)
+                ).fetchone()
+                if locked:
+                    # kept until the connection is closed, so a single worker
+                    # sweeps the cache
+                    db.execute(SCHEMA)
+                    self.sweep(db)
+            except Exception:
+                logger.exception("Failed to sweep the vault cache")
+                if db is not None:
+                    db.close()
+            time.sleep(self.interval)
+
+
+def signed_url(
+    url: str, secret: str, expires: int, filename: str = "", bundle_type: str = ""
+) -> str:
+    """``url`` with the query arguments checked by the secure_link module of
+    nginx, as configured in the /vault-cache/ location of conf/nginx.conf;
+    the (percent-encoded) ``filename`` is sent as the filename* parameter of
+    the Content-Disposition header, and ``bundle_type`` sets the content type"""
+    filename = quote(filename, safe="")
+    digest = hashlib.md5(
+        f"{expires}{url}{filename}{bundle_type} {secret}".encode()
+    ).digest()
+    md5 = base64.urlsafe_b64encode(digest).rstrip(b"=").decode()
+    query = {"md5": md5, "expires": expires}
+    return f"{url}?{urlencode(query)}&filename={filename}&type={bundle_type}"
+
+
+class NginxDownloadVault:
+    """Vault backend proxy answering download_url requests with signed links
+    to the nginx location serving the cache directory, so the cooked bundles
+    are sent by nginx (zero-copy) instead of going through the vault and web
+    workers.
+
+    This requires a pathslicing cache without compression, as nginx sends
+    the files as they are; download_url falls back to the wrapped vault (so
+    to fetching the bundles) otherwise.
+
+    Sample configuration use case for the download links::
+
+        nginx_download:
+          url: /vault-cache/
+          secret: change-me
+          expiry: 3600
+    """
+
+    def __init__(self, vault, url: str, secret: str, expiry: int = DEFAULT_EXPIRY):
+        self.vault = vault
+        self.url = url.rstrip("/") + "/"
+        self.secret = secret
+        self.expiry = expiry
+        objstorage = vault.cache.objstorage
+        self.slicer = getattr(objstorage, "slicer", None)
+        if self.slicer is None or getattr(objstorage, "compression", None) != "none":
+            logger.warning(
+                "The vault cache is not an uncompressed pathslicing objstorage, "
+                "bundles can't be downloaded from nginx"
+            )
+            self.slicer = None
+
+    def __getattr__(self, key):
+        if key == "vault":
+            raise AttributeError(key)
+        return getattr(self.vault, key)
+
+    def download_url(
+        self,
+        bundle_type: str,
+        swhid: CoreSWHID,
+        content_disposition: Optional[str] = None,
+        expiry: Optional[timedelta] = None,
+        raise_notfound: bool = True,
+    ) -> Optional[str]:
+        if self.slicer is None:
+            return self.vault.download_url(
+                bundle_type, swhid, content_disposition, expiry, raise_notfound
+            )
+        if not self.vault.is_available(bundle_type, swhid):
+            if raise_notfound:
+                raise NotFoundExc(f"{bundle_type} {swhid} is not available.")
+            return None
+        # keep the bundles downloaded from nginx in the cache as well
+        self.vault.update_access_ts(bundle_type, swhid)
+        obj_id = self.vault.cache._get_internal_id(bundle_type, swhid)
+        path = self.slicer.get_path(obj_id["sha1"].hex())
+        match = re.search(r'filename="([^"]*)"', content_disposition or "")
+        seconds = int(expiry.total_seconds()) if expiry else self.expiry
+        return signed_url(
+            self.url + os.path.relpath(path, self.slicer.root),
+            self.secret,
+            int(time.time()) + seconds,
+            match.group(1) if match else "",
+            bundle_type,
+        )
+
+
+def make_app_from_configfile() -> server.VaultServerApp:
+    """Run the vault RPC server, with the cache sweeper configured in the
+    cache_sweeper section of the config file, and the nginx download links
+    configured in its nginx_download section"""
+    app = server.make_app_from_configfile()
+    download_cfg = app.config.get("nginx_download")
+    if download_cfg:
+        server.vault = NginxDownloadVault(
+            get_vault(**app.config["vault"]), **download_cfg
+        )
+    sweeper_cfg = app.config.get("cache_sweeper")
+    if sweeper_cfg:
+        vault_cfg = app.config["vault"]
+        CacheSweeper(vault_cfg["db"], vault_cfg["cache"], **sweeper_cfg).start()
+    return app
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+# persistent, size-bounded store of graph nodes keyed by their sha1_git, used
+# by graph_walker.py so that repeated walks only fetch objects new since the
+# last run
+
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import msgpack
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 10 * 2**30
+# fraction of max_size the store is shrunk to when evicting
+LOW_WATERMARK = 0.9
+# max number of host parameters in a single sqlite statement
+MAX_VARIABLES = 999
+
+SCHEMA = """
+pragma journal_mode = wal;
+pragma synchronous = normal;
+create table if not exists node (
+  id blob primary key,
+  value blob not null,
+  -- when the node was fetched from the storage
+  ctime real not null default 0,
+  atime real not null
+) without rowid;
+create index if not exists node_atime on node(atime);
+"""
+
+
+class WalkCache:
+    """SQLite-backed store of immutable graph nodes with LRU eviction.
+
+    Values are msgpack-encoded and their total size is kept below
+    ``max_size`` bytes by evicting the least recently used entries.
+
+    As the stored objects are immutable, entries never need to be updated;
+    but an object may go missing from the storage being checked later on.
+    Entries older than ``max_age`` seconds are thus ignored, so these objects
+    get fetched again (``max_age=0`` checks everything again).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = DEFAULT_MAX_SIZE,
+        max_age: Optional[float] = None,
+    ):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        columns = [row[1] for row in self.db.execute("pragma table_info(node)")]
+        if "ctime" not in columns:
+            # caches created before the entries had an age are all expired
+            self.db.execute("alter table node add column ctime real not null default 0")
+        (self.size,) = self.db.execute(
+            "select coalesce(sum(length(value)), 0) from node"
+        ).fetchone()
+        self.hits = self.misses = 0
+        logger.info("Opened walk cache %s (%s bytes)", path, self.size)
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+    def get_many(self, ids: Iterable[bytes]) -> Dict[bytes, Any]:
+        ids = list(ids)
+        found: Dict[bytes, bytes] = {}
+        now = time.time()
+        min_ctime = -1.0 if self.max_age is None else now - self.max_age
+        with self.lock, self.db:
+            for i in range(0, len(ids), MAX_VARIABLES):
+                chunk = ids[i : i + MAX_VARIABLES]
+                found.update(
+                    self.db.execute(
+                        "select id, value from node where id in (%s) and ctime > ?"
+                        % ",".join("?" * len(chunk)),
+                        [*chunk, min_ctime],
+                    )
+                )
+            self.db.executemany(
+                "update node set atime = ? where id = ?",
+                [(now, obj_id) for obj_id in found],
+            )
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+        return {obj_id: msgpack.unpackb(value) for obj_id, value in found.items()}
+
+    def put_many(self, items: Iterable[Tuple[bytes, Any]]) -> None:
+        rows = [(obj_id, msgpack.packb(value)) for obj_id, value in items]
+        if not rows:
+            return
+        with self.lock:
+            with self.db:
+                now = time.time()
+                for obj_id, value in rows:
+                    # expired entries are replaced
+                    old = self.db.execute(
+                        "select length(value) from node where id = ?", (obj_id,)
+                    ).fetchone()
+                    self.db.execute(
+                        "insert or replace into node (id, value, ctime, atime) "
+                        "values (?, ?, ?, ?)",
+                        (obj_id, value, now, now),
+                    )
+                    self.size += len(value) - (old[0] if old else 0)
+            if self.size > self.max_size:
+                self._evict(int(self.max_size * LOW_WATERMARK))
+
+    def _evict(self, target: int) -> None:
+        evicted = 0
+        with self.db:
+            while self.size > target:
+                rows: List[Tuple[bytes, int]] = self.db.execute(
+                    "select id, length(value) from node order by atime limit 10000"
+                ).fetchall()
+                if not rows:
+                    break
+                to_delete = []
+                for obj_id, length in rows:
+                    to_delete.append((obj_id,))
+                    self.size -= length
+                    if self.size <= target:
+                        break
+                self.db.executemany("delete from node where id = ?", to_delete)
+                evicted += len(to_delete)
+        logger.info("Evicted %s nodes from the walk cache", evicted)
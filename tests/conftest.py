@@ -9,7 +9,8 @@ from pathlib import Path
 import re
 from shutil import copy, copytree
 import socket
-from time import monotonic, sleep
+import sys
+from time import sleep
 from urllib.parse import urlparse
 from uuid import uuid4
 
@@ -19,6 +20,10 @@ from python_on_whales import DockerClient, DockerException
 import requests
 
 SRC_PATH = Path(__file__).resolve().parent.parent
+# make the tools shipped in the mirror image importable from tests
+sys.path.insert(0, str(SRC_PATH / "images" / "tools"))
+
+from readiness import wait_ready  # noqa: E402
 
 KAFKA_USERNAME = environ["SWH_MIRROR_TEST_KAFKA_USERNAME"]
 KAFKA_PASSWORD = environ["SWH_MIRROR_TEST_KAFKA_PASSWORD"]
@@ -39,6 +44,7 @@ LOGGER = logging.getLogger(__name__)
 INITIAL_SERVICES_STATUS = {
     "{}_amqp": "1/1",
     "{}_content-replayer": "0/0",
+    "{}_docker-api": "0/0",
     "{}_elasticsearch": "1/1",
     "{}_grafana": "1/1",
     "{}_graph-replayer": "0/0",
@@ -53,6 +59,8 @@ INITIAL_SERVICES_STATUS = {
     "{}_prometheus": "1/1",
     "{}_prometheus-statsd-exporter": "1/1",
     "{}_redis": "1/1",
+    "{}_replayer-autoscaler": "0/0",
+    "{}_replication-lag-monitor": "1/1",
     "{}_scheduler": "1/1",
     "{}_scheduler-db": "1/1",
     "{}_scheduler-listener": "1/1",
@@ -99,18 +107,11 @@ def pytest_addoption(parser, pluginmanager):
     )
 
 
-def wait_for_it(url):
-    LOGGER.info(f"Waiting for {url}")
-    t0 = monotonic()
-    while monotonic() - t0 <= WFI_TIMEOUT:
-        try:
-            resp = requests.get(url)
-            resp.raise_for_status()
-            LOGGER.info(f"  Got it: {resp}")
-            return
-        except Exception:
-            sleep(1)
-    raise Exception("Connection error")
+def wait_for_it(*urls):
+    """Wait for all the given urls to respond, probing them in parallel"""
+    LOGGER.info(f"Waiting for {', '.join(urls)}")
+    for url, elapsed in wait_ready(list(urls), timeout=WFI_TIMEOUT).items():
+        LOGGER.info(f"  Got {url} after {elapsed:.1f}s")
 
 
 @pytest.fixture(scope="session")
@@ -246,9 +247,7 @@ def mirror_stack(
         got_exception = False
         # for the sake of early checks...
         LOGGER.info("Sanity checks:")
-        wait_for_it(base_url)
-        wait_for_it(f"{api_url}/")
-        wait_for_it(f"{base_url}/mail/api/v2/messages")
+        wait_for_it(base_url, f"{api_url}/", f"{base_url}/mail/api/v2/messages")
         yield docker_stack
     except Exception:
         got_exception = True
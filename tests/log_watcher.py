@@ -0,0 +1,170 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from dataclasses import dataclass, field
+import logging
+from queue import Empty, Queue
+import re
+import subprocess
+import threading
+from time import monotonic
+from typing import IO, Dict, List, Optional, Pattern
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass
+class Expectation:
+    service: str
+    # the expected entry, as given
+    entry: str
+    pattern: Pattern[str]
+    occurrences: int = 1
+    with_stderr: bool = False
+    count: int = 0
+    # seconds from the start of the watch to the last expected occurrence
+    matched_after: Optional[float] = field(default=None)
+
+    @property
+    def done(self) -> bool:
+        return self.count >= self.occurrences
+
+
+class LogWatcher:
+    """Wait for log entries of several swarm services at once.
+
+    The logs of each watched service are followed by a ``docker service
+    logs`` process (with a thread per output stream) and multiplexed in a
+    single queue, the lines of which are matched against the (precompiled)
+    patterns expected for their service. The processes are terminated as soon
+    as all the expected entries have been seen, or on timeout.
+
+    Usage::
+
+        watcher = LogWatcher(docker_client)
+        watcher.expect(service, "Starting the SWH mirror graph replayer", 2)
+        watcher.expect(other_service, "Watching notifications", regex=False)
+        timings = watcher.wait(timeout=600)
+    """
+
+    def __init__(self, docker_client):
+        self.docker_client = docker_client
+        self.expectations: List[Expectation] = []
+        self.services: Dict[str, object] = {}
+        self.lines: Queue = Queue()
+        self.processes: List[subprocess.Popen] = []
+        self.threads: List[threading.Thread] = []
+        self.t0: Optional[float] = None
+
+    def __enter__(self) -> "LogWatcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def expect(
+        self, service, pattern: str, occurrences=1, with_stderr=False, regex=True
+    ) -> Expectation:
+        expectation = Expectation(
+            service.spec.name,
+            pattern,
+            re.compile(pattern if regex else re.escape(pattern)),
+            occurrences,
+            with_stderr,
+        )
+        self.expectations.append(expectation)
+        self.services[service.spec.name] = service
+        return expectation
+
+    def read(self, name: str, stream_type: str, stream: IO[bytes]) -> None:
+        for line in iter(stream.readline, b""):
+            self.lines.put((name, stream_type, line))
+
+    def follow(self, name: str) -> None:
+        process = subprocess.Popen(
+            [
+                *self.docker_client.client_config.docker_cmd,
+                "service",
+                "logs",
+                "--follow",
+                name,
+            ],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        self.processes.append(process)
+        for stream_type, stream in (
+            ("stdout", process.stdout),
+            ("stderr", process.stderr),
+        ):
+            thread = threading.Thread(
+                target=self.read, args=(name, stream_type, stream), daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def close(self) -> None:
+        """Stop following the logs"""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        for thread in self.threads:
+            thread.join()
+        self.processes.clear()
+        self.threads.clear()
+
+    def match(self, name: str, stream_type: str, line: str) -> None:
+        for expectation in self.expectations:
+            if (
+                expectation.done
+                or expectation.service != name
+                or (stream_type != "stdout" and not expectation.with_stderr)
+            ):
+                continue
+            expectation.count += len(expectation.pattern.findall(line))
+            if expectation.done:
+                expectation.matched_after = monotonic() - self.t0
+                LOGGER.info(
+                    "%s: got %r after %.1fs",
+                    name,
+                    expectation.entry,
+                    expectation.matched_after,
+                )
+
+    def wait(self, timeout: Optional[float] = None) -> Dict[str, float]:
+        """Wait for all the expected entries to be logged; return the time it
+        took for each pattern"""
+        self.t0 = monotonic()
+        for name in self.services:
+            self.follow(name)
+        deadline = None if timeout is None else self.t0 + timeout
+        try:
+            while not all(expectation.done for expectation in self.expectations):
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(
+                        "Log entries not found: "
+                        + ", ".join(
+                            f"{e.service}: {e.entry!r} ({e.count}/" f"{e.occurrences})"
+                            for e in self.expectations
+                            if not e.done
+                        )
+                    )
+                try:
+                    name, stream_type, content = self.lines.get(timeout=remaining)
+                except Empty:
+                    continue
+                line = content.decode(errors="replace")
+                LOGGER.debug("%s output: %s", name, line)
+                self.match(name, stream_type, line)
+        finally:
+            self.close()
+        return {f"{e.service}: {e.entry}": e.matched_after for e in self.expectations}
@@ -3,24 +3,29 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
-from hashlib import sha1
-from io import BytesIO
-import re
-import tarfile
+from concurrent.futures import ThreadPoolExecutor
 import time
 from typing import Dict
-from urllib.parse import quote
 
-from confluent_kafka import Consumer, KafkaException
-import msgpack
+from confluent_kafka import Consumer
+from graph_walker import GraphWalker
+from mirror_verify import iter_stats
 import pytest
 from python_on_whales import DockerException
+from readiness import backoff
+import replication_lag
 import requests
+from swh.core.config import read as config_read
 from swh.storage import get_storage
+from vault_load import VaultClient, directory_manifest, validate_flat_bundle
 
 from .conftest import KAFKA_BROKER, KAFKA_PASSWORD, KAFKA_USERNAME, LOGGER
+from .log_watcher import LogWatcher
 
 SCALE = 2
+# max time to wait for expected log entries, in seconds
+LOG_TIMEOUT = 600
+REPLICATION_TIMEOUT = 3600
 
 
 def get(session, url):
@@ -33,16 +38,6 @@ def get(session, url):
     return result
 
 
-def post(session, url):
-    resp = session.post(url)
-    assert resp.status_code in (200, 201, 202)
-    if resp.headers["content-type"].lower() == "application/json":
-        result = resp.json()
-    else:
-        result = resp.content
-    return result
-
-
 def service_target_replicas(service):
     if "Replicated" in service.spec.mode:
         return service.spec.mode["Replicated"]["Replicas"]
@@ -67,7 +62,7 @@ def is_task_running(task):
 def wait_services_status(stack, target_status: Dict[str, str]):
     LOGGER.info("Waiting for services %s", target_status)
     last_changed_status: Dict[str, str] = {}
-    while True:
+    for delay in backoff():
         services = [
             service
             for service in stack.services()
@@ -90,42 +85,11 @@ def wait_services_status(stack, target_status: Dict[str, str]):
                 {k: v for k, v in status.items() if target_status.get(k) != v},
             )
             last_changed_status = status
-        time.sleep(1)
+        time.sleep(delay)
     return status == target_status
 
 
-def wait_for_log_entry(
-    docker_client, service, log_entry, occurrences=1, with_stderr=False
-):
-    count = 0
-    for stream_type, stream_content in docker_client.service.logs(
-        service, follow=True, stream=True
-    ):
-        LOGGER.debug("%s output: %s", service.spec.name, stream_content)
-        if not with_stderr and stream_type != "stdout":
-            continue
-        ncount = len(
-            re.findall(
-                log_entry,
-                stream_content.decode(errors="replace"),
-            )
-        )
-        if not ncount:
-            if log_entry in stream_content.decode(errors="replace"):
-                ncount = 1
-        count += ncount
-        if count >= occurrences:
-            break
-
-
-def get_stats_from_storage(url, base_url):
-
-    from swh.model.model import ReleaseTargetType, SnapshotTargetType
-    import swh.storage.algos.dir_iterators as algo_DI
-    import swh.storage.algos.origin as algo_O
-    import swh.storage.algos.revisions_walker as algo_RW
-    import swh.storage.algos.snapshot as algo_SN
-
+def get_stats_from_storage(urls, base_url):
     storage = get_storage(
         cls="remote",
         url=f"{base_url}/storage-public",
@@ -133,84 +97,8 @@ def get_stats_from_storage(url, base_url):
         pool_connections=10,
         pool_maxsize=20,
     )
-
-    stats = {"origin": url}
-
-    visits = list(algo_O.iter_origin_visits(storage, url))
-    stats["visit"] = len(visits)
-
-    snp_ids = {
-        vs.snapshot
-        for v in visits
-        for vs in algo_O.iter_origin_visit_statuses(storage, url, v.visit)
-        if vs.snapshot
-    }
-
-    snapshots = [
-        algo_SN.snapshot_get_all_branches(storage, snp_id) for snp_id in snp_ids
-    ]
-    branches = [br for snp in snapshots for br in snp.branches.values() if br]
-
-    stats["release"] = len(
-        {br for br in branches if br.target_type == SnapshotTargetType.RELEASE}
-    )
-    stats["alias"] = len(
-        {br for br in branches if br.target_type == SnapshotTargetType.ALIAS}
-    )
-    stats["branch"] = len(
-        {br for br in branches if br.target_type == SnapshotTargetType.REVISION}
-    )
-
-    # resolve aliases
-    rev_ids = {
-        br.target for br in branches if br.target_type == SnapshotTargetType.REVISION
-    }
-    rel_ids = {
-        br.target for br in branches if br.target_type == SnapshotTargetType.RELEASE
-    }
-    dir_ids = {
-        br.target for br in branches if br.target_type == SnapshotTargetType.DIRECTORY
-    }
-    snp_ids.update(
-        {br.target for br in branches if br.target_type == SnapshotTargetType.SNAPSHOT}
-    )
-
-    state = algo_RW.State()
-
-    all_revs = set()
-    all_cnts = set()
-    all_dirs = set()
-
-    all_rels = storage.release_get(list(rel_ids))
-    for rel in all_rels:
-        if rel.target_type == ReleaseTargetType.REVISION:
-            rev_ids.add(rel.target)
-        elif rel.target_type == ReleaseTargetType.DIRECTORY:
-            dir_ids.add(rel.target)
-        elif rel.target_type == ReleaseTargetType.CONTENT:
-            all_cnts.add(rel.target)
-        elif rel.target_type == ReleaseTargetType.RELEASE:
-            raise ValueError("rel: Not yet supported")
-        elif rel.target_type == ReleaseTargetType.SNAPSHOT:
-            raise ValueError("snp: Not yet supported")
-
-    for rev_id in rev_ids:
-        all_revs.add(rev_id)
-        for rev_d in algo_RW.BFSRevisionsWalker(storage, rev_id, state=state):
-            all_revs.add(rev_d["id"])
-            dir_ids.add(rev_d["directory"])
-
-    for dir_id in dir_ids:
-        all_dirs.add(dir_id)
-        for direntry in algo_DI.dir_iterator(storage, dir_id):
-            if direntry["type"] == "dir":
-                all_dirs.add(direntry["target"])
-            elif direntry["type"] == "file":
-                all_cnts.add(direntry["target"])
-    stats["cnt"] = len(all_cnts)
-    stats["dir"] = len(all_dirs)
-    stats["rev"] = len(all_revs)
-    return stats
+    with GraphWalker(storage) as walker:
+        return walker.origin_stats(urls)
 
 
 def get_expected_stats(group_prefix):
@@ -230,49 +118,14 @@ def get_expected_stats(group_prefix):
         "enable.partition.eof": True,
     }
 
-    partitions = set()
-
-    def on_assign(cons, parts):
-        LOGGER.info("assignment %s", parts)
-        for p in parts:
-            partitions.add(p.partition)
-
     consumer = Consumer(cfg)
-    consumer.subscribe(["swh.test.objects.stats"], on_assign=on_assign)
-    stats = {}
     try:
-        while True:
-            msg = consumer.poll(timeout=10.0)
-            if msg is None:
-                if not partitions:
-                    break
-                continue
-            if msg.error():
-                if msg.error().name() == "_PARTITION_EOF":
-                    partitions.discard(msg.partition())
-                    if not partitions:
-                        break
-                else:
-                    raise KafkaException(msg.error())
-            else:
-                # Proper message
-                k = msgpack.unpackb(msg.key())
-                v = msgpack.unpackb(msg.value())
-                LOGGER.info(
-                    "%% %s [%d] at offset %d with key %s:\n",
-                    msg.topic(),
-                    msg.partition(),
-                    msg.offset(),
-                    k,
-                )
-                assert k == v["origin"]
-                stats[k] = v
+        return {v["origin"]: v for v in iter_stats(consumer, "swh.test.objects.stats")}
     except KeyboardInterrupt:
         assert False, "%% Aborted by user"
     finally:
         consumer.unsubscribe()
         consumer.close()
-    return stats
 
 
 def test_mirror(
@@ -297,45 +150,21 @@ def test_mirror(
 
     ########################
     # run replayer services
+    watcher = LogWatcher(docker_client)
     for service_name in replayer_services:
         service = docker_client.service.inspect(f"{mirror_stack}_{service_name}")
         LOGGER.info("Scale %s to %d", service.spec.name, SCALE)
         service.scale(SCALE)
-        wait_for_log_entry(
-            docker_client,
-            service,
-            "Starting the SWH mirror (graph|content) replayer",
-            SCALE,
+        watcher.expect(
+            service, "Starting the SWH mirror (graph|content) replayer", SCALE
         )
+    LOGGER.info("Replayers started: %s", watcher.wait(timeout=LOG_TIMEOUT))
 
-    group_prefix = mirror_stack._test_conf_template["group_id"]
-    cluster_name = mirror_stack._test_conf_template["cluster_name"]
-    kafka_api_url = f"{base_url}/kafka-ui/api/clusters/{cluster_name}"
-
-    def check_replayer_done(consumer_group):
-        # NOTE: probably need to check each partition, we could reach (?) a
-        # transient situation where the total lag is reported as 0 but there
-        # are missing partitions yet to be consumed from...
-        print(f"Waiting for {consumer_group} to be done...")
-        while True:
-            try:
-                cgroup = get(
-                    http_session, f"{kafka_api_url}/consumer-groups/{consumer_group}"
-                )
-                if cgroup["consumerLag"] == 0:
-                    break
-                print(f"{consumer_group} lag={cgroup['consumerLag']}")
-            except Exception as exc:
-                print("oops", exc)
-            time.sleep(5)
-
-    for grp_ext in (
-        "content",
-        "replayer-directory",
-        "replayer-content",
-        "replayer",
-    ):
-        check_replayer_done(f"{group_prefix}_{grp_ext}")
+    # wait for every partition of every replayer consumer group to be
+    # consumed up to its high watermark (the conf file has been generated from
+    # conf/replication-lag.yml.test in the current directory)
+    lag_monitor = replication_lag.from_config(config_read("conf/replication-lag.yml"))
+    lag_monitor.wait_done(interval=5, timeout=REPLICATION_TIMEOUT)
 
     origins = get(http_session, f"{api_url}/origins/")
     expected_stats = get_expected_stats(group_prefix=mirror_stack._test_group_prefix)
@@ -348,98 +177,54 @@ def test_mirror(
         assert len(origins) == len(expected_origins)
         assert sorted(o["url"] for o in origins) == expected_origins
 
+        t0 = time.monotonic()
+        all_stats = get_stats_from_storage(expected_origins, base_url)
+        LOGGER.info("took %.2fs", time.monotonic() - t0)
         for origin, expected in expected_stats.items():
             assert origin == expected["origin"]
-            t0 = time.monotonic()
-            origin_stats = get_stats_from_storage(origin, base_url)
+            origin_stats = all_stats[origin]
             LOGGER.info("%s", origin_stats)
-            LOGGER.info("took %.2fs", time.monotonic() - t0)
             assert origin_stats == expected
             LOGGER.info("%s is OK", origin)
 
     ########################
     # test the vault service
+    vault = VaultClient(http_session, api_url)
     cooks = []
     # first start all the cookings
     for origin in origins:
         LOGGER.info("Cook HEAD for %s", origin["url"])
-        visit = get(
-            http_session,
-            f"{api_url}/origin/{origin['url']}/visit/latest/?require_snapshot=true",
-        )
-        assert visit
-        snp = get(http_session, visit["snapshot_url"])
-        assert snp
-        branches = snp.get("branches", {})
-        head = branches.get("HEAD")
-        assert head
-
-        while True:
-            if head["target_type"] == "alias":
-                head = branches[head["target"]]
-            elif head["target_type"] == "release":
-                head = get(http_session, head["target_url"])
-            elif head["target_type"] == "directory":
-                swhid = f"swh:1:dir:{head['target']}"
-                break
-            elif head["target_type"] == "revision":
-                rev = get(http_session, head["target_url"])
-                swhid = f"swh:1:dir:{rev['directory']}"
-                break
-
+        swhid = vault.resolve_head(origin["url"])["dir"]
         LOGGER.info("Directory is %s", swhid)
-        cook = None
-        for i in range(3):
-            # for some reason, this sometimes fail with a NotFoundError so give
-            # it a bit of time...
-            try:
-                cook = post(http_session, f"{api_url}/vault/flat/{swhid}/")
-                break
-            except Exception as exc:
-                LOGGER.error(f"Could not start cooking {swhid} ({exc})")
-                time.sleep(2)
-
-        assert cook
+        cook = vault.cook("flat", swhid)
         assert cook["status"] in ("new", "pending")
         cooks.append((origin["url"], swhid, cook))
 
-    # then wait for successful cooks
-    while not all(cook["status"] == "done" for _, _, cook in cooks):
-        origin, swhid, cook = cooks.pop(0)
-        cook = get(http_session, f"{api_url}/vault/flat/{swhid}/")
-        cooks.append((origin, swhid, cook))
+    # then wait for successful cooks, polling each with a backoff
+    with ThreadPoolExecutor(len(cooks)) as pool:
+        cooks = list(
+            pool.map(
+                lambda c: (c[0], c[1], vault.wait("flat", c[1], timeout=1800)),
+                cooks,
+            )
+        )
     LOGGER.info("All origins have been cooked")
 
     # should all be in "done" status
+    storage = get_storage(cls="remote", url=f"{base_url}/storage-public")
     for origin, swhid, cook in cooks:
         LOGGER.info(f"Validating cooked directory for {origin} ({swhid})")
         assert cook["status"] == "done"
-        # so we can download it
-        tarfilecontent = get(http_session, cook["fetch_url"])
-        assert isinstance(tarfilecontent, bytes)
-        tarfileobj = tarfile.open(fileobj=BytesIO(tarfilecontent))
-        filelist = tarfileobj.getnames()
-        assert all(fname.startswith(swhid) for fname in filelist)
-        for path in filelist[1:]:
-            tarinfo = tarfileobj.getmember(path)
-            url = f"{api_url}/directory/{quote(path[10:])}/"
-            expected = get(http_session, url)  # remove the 'swh:1:dir:' part
-            LOGGER.debug("Retrieved from storage: %s → %s", url, expected)
-            if expected["type"] == "dir":
-                assert tarinfo.isdir()
-            elif expected["type"] == "file":
-                if expected["perms"] == 0o120000:
-                    assert tarinfo.issym()
-                    tgt = get(http_session, expected["target_url"])
-                    symlnk = get(http_session, tgt["data_url"])
-                    assert symlnk == tarinfo.linkpath.encode()
-                else:
-                    assert tarinfo.isfile()
-                    assert expected["length"] == tarinfo.size
-                    assert (
-                        sha1(tarfileobj.extractfile(tarinfo).read()).hexdigest()
-                        == expected["checksums"]["sha1"]
-                    )
+        # so we can download it, and check it as it is streamed against the
+        # recursive listing of the directory
+        manifest = directory_manifest(storage, swhid)
+        errors = []
+        size, _ = vault.fetch(
+            cook["fetch_url"],
+            lambda f: errors.extend(validate_flat_bundle(f, swhid, manifest)),
+        )
+        assert size
+        assert not errors
     LOGGER.info("All cooked origins have been validated")
 
     ########################
@@ -457,9 +242,11 @@ def test_mirror(
         f"Received a removal notification “{removal_id}”",
         f"Sending email “{subject}”",
     ]
+    watcher = LogWatcher(docker_client)
     for logentry in logentries:
         LOGGER.info("Waiting for log entry %s", logentry)
-        wait_for_log_entry(docker_client, service, logentry, with_stderr=True)
+        watcher.expect(service, logentry, with_stderr=True, regex=False)
+    watcher.wait(timeout=LOG_TIMEOUT)
 
     # check the notification email has been sent
     LOGGER.info("Checking expected email message has been sent")
@@ -486,7 +273,7 @@ def test_mirror(
     # check that the swh.core pypi package remains OK
     origin = "https://pypi.org/project/swh.core/"
     LOGGER.info(f"Checking swh-core pypi origin is still available ({origin})")
-    origin_stats = get_stats_from_storage(origin, base_url)
+    origin_stats = get_stats_from_storage([origin], base_url)[origin]
     assert origin_stats == expected_stats[origin]
 
     # TODO: respawn a pair of vault cooking to check both origins are handled
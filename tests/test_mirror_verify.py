@@ -0,0 +1,193 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import datetime
+import json
+
+from click.testing import CliRunner
+import mirror_verify
+import msgpack
+import pytest
+from swh.model.model import (
+    Content,
+    Directory,
+    DirectoryEntry,
+    ObjectType,
+    Origin,
+    OriginVisit,
+    OriginVisitStatus,
+    Person,
+    Release,
+    Revision,
+    RevisionType,
+    Snapshot,
+    SnapshotBranch,
+    SnapshotTargetType,
+    TimestampWithTimezone,
+)
+from swh.storage import get_storage
+
+DATE = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+AUTHOR = Person.from_fullname(b"Jane Doe <jdoe@example.org>")
+
+
+def add_origin(storage, url, snapshot):
+    storage.origin_add([Origin(url=url)])
+    (visit,) = storage.origin_visit_add(
+        [OriginVisit(origin=url, date=DATE, type="git")]
+    )
+    storage.origin_visit_status_add(
+        [
+            OriginVisitStatus(
+                origin=url,
+                visit=visit.visit,
+                date=DATE,
+                status="full",
+                snapshot=snapshot.id,
+            )
+        ]
+    )
+
+
+@pytest.fixture
+def storage():
+    """In-memory storage with two origins: one with a revision (two contents
+    and an empty subdirectory), and one with a release of that revision"""
+    storage = get_storage("memory")
+    contents = [Content.from_data(data) for data in (b"foo\n", b"bar\n")]
+    empty = Directory(entries=())
+    root = Directory(
+        entries=(
+            DirectoryEntry(
+                name=b"foo", type="file", target=contents[0].sha1_git, perms=0o100644
+            ),
+            DirectoryEntry(
+                name=b"bar", type="file", target=contents[1].sha1_git, perms=0o100644
+            ),
+            DirectoryEntry(name=b"sub", type="dir", target=empty.id, perms=0o040000),
+        )
+    )
+    date = TimestampWithTimezone.from_datetime(DATE)
+    revision = Revision(
+        message=b"initial",
+        author=AUTHOR,
+        committer=AUTHOR,
+        date=date,
+        committer_date=date,
+        type=RevisionType.GIT,
+        directory=root.id,
+        synthetic=False,
+    )
+    release = Release(
+        name=b"v1.0",
+        message=b"v1.0",
+        target=revision.id,
+        target_type=ObjectType.REVISION,
+        synthetic=False,
+        author=AUTHOR,
+        date=date,
+    )
+    snapshots = [
+        Snapshot(
+            branches={
+                b"refs/heads/main": SnapshotBranch(
+                    target=revision.id, target_type=SnapshotTargetType.REVISION
+                ),
+                b"HEAD": SnapshotBranch(
+                    target=b"refs/heads/main", target_type=SnapshotTargetType.ALIAS
+                ),
+            }
+        ),
+        Snapshot(
+            branches={
+                b"refs/tags/v1.0": SnapshotBranch(
+                    target=release.id, target_type=SnapshotTargetType.RELEASE
+                ),
+            }
+        ),
+    ]
+    storage.content_add(contents)
+    storage.directory_add([empty, root])
+    storage.revision_add([revision])
+    storage.release_add([release])
+    storage.snapshot_add(snapshots)
+    add_origin(storage, "https://example.org/repo", snapshots[0])
+    add_origin(storage, "https://example.org/tags", snapshots[1])
+    return storage
+
+
+def stats(origin, **counts):
+    return {
+        "origin": origin,
+        "visit": 1,
+        "release": 0,
+        "alias": 0,
+        "branch": 0,
+        "cnt": 0,
+        "dir": 0,
+        "rev": 0,
+        **counts,
+    }
+
+
+def run_verify(monkeypatch, storage, tmp_path, records, *args):
+    monkeypatch.setattr(mirror_verify, "get_storage", lambda **kwargs: storage)
+    dump = tmp_path / "stats.msgpack"
+    dump.write_bytes(b"".join(msgpack.packb(record) for record in records))
+    results = tmp_path / "results.jsonl"
+    result = CliRunner().invoke(
+        mirror_verify.main,
+        ["--from-dump", str(dump), "--results", str(results), *args],
+    )
+    with results.open() as f:
+        checked = {r["origin"]: r for r in map(json.loads, f)}
+    return result, checked
+
+
+def test_mirror_verify_from_dump(monkeypatch, storage, tmp_path):
+    repo = stats("https://example.org/repo", alias=1, branch=1, cnt=2, dir=2, rev=1)
+    tags = stats("https://example.org/tags", release=1, cnt=2, dir=2, rev=1)
+    records = [
+        repo,
+        # one content short on the mirror
+        {**tags, "cnt": 3},
+        # not replicated at all
+        stats("https://example.org/missing", cnt=1, dir=1, rev=1),
+    ]
+
+    result, checked = run_verify(monkeypatch, storage, tmp_path, records)
+
+    assert result.exit_code == 1
+    assert set(checked) == {record["origin"] for record in records}
+    assert checked[repo["origin"]]["ok"]
+    assert checked[repo["origin"]]["actual"] == repo
+    assert not checked[tags["origin"]]["ok"]
+    assert checked[tags["origin"]]["actual"] == tags
+    missing = checked["https://example.org/missing"]
+    assert not missing["ok"]
+    assert missing["error"] is None
+    assert missing["actual"] == stats("https://example.org/missing", visit=0)
+
+
+def test_mirror_verify_retry_failed(monkeypatch, storage, tmp_path):
+    repo = stats("https://example.org/repo", alias=1, branch=1, cnt=2, dir=2, rev=1)
+    tags = stats("https://example.org/tags", release=1, cnt=2, dir=2, rev=1)
+
+    result, checked = run_verify(
+        monkeypatch, storage, tmp_path, [repo, {**tags, "rev": 2}]
+    )
+    assert result.exit_code == 1
+    assert not checked[tags["origin"]]["ok"]
+
+    # origins already checked are skipped, unless they failed and are retried
+    result, checked = run_verify(monkeypatch, storage, tmp_path, [repo, tags])
+    assert result.exit_code == 0
+    assert not checked[tags["origin"]]["ok"]
+
+    result, checked = run_verify(
+        monkeypatch, storage, tmp_path, [repo, tags], "--retry-failed"
+    )
+    assert result.exit_code == 0, result.output
+    assert checked[tags["origin"]]["ok"]